@@ -0,0 +1,131 @@
+"""
+Замер пропускной способности одновременных обработчиков команд бота на базе SQLite
+
+Каждый обработчик получает пользователя, подписывает его на чат и затем 5 мс ждет сети
+(ответ пользователю). Сравниваются два способа работы с базой на одинаковом файле:
+
+- общая сессия: одна синхронная Session на все обработчики, как до перехода на asyncio;
+  запросы выполняются прямо в цикле событий и блокируют его;
+- сессия на задачу: функции src.database с отдельной AsyncSession на каждый обработчик.
+
+Кроме времени выводится наибольшая задержка цикла событий, которую увидела бы обработка
+обновлений Telegram во время замера.
+
+Запуск: python -m benchmarks.db_sessions [количество обработчиков]
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+from sqlalchemy import create_engine, event, select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+from src import database
+from src.config import DATABASE_POOL_SIZE
+from src.models import Base, ChatSubscription, User, UserSettings
+
+USERS = 100  # Обработчики приходят от ограниченного числа пользователей
+NETWORK_DELAY = 0.005
+
+
+async def watch_loop_lag(stop: asyncio.Event) -> float:
+    """Возвращает наибольшую задержку цикла событий (секунды), пока не выставлен stop"""
+    worst = 0.0
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(0.001)
+        worst = max(worst, time.perf_counter() - started - 0.001)
+    return worst
+
+
+async def measure(handler, count: int):
+    """Запускает count обработчиков одновременно и возвращает время и задержку цикла событий"""
+    stop = asyncio.Event()
+    watcher = asyncio.create_task(watch_loop_lag(stop))
+    started = time.perf_counter()
+    await asyncio.gather(*[handler(number) for number in range(count)])
+    elapsed = time.perf_counter() - started
+    stop.set()
+    return elapsed, await watcher
+
+
+async def shared_session(path: str, count: int):
+    """Одна синхронная сессия на все обработчики"""
+    engine = create_engine(f"sqlite:///{path}")
+    event.listen(engine, "connect", database._set_sqlite_pragmas)
+    db = Session(engine, autoflush=False)
+
+    async def handler(number: int):
+        telegram_id = number % USERS
+        user = db.scalars(select(User).where(User.telegram_id == telegram_id)).first()
+        if user is None:
+            user = User(telegram_id=telegram_id, first_name="Тест", settings=UserSettings())
+            db.add(user)
+            db.commit()
+
+        subscription = db.scalars(select(ChatSubscription).where(
+            ChatSubscription.user_id == user.id,
+            ChatSubscription.chat_id == number
+        )).first()
+        if subscription is None:
+            db.add(ChatSubscription(user_id=user.id, chat_id=number, chat_title="Чат", is_active=True))
+        db.commit()
+
+        await asyncio.sleep(NETWORK_DELAY)
+
+    try:
+        return await measure(handler, count)
+    finally:
+        db.close()
+        engine.dispose()
+
+
+async def session_per_task(path: str, count: int):
+    """Функции src.database с отдельной сессией на каждый обработчик"""
+    engine = create_async_engine(
+        f"sqlite+aiosqlite:///{path}",
+        poolclass=AsyncAdaptedQueuePool,
+        pool_size=DATABASE_POOL_SIZE,
+        max_overflow=0
+    )
+    event.listen(engine.sync_engine, "connect", database._set_sqlite_pragmas)
+    database.engine = engine
+    database.SessionLocal = async_sessionmaker(engine, autoflush=False, expire_on_commit=False)
+
+    async def handler(number: int):
+        async with database.get_session() as db:
+            user = await database.get_or_create_user(db, number % USERS, "Тест")
+            await database.subscribe_to_chat(db, user.id, number, "Чат")
+
+        await asyncio.sleep(NETWORK_DELAY)
+
+    try:
+        return await measure(handler, count)
+    finally:
+        await engine.dispose()
+
+
+async def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for name, run in (("общая сессия", shared_session), ("сессия на задачу", session_per_task)):
+            path = os.path.join(directory, f"{run.__name__}.db")
+            # Таблицы создаются заранее и не входят в замер
+            schema = create_engine(f"sqlite:///{path}")
+            Base.metadata.create_all(schema)
+            schema.dispose()
+            results[name] = await run(path, count)
+
+    print(f"{'способ':<20}{'обработчиков/с':>16}{'задержка цикла, мс':>20}")
+    for name, (elapsed, lag) in results.items():
+        print(f"{name:<20}{count / elapsed:>16.0f}{lag * 1000:>20.1f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
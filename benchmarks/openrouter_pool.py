@@ -0,0 +1,100 @@
+"""
+Замер задержки запросов к OpenRouter с сессией на каждый запрос и с общим пулом соединений
+
+Поднимает локальный HTTPS-сервер, отвечающий как chat/completions, и отправляет ему
+одинаковые последовательные запросы: сначала каждый через новую aiohttp.ClientSession
+(новые TCP- и TLS-соединения), затем через OpenRouterClient. Для сервера создается
+самоподписанный сертификат, поэтому нужна утилита openssl.
+
+Запуск: python -m benchmarks.openrouter_pool [количество запросов]
+"""
+import asyncio
+import os
+import socket
+import ssl
+import subprocess
+import sys
+import tempfile
+import time
+
+import aiohttp
+from aiohttp import web
+
+from src.utils.openrouter import OpenRouterClient
+
+HOST = "localhost"
+PAYLOAD = {"model": "benchmark/model", "messages": [{"role": "user", "content": "ping"}]}
+
+
+def make_certificate(directory: str):
+    """Создает самоподписанный сертификат сервера и возвращает пути к сертификату и ключу"""
+    cert, key = os.path.join(directory, "cert.pem"), os.path.join(directory, "key.pem")
+    subprocess.run(
+        ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+         "-keyout", key, "-out", cert, "-subj", f"/CN={HOST}", "-addext", f"subjectAltName=DNS:{HOST}"],
+        check=True, capture_output=True
+    )
+    return cert, key
+
+
+async def completions(request: web.Request) -> web.Response:
+    await request.json()
+    return web.json_response({"choices": [{"message": {"content": "pong"}}]})
+
+
+async def session_per_request(url: str, count: int) -> float:
+    """Прежний способ: новая сессия на каждый запрос"""
+    started = time.perf_counter()
+    for _ in range(count):
+        async with aiohttp.ClientSession() as session:
+            async with session.post(f"{url}/chat/completions", json=PAYLOAD) as response:
+                await response.json()
+    return time.perf_counter() - started
+
+
+async def pooled_client(url: str, count: int) -> float:
+    """Общий клиент с пулом соединений"""
+    client = OpenRouterClient("benchmark", url)
+    await client.start()
+    try:
+        started = time.perf_counter()
+        for _ in range(count):
+            await client.chat_completion(PAYLOAD)
+        return time.perf_counter() - started
+    finally:
+        await client.stop()
+
+
+async def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+
+    with tempfile.TemporaryDirectory() as directory:
+        cert, key = make_certificate(directory)
+        # Клиенты проверяют сертификат сервера как обычно, доверяя только ему
+        os.environ["SSL_CERT_FILE"] = cert
+
+        server_context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+        server_context.load_cert_chain(cert, key)
+        app = web.Application()
+        app.router.add_post("/api/v1/chat/completions", completions)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        sock = socket.create_server(("127.0.0.1", 0))
+        await web.SockSite(runner, sock, ssl_context=server_context).start()
+        url = f"https://{HOST}:{sock.getsockname()[1]}/api/v1"
+
+        try:
+            results = {
+                "сессия на запрос": await session_per_request(url, count),
+                "общий пул": await pooled_client(url, count),
+            }
+        finally:
+            await runner.cleanup()
+
+    print(f"{'способ':<20}{'мс/запрос':>12}")
+    for name, elapsed in results.items():
+        print(f"{name:<20}{elapsed / count * 1000:>12.2f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,74 @@
+"""
+Замер размера переписки, отправляемой модели, на синтетических чатах
+
+Сравнивает прежний формат строк ("[дд.мм чч:мм] Имя: текст") с компактным форматом
+из src.utils.transcript на одних и тех же сообщениях после предобработки.
+
+Запуск: python -m benchmarks.transcript [количество сообщений] [seed]
+"""
+import random
+import sys
+from datetime import datetime, timedelta
+
+import pytz
+
+from src.utils.preprocessing import TranscriptMessage, preprocess
+from src.utils.tokens import estimate_tokens
+from src.utils.transcript import build_transcript
+
+NAMES = [
+    "Александра Викторовна", "Борис Петров", "Виктория", "Григорий Сергеевич Иванов", "Дмитрий",
+    "Екатерина Смирнова", "Жанна", "Захар Кузнецов", "Ирина Павловна", "Константин",
+]
+WORDS = (
+    "релиз сервер база данных миграция тест деплой баг фича ревью продакшн логи метрика "
+    "пользователи дашборд очередь конфиг кэш индекс запрос ответ задача спринт"
+).split()
+
+# Профили чатов: участников, средняя пауза между сообщениями (секунды), длина сообщения (слов), доля ответов
+CHATS = {
+    "рабочий чат": (6, 40, (3, 20), 0.3),
+    "большая группа": (10, 10, (2, 12), 0.2),
+    "медленное обсуждение": (4, 600, (10, 60), 0.5),
+}
+
+
+def generate_chat(count: int, participants: int, pause: int, length, reply_share: float,
+                  rnd: random.Random):
+    """Генерирует сообщения синтетического чата"""
+    date = pytz.timezone("Europe/Moscow").localize(datetime(2026, 10, 1, 9, 0))
+    messages = []
+    for message_id in range(1, count + 1):
+        date += timedelta(seconds=rnd.randint(1, 2 * pause))
+        reply_to = None
+        if messages and rnd.random() < reply_share:
+            reply_to = rnd.choice(messages[-10:]).id
+        sender = rnd.randrange(participants)
+        text = " ".join(rnd.choice(WORDS) for _ in range(rnd.randint(*length)))
+        messages.append(TranscriptMessage(message_id, date, sender, NAMES[sender], text, reply_to))
+    return messages
+
+
+def plain_transcript(messages) -> str:
+    """Переписка в прежнем формате"""
+    return "".join(
+        f"[{message.date.strftime('%d.%m %H:%M')}] {message.sender_name}: {message.text}\n\n"
+        for message in messages
+    )
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    seed = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+
+    print(f"{'чат':<22}{'прежний':>10}{'компактный':>12}{'экономия':>10}")
+    for name, (participants, pause, length, reply_share) in CHATS.items():
+        messages = list(preprocess(generate_chat(count, participants, pause, length, reply_share,
+                                                 random.Random(seed))))
+        plain = estimate_tokens(plain_transcript(messages))
+        compact = estimate_tokens(build_transcript(messages).text())
+        print(f"{name:<22}{plain:>10}{compact:>12}{(plain - compact) / plain:>10.1%}")
+
+
+if __name__ == "__main__":
+    main()
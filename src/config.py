@@ -19,24 +19,202 @@ BOT_TOKEN = os.getenv("BOT_TOKEN")
 
 # Настройки OpenRouter
 OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
+OPENROUTER_API_URL = os.getenv("OPENROUTER_API_URL", "https://openrouter.ai/api/v1")
 DEFAULT_OPENROUTER_MODEL = "meta-llama/llama-3-70b-instruct"  # Модель по умолчанию
 
-# Список доступных моделей OpenRouter
+# Настройки HTTP-соединений с OpenRouter
+OPENROUTER_POOL_SIZE = int(os.getenv("OPENROUTER_POOL_SIZE", "32"))  # Максимум одновременных соединений
+OPENROUTER_KEEPALIVE = float(os.getenv("OPENROUTER_KEEPALIVE", "60"))  # Время жизни простаивающего соединения (секунды)
+OPENROUTER_DNS_CACHE_TTL = int(os.getenv("OPENROUTER_DNS_CACHE_TTL", "300"))  # Время кэширования DNS (секунды)
+OPENROUTER_CONNECT_TIMEOUT = float(os.getenv("OPENROUTER_CONNECT_TIMEOUT", "10"))  # Таймаут подключения (секунды)
+OPENROUTER_READ_TIMEOUT = float(os.getenv("OPENROUTER_READ_TIMEOUT", "120"))  # Таймаут чтения ответа (секунды)
+
+# Псевдо-модель, для которой модель выбирается по размеру переписки, скорости и ошибкам моделей
+AUTO_MODEL = "auto"
+
+# Список доступных моделей OpenRouter с их параметрами:
+# name - отображаемое название, context_length - размер контекста в токенах,
+# max_output_tokens - максимальная длина ответа в токенах,
+# chunk_tokens - размер фрагмента переписки при иерархической саммаризации,
+# fan_out - сколько фрагментов обрабатывается параллельно.
+# У псевдо-модели auto только название: бюджеты считаются по модели, которую выбрал автовыбор
 AVAILABLE_MODELS = {
-    "meta-llama/llama-3-70b-instruct": "Llama 3 70B (рекомендуется)",
-    "meta-llama/llama-3-8b-instruct": "Llama 3 8B (быстрее)",
-    "anthropic/claude-3-opus-20240229": "Claude 3 Opus (высокое качество)",
-    "anthropic/claude-3-sonnet-20240229": "Claude 3 Sonnet (баланс)",
-    "anthropic/claude-3-haiku-20240307": "Claude 3 Haiku (быстрее)",
-    "google/gemini-1.5-pro-latest": "Gemini 1.5 Pro",
-    "mistralai/mixtral-8x7b-instruct": "Mixtral 8x7B",
-    "mistralai/mistral-7b-instruct": "Mistral 7B (быстрее)",
-    "openai/gpt-4o": "GPT-4o",
-    "openai/gpt-3.5-turbo": "GPT-3.5 Turbo (быстрее)",
+    AUTO_MODEL: {
+        "name": "Автовыбор (быстрые модели для небольших чатов)",
+    },
+    "meta-llama/llama-3-70b-instruct": {
+        "name": "Llama 3 70B (рекомендуется)",
+        "context_length": 8192, "max_output_tokens": 4096, "chunk_tokens": 5000, "fan_out": 4,
+    },
+    "meta-llama/llama-3-8b-instruct": {
+        "name": "Llama 3 8B (быстрее)",
+        "context_length": 8192, "max_output_tokens": 4096, "chunk_tokens": 5000, "fan_out": 8,
+    },
+    "anthropic/claude-3-opus-20240229": {
+        "name": "Claude 3 Opus (высокое качество)",
+        "context_length": 200000, "max_output_tokens": 4096, "chunk_tokens": 24000, "fan_out": 4,
+    },
+    "anthropic/claude-3-sonnet-20240229": {
+        "name": "Claude 3 Sonnet (баланс)",
+        "context_length": 200000, "max_output_tokens": 4096, "chunk_tokens": 24000, "fan_out": 6,
+    },
+    "anthropic/claude-3-haiku-20240307": {
+        "name": "Claude 3 Haiku (быстрее)",
+        "context_length": 200000, "max_output_tokens": 4096, "chunk_tokens": 24000, "fan_out": 8,
+    },
+    "google/gemini-1.5-pro-latest": {
+        "name": "Gemini 1.5 Pro",
+        "context_length": 1000000, "max_output_tokens": 8192, "chunk_tokens": 32000, "fan_out": 4,
+    },
+    "mistralai/mixtral-8x7b-instruct": {
+        "name": "Mixtral 8x7B",
+        "context_length": 32768, "max_output_tokens": 4096, "chunk_tokens": 16000, "fan_out": 6,
+    },
+    "mistralai/mistral-7b-instruct": {
+        "name": "Mistral 7B (быстрее)",
+        "context_length": 32768, "max_output_tokens": 4096, "chunk_tokens": 16000, "fan_out": 8,
+    },
+    "openai/gpt-4o": {
+        "name": "GPT-4o",
+        "context_length": 128000, "max_output_tokens": 4096, "chunk_tokens": 24000, "fan_out": 6,
+    },
+    "openai/gpt-3.5-turbo": {
+        "name": "GPT-3.5 Turbo (быстрее)",
+        "context_length": 16385, "max_output_tokens": 4096, "chunk_tokens": 10000, "fan_out": 8,
+    },
 }
 
+# Повторы запросов к OpenRouter и резервные модели
+OPENROUTER_MAX_RETRIES = int(os.getenv("OPENROUTER_MAX_RETRIES", "3"))  # Повторов запроса к одной модели
+OPENROUTER_BACKOFF_BASE = float(os.getenv("OPENROUTER_BACKOFF_BASE", "1"))  # Базовая пауза перед повтором (секунды)
+OPENROUTER_BACKOFF_MAX = float(os.getenv("OPENROUTER_BACKOFF_MAX", "30"))  # Максимальная пауза перед повтором (секунды)
+OPENROUTER_MAX_RETRY_AFTER = float(os.getenv("OPENROUTER_MAX_RETRY_AFTER", "60"))  # Более долгий Retry-After - сразу к резервной модели
+OPENROUTER_BREAKER_THRESHOLD = int(os.getenv("OPENROUTER_BREAKER_THRESHOLD", "5"))  # Ошибок подряд до отключения модели
+OPENROUTER_BREAKER_RESET = float(os.getenv("OPENROUTER_BREAKER_RESET", "60"))  # Через сколько секунд пробовать модель снова
+# Резервные модели из AVAILABLE_MODELS в порядке приоритета, через запятую
+OPENROUTER_FALLBACK_MODELS = [
+    model.strip()
+    for model in os.getenv(
+        "OPENROUTER_FALLBACK_MODELS",
+        "anthropic/claude-3-haiku-20240307,openai/gpt-3.5-turbo,meta-llama/llama-3-8b-instruct"
+    ).split(",")
+    if model.strip() in AVAILABLE_MODELS and model.strip() != AUTO_MODEL
+]
+
+# Автоматический выбор модели
+# Модели для небольших окон и для больших окон из AVAILABLE_MODELS, через запятую
+AUTO_FAST_MODELS = [
+    model.strip()
+    for model in os.getenv(
+        "AUTO_FAST_MODELS",
+        "meta-llama/llama-3-8b-instruct,anthropic/claude-3-haiku-20240307,openai/gpt-3.5-turbo"
+    ).split(",")
+    if model.strip() in AVAILABLE_MODELS and model.strip() != AUTO_MODEL
+]
+AUTO_QUALITY_MODELS = [
+    model.strip()
+    for model in os.getenv(
+        "AUTO_QUALITY_MODELS",
+        "anthropic/claude-3-sonnet-20240229,openai/gpt-4o,meta-llama/llama-3-70b-instruct"
+    ).split(",")
+    if model.strip() in AVAILABLE_MODELS and model.strip() != AUTO_MODEL
+]
+AUTO_SMALL_WINDOW_TOKENS = int(os.getenv("AUTO_SMALL_WINDOW_TOKENS", "3000"))  # Окна до этого размера - быстрым моделям
+AUTO_STATS_ALPHA = float(os.getenv("AUTO_STATS_ALPHA", "0.2"))  # Вес нового запроса в скользящих средних задержки и ошибок
+AUTO_EXPLORE_RATE = float(os.getenv("AUTO_EXPLORE_RATE", "0.05"))  # Доля запросов к случайной подходящей модели для обновления ее статистики
+AUTO_ERROR_PENALTY = float(os.getenv("AUTO_ERROR_PENALTY", "5"))  # Во сколько раз доля ошибок увеличивает ожидаемую задержку
+
+# Максимальная длина саммари в токенах (ограничивается также max_output_tokens модели)
+SUMMARY_MAX_TOKENS = int(os.getenv("SUMMARY_MAX_TOKENS", "1000"))
+
+# Доля контекста, которая остается в запасе на погрешность локальной оценки токенов
+TOKEN_SAFETY_MARGIN = float(os.getenv("TOKEN_SAFETY_MARGIN", "0.1"))
+
+# Настройки загрузки сообщений из чатов
+INGEST_PAGE_SIZE = int(os.getenv("INGEST_PAGE_SIZE", "100"))  # Размер страницы при обходе истории
+INGEST_MAX_MESSAGES = int(os.getenv("INGEST_MAX_MESSAGES", "5000"))  # Максимум сообщений за одно саммари
+INGEST_MAX_BYTES = int(os.getenv("INGEST_MAX_BYTES", "1000000"))  # Максимум байт текста за одно саммари
+
+# Настройки кэша отправителей сообщений
+SENDER_CACHE_SIZE = int(os.getenv("SENDER_CACHE_SIZE", "10000"))  # Максимум имен в памяти
+SENDER_CACHE_TTL = int(os.getenv("SENDER_CACHE_TTL", "86400"))  # Время жизни имени в памяти (секунды)
+
+# Настройки кэша пользователей бота
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))  # Максимум пользователей в памяти
+USER_CACHE_TTL = int(os.getenv("USER_CACHE_TTL", "3600"))  # Время жизни пользователя в памяти (секунды)
+USER_FLUSH_INTERVAL = float(os.getenv("USER_FLUSH_INTERVAL", "5"))  # Период записи изменившихся профилей (секунды)
+
+# Настройки локального хранилища сообщений
+MESSAGE_STORE_ENABLED = os.getenv("MESSAGE_STORE_ENABLED", "true").lower() == "true"
+MESSAGE_SYNC_CONCURRENCY = int(os.getenv("MESSAGE_SYNC_CONCURRENCY", "4"))  # Чатов, пропуски которых догружаются одновременно
+
+# Ограничения параллельной генерации саммари
+SUMMARY_CONCURRENCY = int(os.getenv("SUMMARY_CONCURRENCY", "8"))  # Одновременно обрабатываемых чатов всего
+SUMMARY_USER_CONCURRENCY = int(os.getenv("SUMMARY_USER_CONCURRENCY", "4"))  # ... для одного пользователя
+
+# Предобработка переписки перед саммаризацией
+# Этапы по умолчанию через запятую: service, trivial, whitespace, urls, duplicates, truncate
+PREPROCESS_STAGES = [
+    stage.strip()
+    for stage in os.getenv("PREPROCESS_STAGES", "service,trivial,whitespace,urls,duplicates,truncate").split(",")
+    if stage.strip()
+]
+PREPROCESS_MAX_MESSAGE_CHARS = int(os.getenv("PREPROCESS_MAX_MESSAGE_CHARS", "1500"))  # Длиннее сообщения обрезаются
+
+# Инкрементальные саммари: передается только новая переписка и сохраненное состояние чата
+# Частоты доставки через запятую, для которых саммари строятся инкрементально
+INCREMENTAL_FREQUENCIES = [
+    frequency.strip()
+    for frequency in os.getenv("INCREMENTAL_FREQUENCIES", "hourly").split(",")
+    if frequency.strip()
+]
+SUMMARY_STATE_REFRESH_RUNS = int(os.getenv("SUMMARY_STATE_REFRESH_RUNS", "24"))  # Через сколько обновлений состояние строится заново
+SUMMARY_STATE_MAX_AGE = int(os.getenv("SUMMARY_STATE_MAX_AGE", "86400"))  # Состояние старше этого не используется (секунды)
+
+# Настройки кэша саммари
+SUMMARY_CACHE_TTL = int(os.getenv("SUMMARY_CACHE_TTL", "604800"))  # Время жизни записи (секунды)
+SUMMARY_CACHE_MAX_ENTRIES = int(os.getenv("SUMMARY_CACHE_MAX_ENTRIES", "10000"))  # Максимум записей
+
+# Хранение истории саммари
+SUMMARY_ARCHIVE_AFTER_DAYS = int(os.getenv("SUMMARY_ARCHIVE_AFTER_DAYS", "30"))  # Через сколько дней саммари сжимаются и переносятся в архив
+SUMMARY_RETENTION_DAYS = int(os.getenv("SUMMARY_RETENTION_DAYS", "365"))  # Через сколько дней саммари удаляются (0 - хранить всегда)
+SUMMARY_ARCHIVE_BATCH_SIZE = int(os.getenv("SUMMARY_ARCHIVE_BATCH_SIZE", "500"))  # Саммари, переносимых в архив одной транзакцией
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", "3"))  # Саммари на одной странице /history
+
+# Настройки планировщика доставки
+SCHEDULER_POLL_INTERVAL = int(os.getenv("SCHEDULER_POLL_INTERVAL", "5"))  # Период опроса задач (секунды)
+SCHEDULER_HORIZON = int(os.getenv("SCHEDULER_HORIZON", "60"))  # На сколько вперед выбирать задачи (секунды)
+SCHEDULER_BATCH_SIZE = int(os.getenv("SCHEDULER_BATCH_SIZE", "1000"))  # Максимум задач за один опрос
+
+# Настройки очереди доставки сообщений бота (лимиты Telegram Bot API)
+DELIVERY_GLOBAL_RATE = float(os.getenv("DELIVERY_GLOBAL_RATE", "30"))  # Сообщений в секунду всего
+DELIVERY_CHAT_RATE = float(os.getenv("DELIVERY_CHAT_RATE", "1"))  # Сообщений в секунду в один чат
+DELIVERY_PREPARE_JITTER = int(os.getenv("DELIVERY_PREPARE_JITTER", "0"))  # Раньше скольких секунд до доставки можно начинать генерацию
+SUMMARY_STREAMING = os.getenv("SUMMARY_STREAMING", "true").lower() == "true"  # Показывать саммари /summary по мере генерации
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", "1.5"))  # Минимальный интервал правок одного сообщения (секунды)
+
+# Ограничение частоты запросов клиента Telegram (MTProto)
+MTPROTO_RATE = float(os.getenv("MTPROTO_RATE", "3"))  # Максимум запросов в секунду для одного метода API
+MTPROTO_MIN_RATE = float(os.getenv("MTPROTO_MIN_RATE", "0.1"))  # Нижняя граница скорости после FloodWait
+MTPROTO_RATE_RECOVERY = float(os.getenv("MTPROTO_RATE_RECOVERY", "0.02"))  # Прибавка к скорости за успешный запрос
+MTPROTO_FLOOD_BACKOFF = float(os.getenv("MTPROTO_FLOOD_BACKOFF", "0.5"))  # Множитель скорости после FloodWait
+MTPROTO_MAX_FLOOD_WAIT = int(os.getenv("MTPROTO_MAX_FLOOD_WAIT", "600"))  # Более долгие FloodWait не ожидаются (секунды)
+
+# Постоянная очередь задач генерации саммари
+SUMMARY_WORKERS = int(os.getenv("SUMMARY_WORKERS", "4"))  # Количество обработчиков очереди
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "2"))  # Период опроса очереди (секунды)
+JOB_LEASE_TIMEOUT = int(os.getenv("JOB_LEASE_TIMEOUT", "300"))  # Через сколько секунд задачу без продления заберет другой обработчик
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))  # Попыток выполнения задачи
+JOB_RETRY_DELAY = int(os.getenv("JOB_RETRY_DELAY", "30"))  # Пауза перед повтором задачи (секунды)
+JOB_BATCH_SIZE = int(os.getenv("JOB_BATCH_SIZE", "50"))  # Сколько задач доставки по расписанию обрабатывать вместе
+JOB_RETENTION = int(os.getenv("JOB_RETENTION", "86400"))  # Сколько хранить завершенные задачи (секунды)
+
 # Настройки для БД
-DATABASE_URL = f"sqlite:///{DATA_DIR}/tg_summary.db"
+DATABASE_URL = f"sqlite+aiosqlite:///{DATA_DIR}/tg_summary.db"
+DATABASE_POOL_SIZE = int(os.getenv("DATABASE_POOL_SIZE", "5"))  # Соединений с базой (больше - только больше ожидания блокировок)
+DATABASE_BUSY_TIMEOUT = float(os.getenv("DATABASE_BUSY_TIMEOUT", "30"))  # Ожидание блокировки записи (секунды)
+DATABASE_MMAP_SIZE = int(os.getenv("DATABASE_MMAP_SIZE", str(256 * 1024 * 1024)))  # Сколько байт файла читать через mmap (0 - не использовать)
+DATABASE_CACHE_SIZE = int(os.getenv("DATABASE_CACHE_SIZE", str(64 * 1024)))  # Кэш страниц на соединение (КиБ)
 
 # Настройки временной зоны
 TIMEZONE = pytz.timezone(os.getenv("TIMEZONE", "UTC"))
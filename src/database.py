@@ -1,38 +1,190 @@
-from sqlalchemy import create_engine
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy.orm import Session
-from datetime import datetime
-
-from src.config import DATABASE_URL, DEFAULT_OPENROUTER_MODEL
-from src.models import User, UserSettings, ChatSubscription, Summary, Base
+from sqlalchemy import and_, delete, event, func, inspect, or_, select, tuple_, update
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import joinedload, selectinload
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+import functools
+import zlib
+from datetime import datetime, timedelta
+import pytz
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+from src.config import (
+    DATABASE_URL, DATABASE_POOL_SIZE, DATABASE_BUSY_TIMEOUT, DATABASE_MMAP_SIZE, DATABASE_CACHE_SIZE,
+    DEFAULT_OPENROUTER_MODEL, SUMMARY_CACHE_TTL, SUMMARY_CACHE_MAX_ENTRIES
+)
+from src.models import (
+    User, UserSettings, ChatSubscription, Summary, Sender, StoredMessage, ChatSyncState,
+    SummaryCacheEntry, ScheduledJob, SummaryJob, ArchivedSummary, SubscriptionPreprocessing, SummaryState, Base
+)
+from src.utils.delivery_schedule import get_next_run_at
 from src.utils.logger import logger
 
-# Настройка базы данных
-engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Настройка базы данных: единственный движок процесса.
+# Для файлов SQLite aiosqlite по умолчанию открывает новое соединение (и поток) на каждую
+# сессию, поэтому соединения берутся из небольшого пула. SQLite все равно пишет в один
+# поток, а одновременные записи из разных соединений ждут друг друга до DATABASE_BUSY_TIMEOUT секунд.
+engine = create_async_engine(
+    DATABASE_URL,
+    poolclass=AsyncAdaptedQueuePool,
+    pool_size=DATABASE_POOL_SIZE,
+    max_overflow=0
+)
+
+
+@event.listens_for(engine.sync_engine, "connect")
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    """
+    Настраивает каждое новое соединение SQLite
+    
+    WAL позволяет читать во время записи, а с synchronous=NORMAL коммит не ждет fsync
+    (данные могут потеряться только при падении ОС, но не процесса). mmap_size и cache_size
+    действуют на соединение, поэтому задаются здесь, а не один раз для файла.
+    """
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA busy_timeout={int(DATABASE_BUSY_TIMEOUT * 1000)}")
+    cursor.execute(f"PRAGMA mmap_size={DATABASE_MMAP_SIZE}")
+    # Отрицательное значение cache_size задает размер в КиБ, а не в страницах
+    cursor.execute(f"PRAGMA cache_size=-{DATABASE_CACHE_SIZE}")
+    cursor.close()
 
 
-def create_tables():
+# Объекты не сбрасываются после commit: сессия живет одну задачу, а отложенная
+# загрузка атрибутов в асинхронном режиме невозможна
+SessionLocal = async_sessionmaker(engine, autoflush=False, expire_on_commit=False)
+
+
+async def create_tables():
     """Создает таблицы в базе данных"""
     try:
-        Base.metadata.create_all(bind=engine)
+        async with engine.begin() as conn:
+            jobs_exist = await conn.run_sync(
+                lambda sync_conn: inspect(sync_conn).has_table(ScheduledJob.__tablename__)
+            )
+            archive_exists = await conn.run_sync(
+                lambda sync_conn: inspect(sync_conn).has_table(ArchivedSummary.__tablename__)
+            )
+            await conn.run_sync(Base.metadata.create_all)
+            if archive_exists:
+                await conn.run_sync(_add_archive_summary_id)
+        await _create_missing_indexes()
         logger.info("Таблицы базы данных созданы успешно")
+        
+        if not jobs_exist:
+            await _backfill_scheduled_jobs()
+            
+        if not archive_exists:
+            await _purge_error_summaries()
     except Exception as e:
         logger.error(f"Ошибка при создании таблиц: {str(e)}")
         raise
 
 
-def get_db():
-    """Возвращает сессию базы данных"""
-    db = SessionLocal()
-    try:
-        return db
-    finally:
-        db.close()
+# Индексы прежних версий, которые заменены индексами моделей
+_REPLACED_INDEXES = ("ix_summary_jobs_user_id_status", "ix_summaries_archive_subscription_id_created_at")
+
 
+async def _create_missing_indexes():
+    """
+    Создает индексы, добавленные в модели после создания таблиц
+    
+    create_all создает индексы только вместе с новыми таблицами, поэтому индексы
+    существующих таблиц создаются отдельно. Уникальный индекс, который не удается создать
+    из-за дубликатов в старых данных, пропускается с предупреждением. Индексы, замененные
+    другими, удаляются.
+    """
+    async with engine.begin() as conn:
+        for name in _REPLACED_INDEXES:
+            await conn.exec_driver_sql(f"DROP INDEX IF EXISTS {name}")
+            
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            try:
+                async with engine.begin() as conn:
+                    await conn.run_sync(index.create, checkfirst=True)
+            except IntegrityError as e:
+                logger.warning(f"Не удалось создать индекс {index.name}: {str(e)}")
 
-def get_or_create_user(db: Session, telegram_id: int, first_name: str, last_name: str = None, username: str = None) -> User:
+
+def _add_archive_summary_id(sync_conn):
+    """
+    Добавляет в архив саммари колонку summary_id, появившуюся после создания таблицы
+    
+    Прежде ID архивной записи совпадал с ID саммари, поэтому для старых записей он и переносится.
+    """
+    columns = {column["name"] for column in inspect(sync_conn).get_columns(ArchivedSummary.__tablename__)}
+    if "summary_id" not in columns:
+        sync_conn.exec_driver_sql(f"ALTER TABLE {ArchivedSummary.__tablename__} ADD COLUMN summary_id INTEGER")
+        sync_conn.execute(update(ArchivedSummary).values(summary_id=ArchivedSummary.id))
+        logger.info("В архив саммари добавлена колонка summary_id")
+
+
+async def _backfill_scheduled_jobs():
+    """Однократно планирует доставку для пользователей, созданных до появления таблицы scheduled_jobs"""
+    async with get_session() as db:
+        settings_list = (await db.scalars(select(UserSettings))).all()
+        for settings in settings_list:
+            await _schedule_delivery(db, settings)
+        await db.commit()
+        logger.info(f"Запланирована доставка для {len(settings_list)} существующих пользователей")
+
+
+# Тексты ошибок, которые прежние версии сохраняли в таблицу summaries вместо саммари
+_LEGACY_ERROR_PREFIXES = ("Ошибка генерации саммари:", "Не удалось сгенерировать саммари:")
+
+
+async def _purge_error_summaries():
+    """Однократно удаляет тексты ошибок, сохраненные прежними версиями как саммари, до их переноса в архив"""
+    async with get_session() as db:
+        result = await db.execute(
+            delete(Summary)
+            .where(or_(*[Summary.content.startswith(prefix) for prefix in _LEGACY_ERROR_PREFIXES]))
+            .execution_options(synchronize_session=False)
+        )
+        await db.commit()
+        if result.rowcount:
+            logger.info(f"Удалено сохраненных как саммари ошибок: {result.rowcount}")
+
+
+def get_session() -> AsyncSession:
+    """
+    Создает сессию базы данных для одной задачи
+    
+    Сессию нельзя использовать из нескольких корутин одновременно, поэтому каждый
+    обработчик и каждая задача открывают свою: `async with get_session() as db: ...`
+    
+    Returns:
+        AsyncSession: Новая сессия
+    """
+    return SessionLocal()
+
+
+def with_session(handler: Callable[..., Awaitable]) -> Callable[..., Awaitable]:
+    """
+    Декоратор обработчика: каждый вызов получает собственную сессию в аргументе db
+    
+    Args:
+        handler: Корутина, принимающая сессию в именованном аргументе db
+        
+    Returns:
+        Callable[..., Awaitable]: Обработчик без аргумента db
+    """
+    @functools.wraps(handler)
+    async def wrapper(*args, **kwargs):
+        async with get_session() as db:
+            return await handler(*args, db=db, **kwargs)
+    return wrapper
+
+
+async def dispose_engine():
+    """Закрывает соединения с базой данных"""
+    await engine.dispose()
+
+
+async def get_or_create_user(db: AsyncSession, telegram_id: int, first_name: str, last_name: str = None, username: str = None) -> User:
     """
     Получает или создает пользователя в базе данных
     
@@ -46,36 +198,130 @@ def get_or_create_user(db: Session, telegram_id: int, first_name: str, last_name
     Returns:
         User: Объект пользователя
     """
-    user = db.query(User).filter(User.telegram_id == telegram_id).first()
+    user = await get_user_by_telegram_id(db, telegram_id)
     
     if user:
-        # Обновляем существующего пользователя
-        user.first_name = first_name
-        user.last_name = last_name
-        user.username = username
-        db.commit()
+        # Обновляем существующего пользователя, только если профиль изменился
+        if (user.first_name, user.last_name, user.username) != (first_name, last_name, username):
+            user.first_name = first_name
+            user.last_name = last_name
+            user.username = username
+            await db.commit()
         return user
         
-    # Создаем нового пользователя
+    # Создаем нового пользователя с настройками по умолчанию и планируем первую доставку
     user = User(
         telegram_id=telegram_id,
         first_name=first_name,
         last_name=last_name,
-        username=username
+        username=username,
+        chats=[],
+        settings=UserSettings()
     )
     db.add(user)
-    db.commit()
-    db.refresh(user)
-    
-    # Создаем настройки по умолчанию
-    settings = UserSettings(user_id=user.id)
-    db.add(settings)
-    db.commit()
+    try:
+        await db.flush()
+    except IntegrityError:
+        # Пользователя одновременно создал другой обработчик
+        await db.rollback()
+        return await get_or_create_user(db, telegram_id, first_name, last_name, username)
+        
+    await _schedule_delivery(db, user.settings)
+    await db.commit()
     
     return user
 
 
-def subscribe_to_chat(db: Session, user_id: int, chat_id: int, chat_title: str) -> ChatSubscription:
+async def get_user_by_telegram_id(db: AsyncSession, telegram_id: int) -> Optional[User]:
+    """
+    Получает пользователя по ID в Telegram вместе с подписками и настройками
+    
+    Args:
+        db: Сессия базы данных
+        telegram_id: ID пользователя в Telegram
+        
+    Returns:
+        Optional[User]: Пользователь или None, если его нет
+    """
+    return (await db.scalars(
+        select(User).options(*_user_relations()).where(User.telegram_id == telegram_id)
+    )).first()
+
+
+async def get_summary_users(db: AsyncSession, user_ids: List[int], active_only: bool = True) -> List[User]:
+    """
+    Получает пользователей с настройками и активными подписками для генерации саммари
+    
+    Выполняет два запроса независимо от количества пользователей: пользователи вместе
+    с настройками и активные подписки всех пользователей. В user.chats попадают только
+    активные подписки.
+    
+    Args:
+        db: Сессия базы данных
+        user_ids: ID пользователей
+        active_only: Пропускать отключенных пользователей
+        
+    Returns:
+        List[User]: Найденные пользователи
+    """
+    stmt = select(User).options(*_user_relations(active_chats_only=True)).where(User.id.in_(user_ids))
+    if active_only:
+        stmt = stmt.where(User.is_active == True)
+        
+    return (await db.scalars(stmt)).all()
+
+
+async def get_active_user_settings(db: AsyncSession, user_ids: List[int]) -> Dict[int, UserSettings]:
+    """
+    Получает настройки активных пользователей одним запросом
+    
+    Args:
+        db: Сессия базы данных
+        user_ids: ID пользователей
+        
+    Returns:
+        Dict[int, UserSettings]: Настройки по ID пользователя
+    """
+    return {
+        settings.user_id: settings
+        for settings in await db.scalars(select(UserSettings).join(User).where(
+            UserSettings.user_id.in_(user_ids),
+            User.is_active == True
+        ))
+    }
+
+
+def _user_relations(active_chats_only: bool = False) -> tuple:
+    """
+    Параметры загрузки пользователя: настройки в том же запросе, подписки - одним
+    дополнительным запросом на всех загружаемых пользователей
+    
+    Args:
+        active_chats_only: Загружать только активные подписки
+        
+    Returns:
+        tuple: Параметры для select(User).options
+    """
+    chats = User.chats.and_(ChatSubscription.is_active == True) if active_chats_only else User.chats
+    return joinedload(User.settings), selectinload(chats)
+
+
+async def save_user_profiles(db: AsyncSession, profiles: Dict[int, Dict[str, Optional[str]]]) -> None:
+    """
+    Записывает изменившиеся профили пользователей одной транзакцией
+    
+    Args:
+        db: Сессия базы данных
+        profiles: Поля first_name, last_name и username по ID пользователя
+    """
+    if not profiles:
+        return
+        
+    await db.execute(update(User), [dict(profile, id=user_id) for user_id, profile in profiles.items()])
+    await db.commit()
+
+
+async def subscribe_to_chat(db: AsyncSession, user_id: int, chat_id: int, chat_title: str) -> ChatSubscription:
     """
     Подписывает пользователя на чат
     
@@ -89,16 +335,16 @@ def subscribe_to_chat(db: Session, user_id: int, chat_id: int, chat_title: str)
         ChatSubscription: Объект подписки на чат
     """
     # Проверяем существующую подписку
-    subscription = db.query(ChatSubscription).filter(
+    subscription = (await db.scalars(select(ChatSubscription).where(
         ChatSubscription.user_id == user_id,
         ChatSubscription.chat_id == chat_id
-    ).first()
+    ))).first()
     
     if subscription:
         # Если подписка существует, активируем ее и обновляем название
         subscription.is_active = True
         subscription.chat_title = chat_title
-        db.commit()
+        await db.commit()
         return subscription
         
     # Создаем новую подписку
@@ -109,13 +355,17 @@ def subscribe_to_chat(db: Session, user_id: int, chat_id: int, chat_title: str)
         is_active=True
     )
     db.add(subscription)
-    db.commit()
-    db.refresh(subscription)
-    
+    try:
+        await db.commit()
+    except IntegrityError:
+        # Подписку одновременно создал другой обработчик (индекс по user_id и chat_id уникален)
+        await db.rollback()
+        return await subscribe_to_chat(db, user_id, chat_id, chat_title)
+        
     return subscription
 
 
-def unsubscribe_from_chat(db: Session, user_id: int, chat_id: int) -> bool:
+async def unsubscribe_from_chat(db: AsyncSession, user_id: int, chat_id: int) -> bool:
     """
     Отписывает пользователя от чата
     
@@ -127,22 +377,22 @@ def unsubscribe_from_chat(db: Session, user_id: int, chat_id: int) -> bool:
     Returns:
         bool: True если операция успешна, иначе False
     """
-    subscription = db.query(ChatSubscription).filter(
+    subscription = (await db.scalars(select(ChatSubscription).where(
         ChatSubscription.user_id == user_id,
         ChatSubscription.chat_id == chat_id
-    ).first()
+    ))).first()
     
     if not subscription:
         return False
         
     subscription.is_active = False
-    db.commit()
+    await db.commit()
     return True
 
 
-def update_user_settings(db: Session, user_id: int, delivery_time: str = None, 
-                         delivery_frequency: str = None, timezone: str = None,
-                         openrouter_model: str = None) -> UserSettings:
+async def update_user_settings(db: AsyncSession, user_id: int, delivery_time: str = None, 
+                               delivery_frequency: str = None, timezone: str = None,
+                               openrouter_model: str = None) -> UserSettings:
     """
     Обновляет настройки пользователя
     
@@ -150,14 +400,14 @@ def update_user_settings(db: Session, user_id: int, delivery_time: str = None,
         db: Сессия базы данных
         user_id: ID пользователя
         delivery_time: Время доставки (формат HH:MM)
-        delivery_frequency: Частота доставки (daily, weekly)
+        delivery_frequency: Частота доставки (hourly, daily, weekly)
         timezone: Временная зона
         openrouter_model: Модель OpenRouter
         
     Returns:
         UserSettings: Обновленные настройки пользователя
     """
-    settings = db.query(UserSettings).filter(UserSettings.user_id == user_id).first()
+    settings = (await db.scalars(select(UserSettings).where(UserSettings.user_id == user_id))).first()
     
     if not settings:
         settings = UserSettings(
@@ -178,81 +428,712 @@ def update_user_settings(db: Session, user_id: int, delivery_time: str = None,
     if openrouter_model:
         settings.openrouter_model = openrouter_model
         
-    db.commit()
-    db.refresh(settings)
+    # Время следующей доставки меняется в той же транзакции, что и настройки
+    if delivery_time or delivery_frequency or timezone or settings.id is None:
+        await db.flush()
+        await _schedule_delivery(db, settings)
+        
+    await db.commit()
     return settings
 
 
-def get_user_model(db: Session, user_id: int) -> str:
+async def get_sender_names(db: AsyncSession, sender_ids: Iterable[int]) -> Dict[int, str]:
     """
-    Получает выбранную пользователем модель
+    Получает сохраненные имена отправителей одним запросом
     
     Args:
         db: Сессия базы данных
-        user_id: ID пользователя
+        sender_ids: ID отправителей в Telegram
         
     Returns:
-        str: Название модели
+        Dict[int, str]: Имена отправителей по их ID
+    """
+    sender_ids = list(sender_ids)
+    if not sender_ids:
+        return {}
+        
+    rows = (await db.execute(select(Sender.id, Sender.display_name).where(Sender.id.in_(sender_ids)))).all()
+    return {sender_id: display_name for sender_id, display_name in rows}
+
+
+async def save_sender_names(db: AsyncSession, names: Dict[int, str]) -> None:
     """
-    settings = db.query(UserSettings).filter(UserSettings.user_id == user_id).first()
+    Сохраняет имена отправителей одной транзакцией
     
-    if not settings or not settings.openrouter_model:
-        return DEFAULT_OPENROUTER_MODEL
+    Args:
+        db: Сессия базы данных
+        names: Имена отправителей по их ID
+    """
+    if not names:
+        return
         
-    return settings.openrouter_model
+    now = datetime.utcnow()
+    existing = {sender.id: sender for sender in await db.scalars(select(Sender).where(Sender.id.in_(list(names))))}
+    
+    for sender_id, display_name in names.items():
+        sender = existing.get(sender_id)
+        if sender:
+            sender.display_name = display_name
+            sender.updated_at = now
+        else:
+            db.add(Sender(id=sender_id, display_name=display_name, updated_at=now))
+            
+    await db.commit()
 
 
-def save_summary(db: Session, subscription_id: int, content: str, 
-                from_message_id: int = None, to_message_id: int = None,
-                model_used: str = None) -> Summary:
+async def get_subscribed_chats(db: AsyncSession) -> Dict[str, Optional[int]]:
     """
-    Сохраняет саммари в базу данных
+    Получает все чаты с активными подписками
     
     Args:
         db: Сессия базы данных
-        subscription_id: ID подписки
+        
+    Returns:
+        Dict[str, Optional[int]]: Наименьший ID последнего обработанного сообщения по ID чата
+            (None, если хотя бы одна подписка еще не обрабатывалась)
+    """
+    rows = (await db.execute(select(
+        ChatSubscription.chat_id,
+        func.min(ChatSubscription.last_processed_message_id),
+        func.count(ChatSubscription.id),
+        func.count(ChatSubscription.last_processed_message_id)
+    ).where(
+        ChatSubscription.is_active == True
+    ).group_by(ChatSubscription.chat_id))).all()
+    
+    return {
+        str(chat_id): min_processed_id if processed == total else None
+        for chat_id, min_processed_id, total, processed in rows
+    }
+
+
+async def save_messages(db: AsyncSession, chat_id: int, messages: List[Dict]) -> None:
+    """
+    Сохраняет сообщения чата в локальное хранилище (повторная запись обновляет сообщение)
+    
+    Args:
+        db: Сессия базы данных
+        chat_id: ID чата в Telegram (peer id)
+        messages: Сообщения в виде словарей с ключами id, date, sender_id, text, reply_to
+    """
+    if not messages:
+        return
+        
+    stmt = insert(StoredMessage).values([dict(message, chat_id=chat_id) for message in messages])
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[StoredMessage.chat_id, StoredMessage.id],
+        set_={"text": stmt.excluded.text}
+    )
+    await db.execute(stmt)
+    await db.commit()
+
+
+async def get_stored_messages(db: AsyncSession, chat_id: int, after_id: int, limit: int) -> List[StoredMessage]:
+    """
+    Получает сообщения чата из локального хранилища диапазонным сканированием по ключу
+    
+    Args:
+        db: Сессия базы данных
+        chat_id: ID чата в Telegram (peer id)
+        after_id: ID сообщения, после которого нужно читать
+        limit: Максимальное количество сообщений
+        
+    Returns:
+        List[StoredMessage]: Сообщения по возрастанию ID
+    """
+    return (await db.scalars(select(StoredMessage).where(
+        StoredMessage.chat_id == chat_id,
+        StoredMessage.id > after_id
+    ).order_by(StoredMessage.id).limit(limit))).all()
+
+
+async def get_chat_sync_state(db: AsyncSession, chat_id: int) -> Optional[ChatSyncState]:
+    """
+    Получает состояние синхронизации чата
+    
+    Args:
+        db: Сессия базы данных
+        chat_id: ID чата в Telegram (peer id)
+        
+    Returns:
+        Optional[ChatSyncState]: Состояние синхронизации или None
+    """
+    return await db.get(ChatSyncState, chat_id)
+
+
+async def update_chat_sync_state(db: AsyncSession, chat_id: int, last_message_id: int,
+                                 synced_from_id: int = None) -> ChatSyncState:
+    """
+    Обновляет состояние синхронизации чата
+    
+    Args:
+        db: Сессия базы данных
+        chat_id: ID чата в Telegram (peer id)
+        last_message_id: ID, до которого хранилище не имеет пропусков
+        synced_from_id: ID, начиная с которого хранилище содержит все сообщения (опционально)
+        
+    Returns:
+        ChatSyncState: Обновленное состояние синхронизации
+    """
+    state = await get_chat_sync_state(db, chat_id)
+    
+    if not state:
+        state = ChatSyncState(chat_id=chat_id, synced_from_id=synced_from_id or last_message_id)
+        db.add(state)
+    elif synced_from_id is not None:
+        state.synced_from_id = synced_from_id
+        
+    state.last_message_id = max(last_message_id, state.last_message_id or 0)
+    state.updated_at = datetime.utcnow()
+    await db.commit()
+    return state
+
+
+async def get_cached_summary(db: AsyncSession, key: str) -> Optional[str]:
+    """
+    Получает саммари из кэша
+    
+    Args:
+        db: Сессия базы данных
+        key: Ключ кэша
+        
+    Returns:
+        Optional[str]: Текст саммари или None, если его нет в кэше или запись устарела
+    """
+    entry = await db.get(SummaryCacheEntry, key)
+    
+    if not entry:
+        return None
+        
+    if entry.created_at < datetime.utcnow() - timedelta(seconds=SUMMARY_CACHE_TTL):
+        return None
+        
+    entry.last_used_at = datetime.utcnow()
+    await db.commit()
+    return entry.content
+
+
+async def save_cached_summary(db: AsyncSession, key: str, content: str, model: str) -> None:
+    """
+    Сохраняет саммари в кэш и удаляет устаревшие и самые давно использованные записи
+    
+    Args:
+        db: Сессия базы данных
+        key: Ключ кэша
         content: Текст саммари
-        from_message_id: ID начального сообщения
-        to_message_id: ID конечного сообщения
+        model: Использованная модель
+    """
+    now = datetime.utcnow()
+    await db.merge(SummaryCacheEntry(key=key, content=content, model=model, created_at=now, last_used_at=now))
+    # Сессия без autoflush: новая запись должна попасть в подсчет размера кэша
+    await db.flush()
+    
+    # Вытеснение по времени жизни
+    await db.execute(
+        delete(SummaryCacheEntry)
+        .where(SummaryCacheEntry.created_at < now - timedelta(seconds=SUMMARY_CACHE_TTL))
+        .execution_options(synchronize_session=False)
+    )
+    
+    # Вытеснение по размеру: удаляем записи, которые дольше всего не использовались
+    excess = await db.scalar(select(func.count(SummaryCacheEntry.key))) - SUMMARY_CACHE_MAX_ENTRIES
+    if excess > 0:
+        stale_keys = select(SummaryCacheEntry.key).order_by(
+            SummaryCacheEntry.last_used_at
+        ).limit(excess).subquery()
+        await db.execute(
+            delete(SummaryCacheEntry)
+            .where(SummaryCacheEntry.key.in_(stale_keys.select()))
+            .execution_options(synchronize_session=False)
+        )
+        
+    await db.commit()
+
+
+async def _schedule_delivery(db: AsyncSession, settings: UserSettings, after: datetime = None) -> None:
+    """
+    Записывает время следующей доставки по настройкам пользователя (без фиксации транзакции)
+    
+    Args:
+        db: Сессия базы данных
+        settings: Настройки пользователя
+        after: Момент (UTC), после которого искать время доставки (по умолчанию - текущее время)
+    """
+    next_run_at = None
+    if settings.is_active:
+        after = after or datetime.utcnow()
+        next_run_at = get_next_run_at(settings, after.replace(tzinfo=pytz.utc))
+        
+    job = await db.get(ScheduledJob, settings.user_id)
+    if next_run_at is None:
+        if job:
+            await db.delete(job)
+        return
+        
+    if not job:
+        job = ScheduledJob(user_id=settings.user_id)
+        db.add(job)
+    job.next_run_at = next_run_at.replace(tzinfo=None)
+
+
+async def get_due_jobs(db: AsyncSession, before: datetime, limit: int) -> List[ScheduledJob]:
+    """
+    Возвращает задачи доставки, время которых наступает до заданного момента
+    
+    Args:
+        db: Сессия базы данных
+        before: Граница (UTC)
+        limit: Максимальное количество задач
+        
+    Returns:
+        List[ScheduledJob]: Задачи в порядке времени доставки
+    """
+    return (await db.scalars(select(ScheduledJob).where(
+        ScheduledJob.next_run_at <= before
+    ).order_by(ScheduledJob.next_run_at).limit(limit))).all()
+
+
+async def claim_scheduled_job(db: AsyncSession, settings: UserSettings, run_at: datetime) -> bool:
+    """
+    Забирает сработавшую задачу доставки и планирует следующую
+    
+    Задача забирается, только если ее время не изменилось с момента выборки,
+    поэтому доставка, перенесенная пользователем, не отправляется по старому времени.
+    В той же транзакции в очередь ставится задача генерации саммари (SummaryJob).
+    
+    Args:
+        db: Сессия базы данных
+        settings: Настройки пользователя
+        run_at: Время доставки (UTC), на которое задача была выбрана
+        
+    Returns:
+        bool: True если задача забрана и в очередь поставлена задача генерации саммари
+    """
+    next_run_at = None
+    if settings.is_active:
+        # После простоя пропущенные доставки не повторяются: следующая ищется после текущего момента
+        after = max(run_at, datetime.utcnow())
+        next_run_at = get_next_run_at(settings, after.replace(tzinfo=pytz.utc))
+        
+    result = await db.execute(
+        update(ScheduledJob)
+        .where(ScheduledJob.user_id == settings.user_id, ScheduledJob.next_run_at == run_at)
+        .values(next_run_at=next_run_at.replace(tzinfo=None) if next_run_at else None)
+    )
+    claimed = result.rowcount == 1 and settings.is_active
+    if claimed:
+        db.add(SummaryJob(user_id=settings.user_id, kind="scheduled", deliver_at=run_at))
+    await db.commit()
+    return claimed
+
+
+async def get_preprocessing_stages(db: AsyncSession, subscription_ids: Iterable[int]) -> Dict[int, str]:
+    """
+    Получает этапы предобработки, выбранные для подписок
+    
+    Args:
+        db: Сессия базы данных
+        subscription_ids: ID подписок
+        
+    Returns:
+        Dict[int, str]: Этапы через запятую по ID подписки (подписок с этапами по умолчанию в словаре нет)
+    """
+    rows = (await db.execute(select(
+        SubscriptionPreprocessing.subscription_id, SubscriptionPreprocessing.stages
+    ).where(SubscriptionPreprocessing.subscription_id.in_(list(subscription_ids))))).all()
+    return dict(rows)
+
+
+async def set_preprocessing_stages(db: AsyncSession, subscription_id: int, stages: List[str]) -> None:
+    """
+    Сохраняет этапы предобработки подписки
+    
+    Args:
+        db: Сессия базы данных
+        subscription_id: ID подписки
+        stages: Названия включенных этапов
+    """
+    stmt = insert(SubscriptionPreprocessing).values(
+        subscription_id=subscription_id, stages=",".join(stages), updated_at=datetime.utcnow()
+    )
+    await db.execute(stmt.on_conflict_do_update(
+        index_elements=[SubscriptionPreprocessing.subscription_id],
+        set_={"stages": stmt.excluded.stages, "updated_at": stmt.excluded.updated_at}
+    ))
+    await db.commit()
+
+
+async def get_summary_states(db: AsyncSession, subscription_ids: Iterable[int]) -> Dict[int, SummaryState]:
+    """
+    Получает состояния инкрементальных саммари подписок
+    
+    Args:
+        db: Сессия базы данных
+        subscription_ids: ID подписок
+        
+    Returns:
+        Dict[int, SummaryState]: Состояния по ID подписки (подписок без состояния в словаре нет)
+    """
+    states = await db.scalars(select(SummaryState).where(SummaryState.subscription_id.in_(list(subscription_ids))))
+    return {state.subscription_id: state for state in states}
+
+
+async def record_summary_window(db: AsyncSession, subscription_id: int, content: Optional[str], from_message_id: int,
+                                to_message_id: int, model_used: str, expected_last_id: Optional[int],
+                                state: Optional[str] = None, full_refresh: bool = False) -> bool:
+    """
+    Сохраняет саммари окна сообщений и сдвигает последнее обработанное сообщение одной транзакцией
+    
+    Граница сдвигается, только если она не изменилась с момента загрузки окна, поэтому
+    повторное выполнение той же задачи не сохраняет саммари дважды.
+    
+    Args:
+        db: Сессия базы данных
+        subscription_id: ID подписки
+        content: Текст саммари (None - в окне не осталось сообщений после предобработки:
+            граница сдвигается без сохранения саммари)
+        from_message_id: ID первого сообщения окна
+        to_message_id: ID последнего сообщения окна
         model_used: Использованная модель
+        expected_last_id: Последнее обработанное сообщение, от которого загружалось окно
+        state: Новое состояние инкрементального саммари в JSON (None - состояние не меняется)
+        full_refresh: Состояние построено заново, а не обновлено
+        
+    Returns:
+        bool: True если саммари сохранено, False если окно уже было обработано
+    """
+    current = ChatSubscription.last_processed_message_id
+    result = await db.execute(
+        update(ChatSubscription)
+        .where(
+            ChatSubscription.id == subscription_id,
+            current.is_(None) if expected_last_id is None else current == expected_last_id
+        )
+        .values(last_processed_message_id=to_message_id)
+    )
+    if result.rowcount != 1:
+        await db.rollback()
+        return False
+        
+    if content is not None:
+        db.add(Summary(
+            subscription_id=subscription_id,
+            content=content,
+            from_message_id=from_message_id,
+            to_message_id=to_message_id,
+            created_at=datetime.utcnow(),
+            model_used=model_used
+        ))
+        
+    # Состояние меняется вместе с границей окна, поэтому повтор задачи не применит его дважды
+    if state is not None:
+        now = datetime.utcnow()
+        stmt = insert(SummaryState).values(
+            subscription_id=subscription_id, state=state, updates_since_refresh=0, refreshed_at=now, updated_at=now
+        )
+        updates = {"state": stmt.excluded.state, "updated_at": stmt.excluded.updated_at}
+        if full_refresh:
+            updates.update(updates_since_refresh=0, refreshed_at=stmt.excluded.refreshed_at)
+        else:
+            updates.update(updates_since_refresh=SummaryState.updates_since_refresh + 1)
+        await db.execute(stmt.on_conflict_do_update(index_elements=[SummaryState.subscription_id], set_=updates))
+    await db.commit()
+    return True
+
+
+async def enqueue_summary_job(db: AsyncSession, user_id: int, reply_chat_id: int, stream: bool = False) -> Optional[SummaryJob]:
+    """
+    Ставит в очередь задачу генерации саммари по команде /summary
+    
+    Args:
+        db: Сессия базы данных
+        user_id: ID пользователя
+        reply_chat_id: ID чата, в который отправить саммари
+        stream: Показывать саммари по мере генерации
         
     Returns:
-        Summary: Созданный объект саммари
-    """
-    summary = Summary(
-        subscription_id=subscription_id,
-        content=content,
-        from_message_id=from_message_id,
-        to_message_id=to_message_id,
-        created_at=datetime.utcnow(),
-        model_used=model_used
+        Optional[SummaryJob]: Задача или None, если у пользователя уже есть незавершенная задача /summary
+    """
+    active = (await db.execute(select(SummaryJob.id).where(
+        SummaryJob.user_id == user_id,
+        SummaryJob.status.in_(["pending", "leased"]),
+        SummaryJob.kind == "manual"
+    ))).first()
+    if active:
+        return None
+        
+    job = SummaryJob(user_id=user_id, kind="manual", reply_chat_id=reply_chat_id, stream=stream)
+    db.add(job)
+    await db.commit()
+    return job
+
+
+def _available_jobs_filter(now: datetime):
+    """Условие доступности задачи: ожидает своего времени или ее аренда истекла"""
+    return or_(
+        and_(SummaryJob.status == "pending", SummaryJob.available_at <= now),
+        and_(SummaryJob.status == "leased", SummaryJob.lease_until <= now),
     )
+
+
+async def lease_summary_jobs(db: AsyncSession, limit: int, lease_seconds: int) -> List[SummaryJob]:
+    """
+    Берет в работу следующую задачу очереди
+    
+    Задачи доставки по расписанию с тем же временем доставки берутся вместе (до limit штук),
+    чтобы общие чаты подписчиков обрабатывались один раз.
     
-    db.add(summary)
-    db.commit()
-    db.refresh(summary)
-    return summary
+    Args:
+        db: Сессия базы данных
+        limit: Максимальное количество задач
+        lease_seconds: Длительность аренды в секундах
+        
+    Returns:
+        List[SummaryJob]: Арендованные задачи (пустой список, если доступных задач нет)
+    """
+    now = datetime.utcnow()
+    available = _available_jobs_filter(now)
     
+    # Ожидающие задачи и задачи с истекшей арендой выбираются отдельно, каждая по своему индексу:
+    # общее условие с OR SQLite выполняет через временное B-дерево для сортировки всех доступных задач
+    candidates = [
+        (await db.scalars(select(SummaryJob).where(
+            SummaryJob.status == "pending",
+            SummaryJob.available_at <= now
+        ).order_by(SummaryJob.available_at, SummaryJob.id).limit(1))).first(),
+        (await db.scalars(select(SummaryJob).where(
+            SummaryJob.status == "leased",
+            SummaryJob.lease_until <= now
+        ).order_by(SummaryJob.lease_until, SummaryJob.id).limit(1))).first(),
+    ]
+    candidates = [job for job in candidates if job]
+    if not candidates:
+        return []
+        
+    first = min(candidates, key=lambda job: (job.available_at, job.id))
+    jobs = [first]
+    if first.kind == "scheduled" and limit > 1:
+        jobs += (await db.scalars(select(SummaryJob).where(
+            available,
+            SummaryJob.kind == "scheduled",
+            SummaryJob.deliver_at == first.deliver_at,
+            SummaryJob.id != first.id
+        ).order_by(SummaryJob.id).limit(limit - 1))).all()
+        
+    # Аренда условная: задачу, которую успел взять другой процесс, пропускаем
+    leased = []
+    lease_until = now + timedelta(seconds=lease_seconds)
+    for job in jobs:
+        result = await db.execute(
+            update(SummaryJob)
+            .where(SummaryJob.id == job.id, available)
+            .values(status="leased", lease_until=lease_until, attempts=SummaryJob.attempts + 1)
+        )
+        if result.rowcount == 1:
+            leased.append(job)
+    await db.commit()
+    return leased
+
+
+async def extend_summary_job_lease(db: AsyncSession, job_ids: List[int], lease_seconds: int) -> None:
+    """
+    Продлевает аренду задач, которые еще выполняются
     
-def update_last_processed_message(db: Session, subscription_id: int, message_id: int) -> bool:
+    Args:
+        db: Сессия базы данных
+        job_ids: ID задач
+        lease_seconds: Длительность аренды в секундах
+    """
+    await db.execute(
+        update(SummaryJob)
+        .where(SummaryJob.id.in_(job_ids), SummaryJob.status == "leased")
+        .values(lease_until=datetime.utcnow() + timedelta(seconds=lease_seconds))
+    )
+    await db.commit()
+
+
+async def finish_summary_jobs(db: AsyncSession, job_ids: List[int], error: str = None,
+                              retry_delay: int = 0, max_attempts: int = 1) -> None:
+    """
+    Завершает задачи: успешно, с повтором позже или окончательно с ошибкой
+    
+    Args:
+        db: Сессия базы данных
+        job_ids: ID задач
+        error: Текст ошибки (None - задачи выполнены успешно)
+        retry_delay: Пауза перед повтором в секундах
+        max_attempts: Максимальное количество попыток
+    """
+    if error is None:
+        await db.execute(
+            update(SummaryJob).where(SummaryJob.id.in_(job_ids)).values(status="done", lease_until=None)
+        )
+        await db.commit()
+        return
+        
+    retry_at = datetime.utcnow() + timedelta(seconds=retry_delay)
+    for job in await db.scalars(select(SummaryJob).where(SummaryJob.id.in_(job_ids))):
+        job.last_error = error
+        job.lease_until = None
+        if job.attempts >= max_attempts:
+            job.status = "failed"
+        else:
+            job.status = "pending"
+            job.available_at = retry_at
+    await db.commit()
+
+
+async def release_summary_jobs(db: AsyncSession, job_ids: List[int]) -> None:
+    """
+    Возвращает в очередь задачи, выполнение которых прервано остановкой бота
+    
+    Прерванная попытка не засчитывается.
+    
+    Args:
+        db: Сессия базы данных
+        job_ids: ID задач
+    """
+    await db.execute(
+        update(SummaryJob)
+        .where(SummaryJob.id.in_(job_ids), SummaryJob.status == "leased")
+        .values(status="pending", lease_until=None, available_at=datetime.utcnow(),
+                attempts=SummaryJob.attempts - 1)
+    )
+    await db.commit()
+
+
+async def purge_summary_jobs(db: AsyncSession, older_than: datetime) -> int:
     """
-    Обновляет ID последнего обработанного сообщения для подписки
+    Удаляет завершенные задачи очереди
+    
+    Args:
+        db: Сессия базы данных
+        older_than: Удалять задачи, обновленные раньше этого времени (UTC)
+        
+    Returns:
+        int: Количество удаленных задач
+    """
+    result = await db.execute(
+        delete(SummaryJob)
+        .where(SummaryJob.status.in_(["done", "failed"]), SummaryJob.updated_at < older_than)
+        .execution_options(synchronize_session=False)
+    )
+    await db.commit()
+    return result.rowcount
+
+
+def summary_history_key(summary: Union[Summary, ArchivedSummary]) -> Tuple[datetime, int]:
+    """
+    Возвращает ключ саммари в истории: время создания и ID саммари в таблице summaries
+    
+    У архивного саммари собственный ID из другой последовательности, поэтому для него
+    берется ID, который саммари имело до переноса в архив.
+    
+    Args:
+        summary: Саммари из основной таблицы или архива
+        
+    Returns:
+        Tuple[datetime, int]: Время создания и ID саммари
+    """
+    if isinstance(summary, ArchivedSummary):
+        return summary.created_at, summary.summary_id
+    return summary.created_at, summary.id
+
+
+async def get_summary_history(db: AsyncSession, subscription_id: int, before: Optional[Tuple[datetime, int]],
+                              limit: int) -> List[Union[Summary, ArchivedSummary]]:
+    """
+    Получает страницу истории саммари подписки, от новых к старым
+    
+    Страница выбирается по ключу (subscription_id, created_at, ID саммари) после последнего
+    показанного саммари, поэтому запрос не зависит от номера страницы. Сначала читается
+    основная таблица, затем архив, в котором лежат более старые саммари. В обеих таблицах
+    ключом служит ID из таблицы summaries (см. summary_history_key).
     
     Args:
         db: Сессия базы данных
         subscription_id: ID подписки
-        message_id: ID сообщения
+        before: Ключ саммари, после которого начинается страница (None - с самого нового)
+        limit: Максимальное количество саммари
+        
+    Returns:
+        List[Union[Summary, ArchivedSummary]]: Саммари, текст доступен в атрибуте text
+    """
+    history = []
+    for model, summary_id in ((Summary, Summary.id), (ArchivedSummary, ArchivedSummary.summary_id)):
+        stmt = select(model).where(model.subscription_id == subscription_id)
+        if before:
+            stmt = stmt.where(tuple_(model.created_at, summary_id) < before)
+            
+        history += (await db.scalars(
+            stmt.order_by(model.created_at.desc(), summary_id.desc()).limit(limit - len(history))
+        )).all()
+        if len(history) >= limit:
+            break
+            
+        if history:
+            before = summary_history_key(history[-1])
+            
+    return history
+
+
+async def archive_summaries(db: AsyncSession, older_than: datetime, limit: int) -> int:
+    """
+    Сжимает саммари старше заданного времени и переносит их в архив одной транзакцией
+    
+    Args:
+        db: Сессия базы данных
+        older_than: Переносить саммари, созданные раньше этого времени (UTC)
+        limit: Максимальное количество саммари за один вызов
         
     Returns:
-        bool: True если обновление успешно, иначе False
+        int: Количество перенесенных саммари
     """
-    subscription = db.query(ChatSubscription).filter(
-        ChatSubscription.id == subscription_id
-    ).first()
+    summaries = (await db.scalars(
+        select(Summary).where(Summary.created_at < older_than).order_by(Summary.id).limit(limit)
+    )).all()
+    if not summaries:
+        return 0
+        
+    # Из основной таблицы удаляются только саммари, которые действительно попали в архив
+    archived_ids = (await db.scalars(insert(ArchivedSummary).values([
+        {
+            "summary_id": summary.id,
+            "subscription_id": summary.subscription_id,
+            "content": zlib.compress((summary.content or "").encode("utf-8"), 9),
+            "created_at": summary.created_at,
+            "from_message_id": summary.from_message_id,
+            "to_message_id": summary.to_message_id,
+            "model_used": summary.model_used
+        }
+        for summary in summaries
+    ]).returning(ArchivedSummary.summary_id))).all()
+    await db.execute(
+        delete(Summary)
+        .where(Summary.id.in_(archived_ids))
+        .execution_options(synchronize_session=False)
+    )
+    await db.commit()
+    return len(archived_ids)
+
+
+async def purge_summaries(db: AsyncSession, older_than: datetime) -> int:
+    """
+    Удаляет саммари старше срока хранения из основной таблицы и из архива
     
-    if not subscription:
-        return False
+    Args:
+        db: Сессия базы данных
+        older_than: Удалять саммари, созданные раньше этого времени (UTC)
+        
+    Returns:
+        int: Количество удаленных саммари
+    """
+    deleted = 0
+    for model in (Summary, ArchivedSummary):
+        result = await db.execute(
+            delete(model).where(model.created_at < older_than).execution_options(synchronize_session=False)
+        )
+        deleted += result.rowcount
         
-    subscription.last_processed_message_id = message_id
-    db.commit()
-    return True 
\ No newline at end of file
+    await db.commit()
+    return deleted
@@ -5,9 +5,10 @@ import signal
 from pathlib import Path
 
 from src.config import BASE_DIR
-from src.database import create_tables, get_db
+from src.database import create_tables, dispose_engine
 from src.telegram_client import TelegramSummaryClient
 from src.utils.logger import logger
+from src.utils.openrouter import openrouter_client
 from src.utils.scheduler import SchedulerManager
 
 
@@ -18,18 +19,19 @@ async def main():
         data_dir = BASE_DIR / "data"
         data_dir.mkdir(exist_ok=True)
         
-        # Создаем таблицы базы данных
-        create_tables()
+        # Создаем таблицы базы данных.
+        # Общей сессии нет: каждый обработчик и каждая задача открывают свою
+        await create_tables()
         
-        # Получаем сессию базы данных
-        db = get_db()
+        # Запускаем HTTP-клиент OpenRouter, общий для всех задач саммаризации
+        await openrouter_client.start()
         
         # Инициализируем и запускаем клиент Telegram
-        telegram_client = TelegramSummaryClient(db)
+        telegram_client = TelegramSummaryClient()
         await telegram_client.start()
         
         # Инициализируем и запускаем планировщик
-        scheduler = SchedulerManager(db, telegram_client.client)
+        scheduler = SchedulerManager(telegram_client)
         scheduler.start()
         
         # Настраиваем обработчик сигналов для корректного завершения
@@ -55,12 +57,18 @@ async def shutdown(telegram_client, scheduler):
     
     # Останавливаем планировщик
     if scheduler:
-        scheduler.stop()
+        await scheduler.stop()
         
     # Останавливаем клиент Telegram
     if telegram_client:
         await telegram_client.stop()
         
+    # Закрываем соединения с OpenRouter
+    await openrouter_client.stop()
+    
+    # Закрываем соединения с базой данных
+    await dispose_engine()
+        
     # Выходим из программы
     sys.exit(0)
     
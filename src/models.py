@@ -1,24 +1,14 @@
-from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, DateTime, Text, create_engine
+from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, DateTime, Text, Index, LargeBinary
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import relationship, sessionmaker
+from sqlalchemy.orm import relationship
 import datetime
+import zlib
 from typing import List, Optional
-from src.config import DATABASE_URL, DEFAULT_OPENROUTER_MODEL
+from src.config import DEFAULT_OPENROUTER_MODEL, INCREMENTAL_FREQUENCIES
 
+# Движок и сессии базы данных находятся в src.database
 Base = declarative_base()
 
-# Создаем движок базы данных
-engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-
-
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
 
 class User(Base):
     """Модель пользователя"""
@@ -30,8 +20,22 @@ class User(Base):
     first_name = Column(String)
     last_name = Column(String, nullable=True)
     is_active = Column(Boolean, default=True)
-    chats = relationship("ChatSubscription", back_populates="user")
-    settings = relationship("UserSettings", uselist=False, back_populates="user")
+    # Подписки и настройки нужны почти каждому обработчику, а отложенная загрузка
+    # в асинхронной сессии невозможна, поэтому они загружаются вместе с пользователем
+    chats = relationship("ChatSubscription", back_populates="user", lazy="selectin")
+    settings = relationship("UserSettings", uselist=False, back_populates="user", lazy="selectin")
+
+    @property
+    def openrouter_model(self) -> str:
+        """Выбранная пользователем модель OpenRouter (модель по умолчанию, если она не задана)"""
+        if self.settings and self.settings.openrouter_model:
+            return self.settings.openrouter_model
+        return DEFAULT_OPENROUTER_MODEL
+
+    @property
+    def incremental_summaries(self) -> bool:
+        """Саммари пользователя строятся инкрементально (по частоте доставки из INCREMENTAL_FREQUENCIES)"""
+        return bool(self.settings) and self.settings.delivery_frequency in INCREMENTAL_FREQUENCIES
 
 
 class ChatSubscription(Base):
@@ -47,6 +51,33 @@ class ChatSubscription(Base):
     user = relationship("User", back_populates="chats")
     summaries = relationship("Summary", back_populates="subscription")
 
+    __table_args__ = (
+        # Поиск подписки пользователя на чат и загрузка всех подписок пользователя
+        Index("ix_chat_subscriptions_user_id_chat_id", "user_id", "chat_id", unique=True),
+        # Группировка активных подписок по чатам (get_subscribed_chats)
+        Index("ix_chat_subscriptions_chat_id_is_active", "chat_id", "is_active"),
+    )
+
+
+class SubscriptionPreprocessing(Base):
+    """Этапы предобработки переписки, выбранные для подписки (без записи действуют этапы по умолчанию)"""
+    __tablename__ = "subscription_preprocessing"
+
+    subscription_id = Column(Integer, ForeignKey("chat_subscriptions.id"), primary_key=True)
+    stages = Column(String, default="")  # Включенные этапы через запятую
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
+
+
+class SummaryState(Base):
+    """Состояние инкрементального саммари подписки: темы, открытые обсуждения и объявления чата"""
+    __tablename__ = "summary_states"
+
+    subscription_id = Column(Integer, ForeignKey("chat_subscriptions.id"), primary_key=True)
+    state = Column(Text)  # JSON со списками topics, open_discussions, announcements
+    updates_since_refresh = Column(Integer, default=0)  # Инкрементальных обновлений с последнего построения заново
+    refreshed_at = Column(DateTime, default=datetime.datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow)
+
 
 class UserSettings(Base):
     """Настройки пользователя"""
@@ -55,7 +86,7 @@ class UserSettings(Base):
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), unique=True)
     delivery_time = Column(String, default="10:00")  # Формат HH:MM
-    delivery_frequency = Column(String, default="daily")  # daily, weekly
+    delivery_frequency = Column(String, default="daily")  # hourly, daily, weekly
     timezone = Column(String, default="UTC")
     is_active = Column(Boolean, default=True)
     openrouter_model = Column(String, default=DEFAULT_OPENROUTER_MODEL)  # Модель OpenRouter
@@ -75,7 +106,122 @@ class Summary(Base):
     model_used = Column(String, nullable=True)  # Какая модель использовалась
     subscription = relationship("ChatSubscription", back_populates="summaries")
 
+    __table_args__ = (
+        Index("ix_summaries_subscription_id_created_at", "subscription_id", "created_at"),
+    )
+
+    @property
+    def text(self) -> str:
+        """Текст саммари под тем же именем, что и у архивного саммари"""
+        return self.content
+
+
+class ArchivedSummary(Base):
+    """Саммари, перенесенное из таблицы summaries в архив в сжатом виде"""
+    __tablename__ = "summaries_archive"
+
+    # Собственный ID: SQLite может повторно выдать ID удаленных саммари в таблице summaries
+    id = Column(Integer, primary_key=True)
+    summary_id = Column(Integer)  # ID саммари в таблице summaries на момент переноса
+    subscription_id = Column(Integer, ForeignKey("chat_subscriptions.id"))
+    content = Column(LargeBinary)  # Текст саммари, сжатый zlib
+    created_at = Column(DateTime)
+    from_message_id = Column(Integer, nullable=True)
+    to_message_id = Column(Integer, nullable=True)
+    model_used = Column(String, nullable=True)
+
+    __table_args__ = (
+        Index("ix_summaries_archive_subscription_id_created_at_summary_id", "subscription_id", "created_at", "summary_id"),
+        {"sqlite_autoincrement": True},
+    )
+
+    @property
+    def text(self) -> str:
+        """Распакованный текст саммари"""
+        return zlib.decompress(self.content).decode("utf-8")
+
+
+class Sender(Base):
+    """Кэш отображаемых имен отправителей сообщений"""
+    __tablename__ = "senders"
+
+    id = Column(Integer, primary_key=True)  # ID отправителя в Telegram
+    display_name = Column(String)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+
+class StoredMessage(Base):
+    """Локальная копия сообщения из чата, на который есть подписки"""
+    __tablename__ = "messages"
+
+    chat_id = Column(Integer, primary_key=True)  # ID чата в Telegram (peer id)
+    id = Column(Integer, primary_key=True)  # ID сообщения в чате
+    date = Column(DateTime)  # Время отправки (UTC)
+    sender_id = Column(Integer, nullable=True)
+    text = Column(Text)
+    reply_to = Column(Integer, nullable=True)  # ID сообщения, на которое это является ответом
+
+    @property
+    def message(self):
+        """Текст сообщения под тем же именем, что и у сообщений Telethon"""
+        return self.text
+
+
+class ChatSyncState(Base):
+    """Состояние синхронизации локального хранилища сообщений чата"""
+    __tablename__ = "chat_sync_state"
+
+    chat_id = Column(Integer, primary_key=True)  # ID чата в Telegram (peer id)
+    synced_from_id = Column(Integer)  # Начиная с этого ID хранилище содержит все сообщения
+    last_message_id = Column(Integer)  # До этого ID хранилище заведомо не имеет пропусков
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+
+class SummaryCacheEntry(Base):
+    """Кэш саммари по окну сообщений, модели и версии промптов"""
+    __tablename__ = "summary_cache"
+
+    key = Column(String, primary_key=True)  # SHA-256 от (чат, диапазон сообщений, модель, версия промптов)
+    content = Column(Text)
+    model = Column(String)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow, index=True)
+    last_used_at = Column(DateTime, default=datetime.datetime.utcnow, index=True)
+
+
+class ScheduledJob(Base):
+    """Время следующей доставки саммари пользователю по расписанию"""
+    __tablename__ = "scheduled_jobs"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    next_run_at = Column(DateTime, index=True)  # Время следующей доставки (UTC)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
+
+
+class SummaryJob(Base):
+    """Задача генерации и отправки саммари в постоянной очереди"""
+    __tablename__ = "summary_jobs"
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"))
+    kind = Column(String)  # manual (команда /summary), scheduled (доставка по расписанию)
+    status = Column(String, default="pending")  # pending, leased, done, failed
+    reply_chat_id = Column(Integer, nullable=True)  # Куда отвечать на /summary
+    stream = Column(Boolean, default=False)  # Показывать саммари по мере генерации
+    deliver_at = Column(DateTime, nullable=True)  # Время доставки по расписанию (UTC)
+    available_at = Column(DateTime, default=datetime.datetime.utcnow)  # Раньше этого времени задачу не брать
+    lease_until = Column(DateTime, nullable=True)  # До этого времени задача принадлежит обработчику
+    attempts = Column(Integer, default=0)
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
+
+    __table_args__ = (
+        Index("ix_summary_jobs_status_available_at", "status", "available_at"),
+        Index("ix_summary_jobs_status_lease_until", "status", "lease_until"),
+        # Незавершенная задача /summary пользователя (enqueue_summary_job): без kind в индексе
+        # SQLite предпочитает ix_summary_jobs_kind_deliver_at и перебирает все задачи вида
+        Index("ix_summary_jobs_user_id_kind_status", "user_id", "kind", "status"),
+        # Задачи доставки по расписанию с общим временем доставки (lease_summary_jobs)
+        Index("ix_summary_jobs_kind_deliver_at", "kind", "deliver_at"),
+    )
 
-# Создаем таблицы
-def init_db():
-    Base.metadata.create_all(bind=engine) 
\ No newline at end of file
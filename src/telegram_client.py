@@ -1,43 +1,71 @@
 import os
 import asyncio
+import functools
 import time
+import weakref
 from telethon import TelegramClient, events
 from telethon.tl import types
 from telethon.errors import SessionPasswordNeededError, FloodWaitError
-from typing import List, Dict, Any, Optional, Union
+from typing import List, Dict, Any, Awaitable, Callable, Optional, Tuple, Union
 from datetime import datetime, timedelta
 import pytz
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from src.config import API_ID, API_HASH, PHONE, BOT_TOKEN, TIMEZONE, DATA_DIR, AVAILABLE_MODELS
+from src.config import (
+    API_ID, API_HASH, PHONE, BOT_TOKEN, TIMEZONE, DATA_DIR, AVAILABLE_MODELS, MESSAGE_STORE_ENABLED,
+    SUMMARY_CONCURRENCY, SUMMARY_USER_CONCURRENCY, SUMMARY_STREAMING, HISTORY_PAGE_SIZE,
+    SUMMARY_STATE_REFRESH_RUNS, SUMMARY_STATE_MAX_AGE, JOB_RETRY_DELAY
+)
 from src.database import (
-    get_or_create_user, 
+    get_session,
+    with_session,
     subscribe_to_chat, 
     unsubscribe_from_chat, 
     update_user_settings, 
-    save_summary, 
-    update_last_processed_message,
-    get_user_model
+    record_summary_window,
+    enqueue_summary_job,
+    get_summary_history,
+    summary_history_key,
+    get_cached_summary,
+    save_cached_summary,
+    get_preprocessing_stages,
+    set_preprocessing_stages,
+    get_summary_states
 )
 from src.models import User, ChatSubscription
 from src.utils.logger import logger
-from src.utils.openrouter import generate_summary, list_available_models
+from src.utils.openrouter import (
+    OpenRouterError, list_available_models, get_model_display_name, format_summary_error, resolve_request_model
+)
+from src.utils.tokens import estimate_tokens
+from src.utils.summarizer import (
+    summarize_messages, summarize_incremental, parse_incremental_response, get_summary_cache_key
+)
+from src.utils.ingestion import IngestionState, iter_message_pages, iter_stored_pages
+from src.utils.message_sync import MessageSync
+from src.utils.delivery import DeliveryQueue, ProgressiveMessage
+from src.utils.job_queue import SummaryJobQueue
+from src.utils.rate_limit import RateLimitedTelegramClient
+from src.utils.senders import resolve_sender_names, UNKNOWN_SENDER
+from src.utils.user_cache import user_cache
+from src.utils.history import encode_history_cursor, decode_history_cursor
+from src.utils.preprocessing import (
+    TranscriptMessage, PreprocessingStats, STAGES, DEFAULT_STAGES, preprocess, parse_stages
+)
+from src.utils.transcript import Transcript, build_transcript
 
 
 class TelegramSummaryClient:
-    def __init__(self, db: Session):
-        """
-        Инициализирует клиент Telegram
-        
-        Args:
-            db: Сессия базы данных
-        """
-        self.db = db
-        
+    def __init__(self):
+        """Инициализирует клиент Telegram"""
         # Используем директорию data для хранения файлов сессии
         session_file = os.path.join(DATA_DIR, 'anon')
-        self.client = TelegramClient(session_file, API_ID, API_HASH)
+        # Все запросы клиента проходят через общий ограничитель частоты
+        self.client = RateLimitedTelegramClient(session_file, API_ID, API_HASH)
         self.bot = None  # Клиент бота будет инициализирован позже
+        self.message_sync = None  # Синхронизация локального хранилища сообщений
+        self.delivery_queue = None  # Очередь исходящих сообщений бота
+        self.summary_jobs = None  # Очередь задач генерации саммари
         
     async def start(self):
         """Запускает клиент Telegram и настраивает обработчики событий"""
@@ -63,6 +91,11 @@ class TelegramSummaryClient:
                 
             logger.info("Telethon клиент успешно подключен с существующей сессией")
             
+            # Запускаем синхронизацию локального хранилища сообщений
+            if MESSAGE_STORE_ENABLED:
+                self.message_sync = MessageSync(self.client)
+                await self.message_sync.start()
+            
             # Запускаем бота, если задан токен
             if BOT_TOKEN:
                 if not os.path.exists(bot_session_path):
@@ -86,6 +119,17 @@ class TelegramSummaryClient:
                 
                 logger.info("Telegram бот успешно подключен с существующей сессией")
                 
+                # Саммари отправляются через очередь с учетом лимитов Telegram
+                self.delivery_queue = DeliveryQueue(self.bot)
+                self.delivery_queue.start()
+                
+                # Саммари генерируются обработчиками постоянной очереди задач
+                self.summary_jobs = SummaryJobQueue(self)
+                self.summary_jobs.start()
+                
+                # Изменившиеся профили пользователей записываются в базу пакетами
+                user_cache.start()
+                
                 # Регистрируем обработчики сообщений бота
                 self._register_bot_handlers()
             else:
@@ -120,6 +164,17 @@ class TelegramSummaryClient:
             
     async def stop(self):
         """Останавливает клиент Telegram"""
+        if self.message_sync:
+            await self.message_sync.stop()
+            
+        if self.summary_jobs:
+            await self.summary_jobs.stop()
+            
+        if self.delivery_queue:
+            await self.delivery_queue.stop()
+            
+        await user_cache.stop()
+            
         if self.client and self.client.is_connected():
             await self.client.disconnect()
             logger.info("Telethon клиент остановлен")
@@ -128,15 +183,26 @@ class TelegramSummaryClient:
             await self.bot.disconnect()
             logger.info("Telegram бот остановлен")
             
+    def _track_chat(self, chat_id):
+        """
+        Запускает в фоне синхронизацию сообщений чата, на который подписался пользователь
+        
+        Args:
+            chat_id: ID чата из подписки
+        """
+        if self.message_sync:
+            asyncio.create_task(self.message_sync.track(chat_id))
+            
     def _register_bot_handlers(self):
         """Регистрирует обработчики сообщений для бота"""
         # Обработчик команды /start
         @self.bot.on(events.NewMessage(pattern='/start'))
-        async def start_handler(event):
+        @with_session
+        async def start_handler(event, db: AsyncSession):
             """Обрабатывает команду /start"""
             sender = await event.get_sender()
-            user = get_or_create_user(
-                self.db, 
+            user = await user_cache.get_user(
+                db, 
                 sender.id, 
                 sender.first_name,
                 getattr(sender, 'last_name', None),
@@ -165,18 +231,21 @@ class TelegramSummaryClient:
                 "/settings - Настроить время и частоту получения саммари\n"
                 "/list - Показать список чатов для саммари\n"
                 "/unsubscribe - Отписаться от чата (будет запрошен выбор)\n"
-                "/summary - Получить саммари прямо сейчас\n\n"
+                "/summary - Получить саммари прямо сейчас\n"
+                "/history [ID чата] - Показать прошлые саммари чата\n"
+                "/filters [ID чата] - Настроить предобработку переписки чата\n\n"
                 "Чтобы добавить чат для саммари, перешли мне любое сообщение из нужного чата."
             )
             await event.respond(help_text, parse_mode='md')
         
         # Обработчик команды /settings
         @self.bot.on(events.NewMessage(pattern='/settings'))
-        async def settings_handler(event):
+        @with_session
+        async def settings_handler(event, db: AsyncSession):
             """Обрабатывает команду /settings"""
             sender = await event.get_sender()
-            user = get_or_create_user(
-                self.db, 
+            user = await user_cache.get_user(
+                db, 
                 sender.id, 
                 sender.first_name,
                 getattr(sender, 'last_name', None),
@@ -187,7 +256,7 @@ class TelegramSummaryClient:
             
             # Получаем название модели из списка доступных
             model_name = settings.openrouter_model
-            model_display_name = AVAILABLE_MODELS.get(model_name, model_name)
+            model_display_name = get_model_display_name(model_name)
             
             await event.respond(
                 "⚙️ **Настройки**\n\n"
@@ -198,7 +267,7 @@ class TelegramSummaryClient:
                 "Чтобы изменить время доставки, отправь сообщение в формате:\n"
                 "`/time ЧЧ:ММ`\n\n"
                 "Чтобы изменить частоту, отправь:\n"
-                "`/frequency daily` или `/frequency weekly`\n\n"
+                "`/frequency hourly`, `/frequency daily` или `/frequency weekly`\n\n"
                 "Для выбора модели саммаризации используй:\n"
                 "`/models` - список доступных моделей\n"
                 "`/model ID_модели` - выбор конкретной модели",
@@ -207,11 +276,12 @@ class TelegramSummaryClient:
         
         # Обработчик команды /time
         @self.bot.on(events.NewMessage(pattern=r'/time\s+(\d{1,2}):(\d{1,2})'))
-        async def time_handler(event):
+        @with_session
+        async def time_handler(event, db: AsyncSession):
             """Обрабатывает команду /time для установки времени доставки"""
             sender = await event.get_sender()
-            user = get_or_create_user(
-                self.db, 
+            user = await user_cache.get_user(
+                db, 
                 sender.id, 
                 sender.first_name,
                 getattr(sender, 'last_name', None),
@@ -225,18 +295,20 @@ class TelegramSummaryClient:
             # Проверяем валидность времени
             if 0 <= hour <= 23 and 0 <= minute <= 59:
                 time_str = f"{hour:02d}:{minute:02d}"
-                update_user_settings(self.db, user.id, delivery_time=time_str)
+                await update_user_settings(db, user.id, delivery_time=time_str)
+                user_cache.invalidate(user.id)
                 await event.respond(f"✅ Время доставки саммари установлено на {time_str}")
             else:
                 await event.respond("❌ Некорректное время. Используйте формат ЧЧ:ММ в 24-часовом формате.")
         
         # Обработчик команды /frequency
-        @self.bot.on(events.NewMessage(pattern=r'/frequency\s+(daily|weekly)'))
-        async def frequency_handler(event):
+        @self.bot.on(events.NewMessage(pattern=r'/frequency\s+(hourly|daily|weekly)'))
+        @with_session
+        async def frequency_handler(event, db: AsyncSession):
             """Обрабатывает команду /frequency для установки частоты доставки"""
             sender = await event.get_sender()
-            user = get_or_create_user(
-                self.db, 
+            user = await user_cache.get_user(
+                db, 
                 sender.id, 
                 sender.first_name,
                 getattr(sender, 'last_name', None),
@@ -247,18 +319,20 @@ class TelegramSummaryClient:
             frequency = event.pattern_match.group(1)
             
             # Обновляем настройки пользователя
-            update_user_settings(self.db, user.id, delivery_frequency=frequency)
+            await update_user_settings(db, user.id, delivery_frequency=frequency)
+            user_cache.invalidate(user.id)
             
-            frequency_text = "ежедневно" if frequency == "daily" else "еженедельно"
+            frequency_text = {"hourly": "ежечасно", "daily": "ежедневно", "weekly": "еженедельно"}[frequency]
             await event.respond(f"✅ Частота доставки саммари установлена на {frequency_text}")
         
         # Обработчик команды /list
         @self.bot.on(events.NewMessage(pattern='/list'))
-        async def list_handler(event):
+        @with_session
+        async def list_handler(event, db: AsyncSession):
             """Обрабатывает команду /list для отображения списка подписок"""
             sender = await event.get_sender()
-            user = get_or_create_user(
-                self.db, 
+            user = await user_cache.get_user(
+                db, 
                 sender.id, 
                 sender.first_name,
                 getattr(sender, 'last_name', None),
@@ -284,11 +358,12 @@ class TelegramSummaryClient:
         
         # Обработчик команды /unsubscribe
         @self.bot.on(events.NewMessage(pattern='/unsubscribe'))
-        async def unsubscribe_handler(event):
+        @with_session
+        async def unsubscribe_handler(event, db: AsyncSession):
             """Обрабатывает команду /unsubscribe для отписки от чата"""
             sender = await event.get_sender()
-            user = get_or_create_user(
-                self.db, 
+            user = await user_cache.get_user(
+                db, 
                 sender.id, 
                 sender.first_name,
                 getattr(sender, 'last_name', None),
@@ -321,7 +396,8 @@ class TelegramSummaryClient:
         
         # Обработчик для завершения отписки
         @self.bot.on(events.NewMessage(pattern=r'^[0-9]+$'))
-        async def unsubscribe_confirm_handler(event):
+        @with_session
+        async def unsubscribe_confirm_handler(event, db: AsyncSession):
             """Обрабатывает выбор чата для отписки"""
             sender = await event.get_sender()
             
@@ -340,7 +416,9 @@ class TelegramSummaryClient:
                     sub = subscriptions[choice - 1]
                     
                     # Отписываем пользователя от чата
-                    if unsubscribe_from_chat(self.db, sub.user_id, sub.chat_id):
+                    unsubscribed = await unsubscribe_from_chat(db, sub.user_id, sub.chat_id)
+                    user_cache.invalidate(sub.user_id)
+                    if unsubscribed:
                         await event.respond(f"✅ Вы успешно отписались от чата {sub.chat_title}")
                     else:
                         await event.respond("❌ Не удалось отписаться от чата")
@@ -354,11 +432,12 @@ class TelegramSummaryClient:
         
         # Обработчик пересланных сообщений (для добавления чатов)
         @self.bot.on(events.NewMessage(func=lambda e: e.is_private and e.message.forward))
-        async def forwarded_handler(event):
+        @with_session
+        async def forwarded_handler(event, db: AsyncSession):
             """Обрабатывает пересланные сообщения для добавления чатов"""
             sender = await event.get_sender()
-            user = get_or_create_user(
-                self.db, 
+            user = await user_cache.get_user(
+                db, 
                 sender.id, 
                 sender.first_name,
                 getattr(sender, 'last_name', None),
@@ -472,7 +551,9 @@ class TelegramSummaryClient:
                             chat_title = f"Личный чат с {full_name}"
                         
                         # Подписываем пользователя на личный чат
-                        subscription = subscribe_to_chat(self.db, user.id, chat_id, chat_title)
+                        subscription = await subscribe_to_chat(db, user.id, chat_id, chat_title)
+                        user_cache.invalidate(user.id)
+                        self._track_chat(chat_id)
                         
                         await event.respond(
                             f"✅ Вы успешно подписались на саммари личного чата **{chat_title}**\n\n"
@@ -503,7 +584,9 @@ class TelegramSummaryClient:
                         chat_title = chat_entity.title
                     
                     # Подписываем пользователя на чат
-                    subscription = subscribe_to_chat(self.db, user.id, chat_id, chat_title)
+                    subscription = await subscribe_to_chat(db, user.id, chat_id, chat_title)
+                    user_cache.invalidate(user.id)
+                    self._track_chat(chat_id)
                     
                     await event.respond(
                         f"✅ Вы успешно подписались на саммари чата **{chat_title}**\n\n"
@@ -542,11 +625,12 @@ class TelegramSummaryClient:
         
         # Обработчик команды /summary для ручного запроса саммари
         @self.bot.on(events.NewMessage(pattern='/summary'))
-        async def summary_handler(event):
+        @with_session
+        async def summary_handler(event, db: AsyncSession):
             """Обрабатывает команду /summary для ручного запроса саммари"""
             sender = await event.get_sender()
-            user = get_or_create_user(
-                self.db, 
+            user = await user_cache.get_user(
+                db, 
                 sender.id, 
                 sender.first_name,
                 getattr(sender, 'last_name', None),
@@ -560,15 +644,133 @@ class TelegramSummaryClient:
                 await event.respond("У вас пока нет подписок на чаты. Чтобы добавить чат, перешлите мне сообщение из него.")
                 return
                 
-            await event.respond("🔄 Генерирую саммари для ваших чатов, это может занять некоторое время...")
-            
-            try:
-                # Генерируем саммари для всех чатов пользователя
-                await generate_and_send_summaries(self.client, self.db, user, self.bot, event.chat_id)
-            except Exception as e:
-                logger.error(f"Ошибка при генерации саммари: {str(e)}")
-                await event.respond(f"❌ Произошла ошибка при генерации саммари: {str(e)}")
+            # Саммари генерирует обработчик очереди задач; незавершенная задача переживет перезапуск
+            job = await enqueue_summary_job(db, user.id, event.chat_id, stream=SUMMARY_STREAMING)
+            if job is None:
+                await event.respond("⏳ Саммари для ваших чатов уже генерируется, дождитесь его, пожалуйста.")
+                return
+                
+            # В потоковом режиме у каждого чата есть свое сообщение, которое дописывается по мере генерации
+            if not SUMMARY_STREAMING:
+                await event.respond("🔄 Генерирую саммари для ваших чатов, это может занять некоторое время...")
+                
+            self.summary_jobs.notify()
         
+        # Обработчик команды /history для просмотра прошлых саммари
+        @self.bot.on(events.NewMessage(pattern=r'/history(?:\s+(\S+))?(?:\s+(\S+))?\s*$'))
+        @with_session
+        async def history_handler(event, db: AsyncSession):
+            """Обрабатывает команду /history: показывает саммари чата страницами от новых к старым"""
+            sender = await event.get_sender()
+            user = await user_cache.get_user(
+                db, 
+                sender.id, 
+                sender.first_name,
+                getattr(sender, 'last_name', None),
+                getattr(sender, 'username', None)
+            )
+            
+            chat_arg, cursor_arg = event.pattern_match.group(1), event.pattern_match.group(2)
+            subscriptions = [s for s in user.chats if s.is_active]
+            if not subscriptions:
+                await event.respond("У вас пока нет подписок на чаты. Чтобы добавить чат, перешлите мне сообщение из него.")
+                return
+                
+            # Без ID чата история показывается сразу, только если подписка одна
+            if chat_arg is None and len(subscriptions) > 1:
+                chats_list = "\n".join([f"• {sub.chat_title}: /history {sub.chat_id}" for sub in subscriptions])
+                await event.respond(f"Выберите чат, историю которого хотите посмотреть:\n\n{chats_list}")
+                return
+                
+            subscription = subscriptions[0]
+            if chat_arg is not None:
+                subscription = next((sub for sub in subscriptions if str(sub.chat_id) == chat_arg), None)
+                if subscription is None:
+                    await event.respond("❌ Чат не найден среди ваших подписок. Список чатов: /list")
+                    return
+                    
+            before = None
+            if cursor_arg is not None:
+                before = decode_history_cursor(cursor_arg)
+                if before is None:
+                    await event.respond("❌ Некорректная ссылка на страницу истории.")
+                    return
+                    
+            # Одно лишнее саммари показывает, есть ли следующая страница
+            history = await get_summary_history(db, subscription.id, before, HISTORY_PAGE_SIZE + 1)
+            page = history[:HISTORY_PAGE_SIZE]
+            if not page:
+                await event.respond(f"Сохраненных саммари чата {subscription.chat_title} больше нет.")
+                return
+                
+            for summary in page:
+                created_at = pytz.utc.localize(summary.created_at).astimezone(TIMEZONE).strftime("%d.%m.%Y %H:%M")
+                await event.respond(
+                    f"🗂 <b>Саммари чата {subscription.chat_title}</b>\n"
+                    f"<i>{created_at}, модель: {get_model_display_name(summary.model_used)}</i>\n\n"
+                    f"{summary.text}",
+                    parse_mode='html'
+                )
+                
+            if len(history) > HISTORY_PAGE_SIZE:
+                cursor = encode_history_cursor(*summary_history_key(page[-1]))
+                await event.respond(f"Более ранние саммари: /history {subscription.chat_id} {cursor}")
+                
+        # Обработчик команды /filters для настройки предобработки переписки
+        @self.bot.on(events.NewMessage(pattern=r'/filters(?:\s+(\S+))?(?:\s+(\S+)\s+(on|off))?\s*$'))
+        @with_session
+        async def filters_handler(event, db: AsyncSession):
+            """Обрабатывает команду /filters: показывает и переключает этапы предобработки чата"""
+            sender = await event.get_sender()
+            user = await user_cache.get_user(
+                db, 
+                sender.id, 
+                sender.first_name,
+                getattr(sender, 'last_name', None),
+                getattr(sender, 'username', None)
+            )
+            
+            chat_arg, stage_arg, switch_arg = event.pattern_match.groups()
+            subscriptions = [s for s in user.chats if s.is_active]
+            if not subscriptions:
+                await event.respond("У вас пока нет подписок на чаты. Чтобы добавить чат, перешлите мне сообщение из него.")
+                return
+                
+            # Без ID чата настройки показываются сразу, только если подписка одна
+            if chat_arg is None and len(subscriptions) > 1:
+                chats_list = "\n".join([f"• {sub.chat_title}: /filters {sub.chat_id}" for sub in subscriptions])
+                await event.respond(f"Выберите чат, предобработку которого хотите настроить:\n\n{chats_list}")
+                return
+                
+            subscription = subscriptions[0]
+            if chat_arg is not None:
+                subscription = next((sub for sub in subscriptions if str(sub.chat_id) == chat_arg), None)
+                if subscription is None:
+                    await event.respond("❌ Чат не найден среди ваших подписок. Список чатов: /list")
+                    return
+                    
+            stored = await get_preprocessing_stages(db, [subscription.id])
+            stages = parse_stages(stored.get(subscription.id))
+            
+            if stage_arg is not None:
+                if stage_arg not in STAGES:
+                    await event.respond(f"❌ Неизвестный этап предобработки. Доступные этапы: {', '.join(STAGES)}")
+                    return
+                    
+                enabled = set(stages) | {stage_arg} if switch_arg == 'on' else set(stages) - {stage_arg}
+                stages = [stage for stage in STAGES if stage in enabled]
+                await set_preprocessing_stages(db, subscription.id, stages)
+                user_cache.invalidate(user.id)
+                
+            stages_list = "\n".join([
+                f"{'✅' if stage in stages else '❌'} {stage} - {description}"
+                for stage, (description, _) in STAGES.items()
+            ])
+            await event.respond(
+                f"Предобработка переписки чата {subscription.chat_title}:\n\n{stages_list}\n\n"
+                f"Чтобы включить или выключить этап: /filters {subscription.chat_id} <этап> on|off"
+            )
+            
         # Обработчик команды /models
         @self.bot.on(events.NewMessage(pattern='/models'))
         async def models_handler(event):
@@ -581,11 +783,12 @@ class TelegramSummaryClient:
             
         # Обработчик команды /model
         @self.bot.on(events.NewMessage(pattern=r'/model\s+(.+)'))
-        async def model_handler(event):
+        @with_session
+        async def model_handler(event, db: AsyncSession):
             """Обрабатывает команду /model для установки модели для саммаризации"""
             sender = await event.get_sender()
-            user = get_or_create_user(
-                self.db, 
+            user = await user_cache.get_user(
+                db, 
                 sender.id, 
                 sender.first_name,
                 getattr(sender, 'last_name', None),
@@ -598,8 +801,9 @@ class TelegramSummaryClient:
             # Проверяем, что модель существует в списке доступных
             if model_id in AVAILABLE_MODELS:
                 # Обновляем настройки пользователя
-                update_user_settings(self.db, user.id, openrouter_model=model_id)
-                model_display_name = AVAILABLE_MODELS[model_id]
+                await update_user_settings(db, user.id, openrouter_model=model_id)
+                user_cache.invalidate(user.id)
+                model_display_name = get_model_display_name(model_id)
                 
                 await event.respond(
                     f"✅ Модель для саммаризации успешно изменена на:\n"
@@ -619,16 +823,70 @@ class TelegramSummaryClient:
                 models_list = await list_available_models()
                 await event.respond(models_list, parse_mode='html')
 
-async def generate_and_send_summaries(client, db: Session, user: User, bot=None, chat_id=None):
+
+# Ограничения параллельной обработки чатов: общее для процесса и для каждого пользователя.
+# Семафор пользователя хранится, только пока обрабатываются его чаты, поэтому словарь
+# не растет с числом пользователей
+_global_semaphore = asyncio.Semaphore(SUMMARY_CONCURRENCY)
+_user_semaphores: weakref.WeakValueDictionary[int, asyncio.Semaphore] = weakref.WeakValueDictionary()
+
+# Фоновые задачи, которые сохраняют саммари после доставки по расписанию
+_delivery_tasks = set()
+
+
+class _Replies:
+    """Ответы пользователю по одной подписке и сохранение саммари, которое выполняется после их отправки"""
+
+    def __init__(self, messages: List[Tuple[str, Optional[str]]],
+                 record: Callable[[], Awaitable[None]] = None,
+                 no_messages: bool = False, retry_error: Exception = None):
+        """
+        Args:
+            messages: Сообщения для отправки и режим их разметки
+            record: Сохраняет саммари и сдвигает окно сообщений (None - сохранять нечего)
+            no_messages: В чате нет новых сообщений
+            retry_error: Временная ошибка модели, из-за которой задачу стоит повторить
+        """
+        self.messages = messages
+        self.record = record
+        self.no_messages = no_messages
+        self.retry_error = retry_error
+        
+    async def delivered(self):
+        """Сохраняет саммари после того, как ответы отправлены пользователю"""
+        if self.record is not None:
+            await self.record()
+
+
+def _is_retryable(error: BaseException) -> bool:
+    """Ошибка модели временная, и задачу очереди имеет смысл повторить"""
+    return isinstance(error, OpenRouterError) and error.retryable
+
+
+async def generate_and_send_summaries(client, user: User, bot=None, chat_id=None,
+                                      message_sync: MessageSync = None, stream: bool = False,
+                                      retry_failures: bool = False, resumed: bool = False):
     """
     Генерирует и отправляет саммари для всех чатов пользователя
     
+    Чаты обрабатываются параллельно в пределах глобального и пользовательского лимитов,
+    а саммари отправляются в порядке подписок по мере готовности. В потоковом режиме
+    для каждого чата сразу отправляется сообщение, которое дописывается по мере генерации.
+    Саммари чата сохраняется, а окно его сообщений сдвигается только после отправки.
+    
     Args:
         client: Telegram клиент
-        db: Сессия базы данных
-        user: Пользователь
-        bot: Telegram бот (опционально)
+        user: Пользователь (с загруженными настройками и подписками)
+        bot: Telegram бот или очередь доставки (опционально)
         chat_id: ID чата для отправки (опционально)
+        message_sync: Синхронизация локального хранилища сообщений (опционально)
+        stream: Показывать саммари по мере генерации
+        retry_failures: Временная ошибка модели не превращается в окончательный ответ:
+            остальные чаты отправляются, а ошибка передается вызывающему, чтобы задача была повторена
+        resumed: Повтор задачи: чаты без новых сообщений уже получили ответ и пропускаются
+        
+    Raises:
+        OpenRouterError: Если retry_failures и саммари какого-то чата не удалось сгенерировать из-за временной ошибки
     """
     # Получаем активные подписки пользователя
     subscriptions = [s for s in user.chats if s.is_active]
@@ -639,149 +897,678 @@ async def generate_and_send_summaries(client, db: Session, user: User, bot=None,
             await bot.send_message(chat_id, "У вас нет активных подписок на чаты.")
         return
     
-    # Получаем выбранную пользователем модель
-    user_model = get_user_model(db, user.id)
+    # Настройки загружены вместе с пользователем
+    user_model = user.openrouter_model
     logger.info(f"Пользователь {user.telegram_id} использует модель: {user_model}")
+    
+    async with get_session() as db:
+        stages_by_subscription = await get_preprocessing_stages(db, [s.id for s in subscriptions])
+        rolling_states = await _get_rolling_states(db, subscriptions) if user.incremental_summaries else {}
+    
+    # Сообщения, которые дописываются по мере генерации саммари. При повторе задачи
+    # заранее неизвестно, каким чатам понадобится ответ, поэтому заглушки не отправляются
+    progressive = {}
+    if stream and bot and chat_id and not resumed:
+        progressive = {
+            subscription.id: ProgressiveMessage(bot, chat_id, f"📝 Саммари чата {subscription.chat_title}")
+            for subscription in subscriptions
+        }
         
-    # Генерируем саммари для каждой подписки
-    for subscription in subscriptions:
-        try:
-            # Проверяем, является ли это приватным чатом
-            is_private_chat = str(subscription.chat_id).startswith('user_') or str(subscription.chat_id).startswith('name_')
+    # Запускаем обработку всех подписок параллельно
+    user_semaphore = _user_semaphores.setdefault(user.id, asyncio.Semaphore(SUMMARY_USER_CONCURRENCY))
+    tasks = [
+        asyncio.create_task(
+            _summarize_subscription_limited(
+                client, subscription, user_model, message_sync, user_semaphore,
+                stages=parse_stages(stages_by_subscription.get(subscription.id)),
+                incremental=user.incremental_summaries,
+                rolling_state=rolling_states.get(subscription.id),
+                on_text=progressive[subscription.id].update if progressive else None,
+                retry_failures=retry_failures
+            )
+        )
+        for subscription in subscriptions
+    ]
+    retry_error = None
+    
+    try:
+        # Заглушки отправляются в порядке подписок, пока саммари уже генерируются
+        for message in progressive.values():
+            try:
+                await message.start()
+            except Exception as e:
+                logger.error(f"Ошибка при отправке сообщения-заглушки: {str(e)}")
+                
+        # Отправляем результаты в порядке подписок, не дожидаясь остальных чатов
+        for subscription, task in zip(subscriptions, tasks):
+            replies = await task
+            retry_error = retry_error or replies.retry_error
+            if resumed and replies.no_messages:
+                continue
+                
+            if not (bot and chat_id):
+                await replies.delivered()
+                continue
+                
+            try:
+                for index, (text, parse_mode) in enumerate(replies.messages):
+                    if progressive and index == 0:
+                        await progressive[subscription.id].finish(text, parse_mode)
+                    else:
+                        await bot.send_message(chat_id, text, parse_mode=parse_mode)
+                await replies.delivered()
+            except Exception as e:
+                logger.error(f"Ошибка при отправке саммари чата {subscription.chat_title}: {str(e)}")
+    finally:
+        for task in tasks:
+            task.cancel()
             
-            if is_private_chat:
-                # Обработка приватного чата
-                logger.info(f"Обрабатываем приватный чат: {subscription.chat_title}")
+    if retry_error is not None:
+        raise retry_error
+        
+    logger.info(f"Саммари сгенерированы для пользователя {user.telegram_id}")
+
+
+async def _summarize_subscription_limited(client, subscription: ChatSubscription, user_model: str,
+                                          message_sync: Optional[MessageSync],
+                                          user_semaphore: asyncio.Semaphore,
+                                          stages: List[str] = None,
+                                          incremental: bool = False,
+                                          rolling_state: Optional[str] = None,
+                                          on_text: Callable[[str], Awaitable[None]] = None,
+                                          retry_failures: bool = False) -> "_Replies":
+    """
+    Обрабатывает подписку с учетом ограничений параллельности
+    
+    Ошибка в одном чате не влияет на остальные: она превращается в сообщение для пользователя.
+    
+    Args:
+        client: Telegram клиент
+        subscription: Подписка на чат
+        user_model: Модель для саммаризации
+        message_sync: Синхронизация локального хранилища сообщений
+        user_semaphore: Ограничение параллельности для пользователя
+        stages: Этапы предобработки переписки (по умолчанию - этапы из настроек)
+        incremental: Саммари строится инкрементально
+        rolling_state: Состояние инкрементального саммари в JSON (None - строится заново)
+        on_text: Получатель текста саммари по мере генерации (опционально)
+        retry_failures: Временная ошибка модели сообщается как повторяемая (см. _summarize_subscription)
+        
+    Returns:
+        _Replies: Сообщения для отправки пользователю
+    """
+    async with user_semaphore:
+        async with _global_semaphore:
+            try:
+                return await _summarize_subscription(
+                    client, subscription, user_model, message_sync, stages, incremental, rolling_state, on_text,
+                    retry_failures
+                )
+            except Exception as e:
+                logger.error(f"Ошибка при генерации саммари для чата {subscription.chat_title}: {str(e)}")
+                return _Replies([(f"❌ Не удалось сгенерировать саммари для чата {subscription.chat_title}: {str(e)}", None)])
+
+
+async def generate_and_send_chat_summaries(client, users: List[User],
+                                           delivery_queue: DeliveryQueue = None,
+                                           message_sync: MessageSync = None, deliver_at: datetime = None,
+                                           retry_failures: bool = False):
+    """
+    Генерирует саммари для группы пользователей, обрабатывая каждый чат один раз, и ставит их в очередь доставки
+    
+    Подписки группируются по чату и окну сообщений: окно загружается один раз,
+    саммари генерируется один раз для каждой модели и рассылается всем подписчикам.
+    Саммари ставятся в очередь доставки в личный чат каждого пользователя с ботом,
+    и функция возвращается, не дожидаясь доставки. Саммари подписки сохраняется, а окно
+    ее сообщений сдвигается в фоне после доставки (_record_delivered), поэтому саммари,
+    которое не дошло до пользователя, будет построено заново при следующем запуске.
+    
+    Args:
+        client: Telegram клиент
+        users: Пользователи, которым пора отправить саммари (с загруженными настройками и подписками)
+        delivery_queue: Очередь доставки сообщений бота (опционально)
+        message_sync: Синхронизация локального хранилища сообщений (опционально)
+        deliver_at: Время (UTC), раньше которого саммари не отправляются (опционально)
+        retry_failures: При временной ошибке модели ничего не отправлять, а передать ошибку
+            вызывающему, чтобы задачи были повторены (готовые саммари при повторе берутся из кэша)
+        
+    Raises:
+        OpenRouterError: Если retry_failures и саммари какого-то чата не удалось сгенерировать из-за временной ошибки
+    """
+    async with get_session() as db:
+        stages_by_subscription = await get_preprocessing_stages(
+            db, [subscription.id for user in users for subscription in user.chats]
+        )
+        rolling_states = await _get_rolling_states(
+            db, [subscription for user in users if user.incremental_summaries for subscription in user.chats]
+        )
+        
+    # Группируем подписки по чату, началу окна сообщений, этапам предобработки и режиму саммари
+    groups: Dict[Tuple[str, Optional[int], Tuple[str, ...], bool], List[Tuple[ChatSubscription, str]]] = {}
+    for user in users:
+        for subscription in user.chats:
+            if subscription.is_active:
+                stages = tuple(parse_stages(stages_by_subscription.get(subscription.id)))
+                key = (str(subscription.chat_id), subscription.last_processed_message_id, stages,
+                       user.incremental_summaries)
+                groups.setdefault(key, []).append((subscription, user.openrouter_model))
                 
-                # Для чатов с user_id
-                if str(subscription.chat_id).startswith('user_'):
-                    user_id = int(str(subscription.chat_id).replace('user_', ''))
-                    logger.info(f"Извлечен user_id: {user_id}")
-                    
-                    # Получаем сущность пользователя
-                    try:
-                        chat_entity = await client.get_entity(user_id)
-                    except Exception as e:
-                        logger.error(f"Не удалось получить сущность пользователя {user_id}: {str(e)}")
-                        if bot and chat_id:
-                            await bot.send_message(
-                                chat_id,
-                                f"❌ Не удалось получить доступ к чату {subscription.chat_title}: {str(e)}"
-                            )
-                        continue
-                else:
-                    # Для чатов с именем без user_id
-                    logger.warning(f"Чат идентифицирован только по имени: {subscription.chat_title}")
-                    if bot and chat_id:
-                        await bot.send_message(
-                            chat_id,
-                            f"⚠️ Чат {subscription.chat_title} идентифицирован только по имени. "
-                            f"Для корректной работы переслите новое сообщение из этого чата."
-                        )
-                    continue
-                
-                # Определяем начальное сообщение
-                last_processed_id = subscription.last_processed_message_id
-                
-                # Для приватных чатов получаем диалог с пользователем
-                # Если нет последнего обработанного сообщения, берем сообщения за последние 24 часа
-                if not last_processed_id:
-                    # Получаем сообщения за последние 24 часа
-                    yesterday = datetime.now(TIMEZONE) - timedelta(days=1)
-                    messages = await client.get_messages(
-                        chat_entity,  # Используем entity пользователя
-                        limit=100,    # Ограничиваем количество сообщений
-                        offset_date=yesterday
-                    )
-                else:
-                    # Получаем сообщения с момента последнего обработанного
-                    messages = await client.get_messages(
-                        chat_entity,  # Используем entity пользователя
-                        limit=100,
-                        min_id=last_processed_id
-                    )
-            else:
-                # Обработка групп и каналов (стандартная логика)
-                chat_entity = await client.get_entity(subscription.chat_id)
-                
-                # Определяем начальное сообщение
-                last_processed_id = subscription.last_processed_message_id
-                
-                # Если нет последнего обработанного сообщения, берем сообщения за последние 24 часа
-                if not last_processed_id:
-                    # Получаем сообщения за последние 24 часа
-                    yesterday = datetime.now(TIMEZONE) - timedelta(days=1)
-                    messages = await client.get_messages(
-                        chat_entity,
-                        limit=100,  # Ограничиваем количество сообщений
-                        offset_date=yesterday
-                    )
-                else:
-                    # Получаем сообщения с момента последнего обработанного
-                    messages = await client.get_messages(
-                        chat_entity,
-                        limit=100,
-                        min_id=last_processed_id
-                    )
+    logger.info(f"Саммари для {len(users)} пользователей: {len(groups)} уникальных окон чатов")
+    
+    async def process_group(stages, incremental, members):
+        async with _global_semaphore:
+            return await _summarize_chat_group(
+                client, members, message_sync, list(stages), incremental, rolling_states, retry_failures
+            )
             
-            # Проверяем, есть ли новые сообщения
-            if not messages:
-                logger.info(f"Нет новых сообщений в чате {subscription.chat_title}")
-                if bot and chat_id:
-                    await bot.send_message(
-                        chat_id,
-                        f"Нет новых сообщений в чате {subscription.chat_title} с момента последнего саммари."
-                    )
+    results = await asyncio.gather(*[
+        process_group(stages, incremental, members)
+        for (_, _, stages, incremental), members in groups.items()
+    ])
+    
+    # Собираем ответы по подпискам и отправляем каждому пользователю в порядке его подписок
+    replies_by_subscription = {}
+    for group_replies in results:
+        replies_by_subscription.update(group_replies)
+        
+    deliveries = []
+    for user in users:
+        for subscription in user.chats:
+            replies = replies_by_subscription.get(subscription.id)
+            if replies is None:
                 continue
                 
-            # Сортируем сообщения по ID
-            messages = sorted(messages, key=lambda m: m.id)
+            futures = []
+            if delivery_queue:
+                futures = [
+                    delivery_queue.enqueue(user.telegram_id, text, parse_mode, deliver_at)
+                    for text, parse_mode in replies.messages
+                ]
+            deliveries.append((user, subscription, replies, futures))
             
-            # Собираем тексты сообщений
-            messages_text = ""
-            for msg in messages:
-                if msg.message:
-                    sender = await client.get_entity(msg.sender_id) if msg.sender_id else None
-                    sender_name = f"{getattr(sender, 'first_name', '')} {getattr(sender, 'last_name', '')}".strip() if sender else "Unknown"
-                    
-                    # Форматируем сообщение
-                    timestamp = msg.date.astimezone(TIMEZONE).strftime("%d.%m %H:%M")
-                    messages_text += f"[{timestamp}] {sender_name}: {msg.message}\n\n"
+    # Доставка отслеживается отдельно: обработчик очереди задач не ждет времени доставки
+    task = asyncio.create_task(_record_delivered(deliveries))
+    _delivery_tasks.add(task)
+    task.add_done_callback(_delivery_tasks.discard)
+    
+    logger.info(f"Саммари сгенерированы для {len(users)} пользователей")
+
+
+async def _record_delivered(deliveries: List[Tuple[User, ChatSubscription, "_Replies", List[asyncio.Future]]]):
+    """
+    Дожидается доставки саммари и сохраняет саммари подписок, сообщения которых доставлены
+    
+    Args:
+        deliveries: Пользователь, подписка, ее ответы и результаты их отправки
+    """
+    for user, subscription, replies, futures in deliveries:
+        try:
+            await asyncio.gather(*futures)
+        except Exception as e:
+            logger.error(f"Ошибка при отправке саммари пользователю {user.telegram_id}: {str(e)}")
+            continue
             
-            # Генерируем саммари с использованием выбранной модели
-            summary_text = await generate_summary(messages_text, user_model)
+        try:
+            await replies.delivered()
+        except Exception as e:
+            logger.error(f"Ошибка при сохранении саммари чата {subscription.chat_title}: {str(e)}")
+
+
+class WindowUnavailableError(Exception):
+    """Окно сообщений чата не может быть загружено; текст ошибки предназначен для пользователя"""
+
+
+async def _summarize_chat_group(client, members: List[Tuple[ChatSubscription, str]],
+                                message_sync: MessageSync = None,
+                                stages: List[str] = None, incremental: bool = False,
+                                rolling_states: Dict[int, str] = None,
+                                retry_failures: bool = False) -> Dict[int, "_Replies"]:
+    """
+    Обрабатывает подписки разных пользователей на одно и то же окно сообщений чата
+    
+    Саммари подписок сохраняются вызовом _Replies.delivered после доставки.
+    
+    Args:
+        client: Telegram клиент
+        members: Подписки и выбранные их владельцами модели
+        message_sync: Синхронизация локального хранилища сообщений (опционально)
+        stages: Этапы предобработки переписки, общие для всех подписок группы
+        incremental: Саммари подписок группы строятся инкрементально
+        rolling_states: Состояния инкрементальных саммари в JSON по ID подписки (опционально)
+        retry_failures: Передавать временные ошибки модели вызывающему вместо ответа об ошибке
+        
+    Returns:
+        Dict[int, _Replies]: Сообщения для отправки по ID подписки
+        
+    Raises:
+        OpenRouterError: Если retry_failures и саммари не удалось сгенерировать из-за временной ошибки
+    """
+    first_subscription = members[0][0]
+    
+    try:
+        async with get_session() as db:
+            state, transcript = await _fetch_window(client, db, first_subscription, message_sync, stages)
+    except WindowUnavailableError as e:
+        return {subscription.id: _Replies([(str(e), None)]) for subscription, _ in members}
+    except Exception as e:
+        logger.error(f"Ошибка при загрузке сообщений чата {first_subscription.chat_title}: {str(e)}")
+        error_text = f"❌ Не удалось сгенерировать саммари для чата {first_subscription.chat_title}: {str(e)}"
+        return {subscription.id: _Replies([(error_text, None)]) for subscription, _ in members}
+        
+    if not state.count:
+        return {
+            subscription.id: _Replies([(_no_messages_reply(subscription), None)], no_messages=True)
+            for subscription, _ in members
+        }
+        
+    if not transcript.lines:
+        return {
+            subscription.id: _Replies(
+                [(_nothing_to_summarize_reply(subscription), None)],
+                functools.partial(_record_summary, subscription, state, None, model)
+            )
+            for subscription, model in members
+        }
+        
+    # Генерируем саммари один раз для каждой модели (и состояния инкрементального саммари)
+    rolling_states = rolling_states or {}
+    variants = list(dict.fromkeys(
+        (model, rolling_states.get(subscription.id)) for subscription, model in members
+    ))
+    results = await asyncio.gather(*[
+        _summarize_window(first_subscription, state, transcript, model, stages,
+                          incremental=incremental, rolling_state=rolling_state)
+        for model, rolling_state in variants
+    ], return_exceptions=True)
+    if retry_failures:
+        for result in results:
+            if _is_retryable(result):
+                raise result
+                
+    result_by_variant = dict(zip(variants, results))
+    error_by_variant = {
+        variant: format_summary_error(result)
+        for variant, result in result_by_variant.items() if isinstance(result, BaseException)
+    }
+    
+    replies = {}
+    for subscription, model in members:
+        variant = (model, rolling_states.get(subscription.id))
+        if variant in error_by_variant:
+            replies[subscription.id] = _Replies([(_summary_error_reply(subscription, error_by_variant[variant]), None)])
+            continue
             
-            # Записываем саммари в базу данных
-            summary = save_summary(
-                db, 
-                subscription.id, 
-                summary_text,
-                messages[0].id if messages else None,
-                messages[-1].id if messages else None,
-                model_used=user_model
+        response, used_model = result_by_variant[variant]
+        summary_text, new_state = _split_summary_response(response, incremental)
+        replies[subscription.id] = _Replies(
+            [(_format_summary_reply(subscription, state, summary_text, used_model), 'html')],
+            functools.partial(
+                _record_summary, subscription, state, summary_text, used_model, new_state,
+                full_refresh=variant[1] is None
             )
+        )
+        
+    return replies
+
+
+async def _summarize_subscription(client, subscription: ChatSubscription, user_model: str,
+                                  message_sync: MessageSync = None,
+                                  stages: List[str] = None,
+                                  incremental: bool = False,
+                                  rolling_state: Optional[str] = None,
+                                  on_text: Callable[[str], Awaitable[None]] = None,
+                                  retry_failures: bool = False) -> "_Replies":
+    """
+    Загружает новые сообщения чата и генерирует по ним саммари
+    
+    Саммари сохраняется вызовом _Replies.delivered после отправки пользователю.
+    
+    Args:
+        client: Telegram клиент
+        subscription: Подписка на чат
+        user_model: Модель для саммаризации
+        message_sync: Синхронизация локального хранилища сообщений (опционально)
+        stages: Этапы предобработки переписки (по умолчанию - этапы из настроек)
+        incremental: Саммари строится инкрементально
+        rolling_state: Состояние инкрементального саммари в JSON (None - строится заново)
+        on_text: Получатель текста саммари по мере генерации (опционально)
+        retry_failures: При временной ошибке модели вместо окончательного ответа об ошибке
+            вернуть ответ о повторе вместе с самой ошибкой (_Replies.retry_error)
+        
+    Returns:
+        _Replies: Сообщения для отправки пользователю
+    """
+    try:
+        async with get_session() as db:
+            state, transcript = await _fetch_window(client, db, subscription, message_sync, stages)
+    except WindowUnavailableError as e:
+        return _Replies([(str(e), None)])
+    
+    # Проверяем, есть ли новые сообщения
+    if not state.count:
+        return _Replies([(_no_messages_reply(subscription), None)], no_messages=True)
+        
+    # Все сообщения окна убраны предобработкой: окно считается обработанным без саммари
+    if not transcript.lines:
+        return _Replies(
+            [(_nothing_to_summarize_reply(subscription), None)],
+            functools.partial(_record_summary, subscription, state, None, user_model)
+        )
+        
+    try:
+        response, used_model = await _summarize_window(
+            subscription, state, transcript, user_model, stages, on_text, incremental, rolling_state
+        )
+    except Exception as e:
+        if retry_failures and _is_retryable(e):
+            return _Replies([(_summary_retry_reply(subscription, format_summary_error(e)), None)], retry_error=e)
+        return _Replies([(_summary_error_reply(subscription, format_summary_error(e)), None)])
+        
+    summary_text, new_state = _split_summary_response(response, incremental)
+    return _Replies(
+        [(_format_summary_reply(subscription, state, summary_text, used_model), 'html')],
+        functools.partial(
+            _record_summary, subscription, state, summary_text, used_model, new_state,
+            full_refresh=rolling_state is None
+        )
+    )
+
+
+async def _fetch_window(client, db: AsyncSession, subscription: ChatSubscription,
+                        message_sync: MessageSync = None,
+                        stages: List[str] = None) -> Tuple[IngestionState, Transcript]:
+    """
+    Загружает сообщения чата с момента последнего обработанного и формирует из них переписку
+    
+    Args:
+        client: Telegram клиент
+        db: Сессия базы данных
+        subscription: Подписка на чат
+        message_sync: Синхронизация локального хранилища сообщений (опционально)
+        stages: Этапы предобработки переписки (по умолчанию - этапы из настроек)
+        
+    Returns:
+        Tuple[IngestionState, Transcript]: Состояние обхода окна и переписка
+        
+    Raises:
+        WindowUnavailableError: Если к чату нет доступа
+    """
+    state = IngestionState(subscription.last_processed_message_id)
+    
+    # Если локальное хранилище покрывает окно, читаем из него без обращения к Telegram
+    store_peer_id = None
+    if message_sync:
+        store_peer_id = await message_sync.get_live_peer(subscription.chat_id, state.last_id)
+        
+    if store_peer_id is not None:
+        pages = iter_stored_pages(db, store_peer_id, state)
+    else:
+        # Проверяем, является ли это приватным чатом
+        is_private_chat = str(subscription.chat_id).startswith('user_') or str(subscription.chat_id).startswith('name_')
+        
+        if is_private_chat:
+            # Обработка приватного чата
+            logger.info(f"Обрабатываем приватный чат: {subscription.chat_title}")
             
-            # Обновляем последнее обработанное сообщение
-            if messages:
-                update_last_processed_message(db, subscription.id, messages[-1].id)
-            
-            # Отправляем саммари пользователю
-            if bot and chat_id:
-                model_display_name = AVAILABLE_MODELS.get(user_model, user_model)
-                await bot.send_message(
-                    chat_id,
-                    f"📝 <b>Саммари чата {subscription.chat_title}</b>\n"
-                    f"<i>Модель: {model_display_name}</i>\n\n"
-                    f"{summary_text}",
-                    parse_mode='html'
-                )
+            # Для чатов с user_id
+            if str(subscription.chat_id).startswith('user_'):
+                user_id = int(str(subscription.chat_id).replace('user_', ''))
+                logger.info(f"Извлечен user_id: {user_id}")
                 
-        except Exception as e:
-            logger.error(f"Ошибка при генерации саммари для чата {subscription.chat_title}: {str(e)}")
-            if bot and chat_id:
-                await bot.send_message(
-                    chat_id,
-                    f"❌ Не удалось сгенерировать саммари для чата {subscription.chat_title}: {str(e)}"
+                # Получаем сущность пользователя
+                try:
+                    chat_entity = await client.get_entity(user_id)
+                except Exception as e:
+                    logger.error(f"Не удалось получить сущность пользователя {user_id}: {str(e)}")
+                    raise WindowUnavailableError(
+                        f"❌ Не удалось получить доступ к чату {subscription.chat_title}: {str(e)}"
+                    )
+            else:
+                # Для чатов с именем без user_id
+                logger.warning(f"Чат идентифицирован только по имени: {subscription.chat_title}")
+                raise WindowUnavailableError(
+                    f"⚠️ Чат {subscription.chat_title} идентифицирован только по имени. "
+                    f"Для корректной работы переслите новое сообщение из этого чата."
                 )
+        else:
+            # Обработка групп и каналов (стандартная логика)
+            chat_entity = await client.get_entity(subscription.chat_id)
+        
+        # Обходим все сообщения с момента последнего обработанного.
+        # Если его нет, берем сообщения за последние 24 часа
+        offset_date = None
+        if not state.last_id:
+            offset_date = datetime.now(TIMEZONE) - timedelta(days=1)
+        pages = iter_message_pages(client, chat_entity, state, offset_date=offset_date)
+    
+    # Собираем сообщения постранично, не держа в памяти сами сообщения Telegram
+    messages = []
+    async for page in pages:
+        # Имена отправителей определяются пакетно для всей страницы
+        sender_names = await resolve_sender_names(client, db, page)
+        for msg in page:
+            if getattr(msg, 'message', None) or getattr(msg, 'action', None) is not None:
+                sender_name = sender_names.get(msg.sender_id, UNKNOWN_SENDER)
                 
-    logger.info(f"Саммари сгенерированы для пользователя {user.telegram_id}") 
\ No newline at end of file
+                # В хранилище время хранится в UTC без зоны
+                date = msg.date if msg.date.tzinfo else pytz.utc.localize(msg.date)
+                messages.append(TranscriptMessage.from_message(msg, sender_name, date.astimezone(TIMEZONE)))
+                
+        # Завершаем транзакцию: соединение возвращается в пул, пока следующая страница загружается
+        await db.commit()
+        
+    # Убираем из переписки то, что не влияет на саммари, и форматируем оставшееся
+    stats = PreprocessingStats()
+    transcript = build_transcript(list(preprocess(messages, stages, stats)))
+    if messages:
+        logger.info(f"Предобработка чата {subscription.chat_title}: {stats.describe()}")
+        
+    return state, transcript
+
+
+async def _summarize_window(subscription: ChatSubscription, state: IngestionState,
+                            transcript: Transcript, model: str, stages: List[str] = None,
+                            on_text: Callable[[str], Awaitable[None]] = None,
+                            incremental: bool = False, rolling_state: Optional[str] = None) -> Tuple[str, str]:
+    """
+    Генерирует саммари окна сообщений, используя кэш саммари
+    
+    Модель auto заменяется моделью, выбранной для размера переписки, до обращения к кэшу,
+    поэтому в ключе кэша и в сохраненном саммари всегда указана модель, которая его построила.
+    
+    Args:
+        subscription: Подписка на чат (любая из подписок на это окно)
+        state: Состояние обхода окна
+        transcript: Переписка
+        model: Модель для саммаризации
+        stages: Этапы предобработки, которыми получена переписка
+        on_text: Получатель текста саммари по мере генерации (опционально, кроме инкрементального режима)
+        incremental: Обновить инкрементальное саммари вместо саммаризации окна с нуля
+        rolling_state: Состояние инкрементального саммари в JSON (None - строится заново)
+        
+    Returns:
+        Tuple[str, str]: Текст саммари (в инкрементальном режиме - ответ модели для
+            _split_summary_response) и модель, которой оно построено
+        
+    Raises:
+        OpenRouterError: Если саммари не удалось сгенерировать
+    """
+    # Одинаковое окно сообщений с той же моделью и предобработкой уже могло быть
+    # саммаризировано, например для другого подписчика чата
+    model = resolve_request_model(model, estimate_tokens(transcript.text()))
+    variant = ",".join(DEFAULT_STAGES if stages is None else stages)
+    if incremental:
+        variant += f"|incremental:{rolling_state or ''}"
+    cache_key = get_summary_cache_key(subscription.chat_id, state.first_id, state.last_id, model, variant)
+    async with get_session() as db:
+        summary_text = await get_cached_summary(db, cache_key)
+    
+    if summary_text is not None:
+        logger.info(f"Саммари чата {subscription.chat_title} взято из кэша")
+        return summary_text, model
+        
+    # Генерируем саммари с использованием выбранной модели.
+    # Большие окна саммаризируются по частям. Инкрементальный ответ - JSON,
+    # поэтому по мере генерации он не показывается
+    if incremental:
+        summary_text = await summarize_incremental(transcript, rolling_state, model)
+    else:
+        summary_text = await summarize_messages(transcript, model, on_text)
+    async with get_session() as db:
+        await save_cached_summary(db, cache_key, summary_text, model)
+    return summary_text, model
+
+
+async def _record_summary(subscription: ChatSubscription, state: IngestionState,
+                          summary_text: Optional[str], model: str,
+                          rolling_state: Optional[str] = None, full_refresh: bool = False):
+    """
+    Сохраняет саммари подписки и сдвигает последнее обработанное сообщение
+    
+    Обе записи выполняются одной транзакцией и только если окно еще не было обработано,
+    поэтому повторное выполнение задачи очереди не создает дубликатов.
+    
+    Args:
+        subscription: Подписка на чат
+        state: Состояние обхода окна
+        summary_text: Текст саммари или None, если в окне нечего саммаризировать
+        model: Использованная модель
+        rolling_state: Новое состояние инкрементального саммари в JSON (опционально)
+        full_refresh: Состояние построено заново, а не обновлено
+    """
+    # Если окно было обрезано по лимиту, следующий запуск продолжит с его последнего сообщения
+    async with get_session() as db:
+        recorded = await record_summary_window(
+            db,
+            subscription.id,
+            summary_text,
+            state.first_id,
+            state.last_id,
+            model,
+            expected_last_id=state.start_id,
+            state=rolling_state,
+            full_refresh=full_refresh
+        )
+    if not recorded:
+        logger.warning(f"Окно сообщений чата {subscription.chat_title} уже обработано, саммари не сохранено")
+
+
+async def _get_rolling_states(db: AsyncSession, subscriptions: List[ChatSubscription]) -> Dict[int, str]:
+    """
+    Получает состояния инкрементальных саммари, которые можно обновлять
+    
+    Состояние, обновленное SUMMARY_STATE_REFRESH_RUNS раз подряд или не обновлявшееся дольше
+    SUMMARY_STATE_MAX_AGE секунд, не используется: саммари строится заново, чтобы ошибки
+    и устаревшие пункты не накапливались.
+    
+    Args:
+        db: Сессия базы данных
+        subscriptions: Подписки с инкрементальными саммари
+        
+    Returns:
+        Dict[int, str]: Состояния в JSON по ID подписки (подписок, для которых состояние строится заново, в словаре нет)
+    """
+    if not subscriptions:
+        return {}
+        
+    stale_before = datetime.utcnow() - timedelta(seconds=SUMMARY_STATE_MAX_AGE)
+    states = await get_summary_states(db, [subscription.id for subscription in subscriptions])
+    return {
+        subscription_id: summary_state.state
+        for subscription_id, summary_state in states.items()
+        if summary_state.updates_since_refresh < SUMMARY_STATE_REFRESH_RUNS and summary_state.updated_at >= stale_before
+    }
+
+
+def _split_summary_response(response: str, incremental: bool) -> Tuple[str, Optional[str]]:
+    """
+    Разделяет ответ саммаризации на текст саммари и новое состояние инкрементального саммари
+    
+    Args:
+        response: Результат _summarize_window
+        incremental: Саммари строилось инкрементально
+        
+    Returns:
+        Tuple[str, Optional[str]]: Текст саммари и состояние в JSON (None - состояние не меняется)
+    """
+    if not incremental:
+        return response, None
+    return parse_incremental_response(response)
+
+
+def _summary_error_reply(subscription: ChatSubscription, error_text: str) -> str:
+    """
+    Формирует ответ для чата, саммари которого не удалось сгенерировать
+    
+    Саммари в этом случае не сохраняется, а окно сообщений не помечается обработанным,
+    поэтому следующий запуск повторит его.
+    
+    Args:
+        subscription: Подписка на чат
+        error_text: Текст ошибки для пользователя
+        
+    Returns:
+        str: Текст сообщения
+    """
+    return (
+        f"❌ Саммари чата {subscription.chat_title} не готово. {error_text}. "
+        f"Эти сообщения попадут в следующее саммари."
+    )
+
+
+def _summary_retry_reply(subscription: ChatSubscription, error_text: str) -> str:
+    """
+    Формирует ответ для чата, саммари которого будет сгенерировано повторной попыткой задачи
+    
+    Args:
+        subscription: Подписка на чат
+        error_text: Текст ошибки для пользователя
+        
+    Returns:
+        str: Текст сообщения
+    """
+    return (
+        f"⏳ Саммари чата {subscription.chat_title} пока не готово. {error_text}. "
+        f"Повторная попытка примерно через {JOB_RETRY_DELAY} секунд."
+    )
+
+
+def _no_messages_reply(subscription: ChatSubscription) -> str:
+    """Формирует ответ для чата без новых сообщений"""
+    logger.info(f"Нет новых сообщений в чате {subscription.chat_title}")
+    return f"Нет новых сообщений в чате {subscription.chat_title} с момента последнего саммари."
+
+
+def _nothing_to_summarize_reply(subscription: ChatSubscription) -> str:
+    """Формирует ответ для чата, все новые сообщения которого убраны предобработкой"""
+    logger.info(f"Нет содержательных сообщений в чате {subscription.chat_title}")
+    return f"В чате {subscription.chat_title} нет содержательных сообщений с момента последнего саммари."
+
+
+def _format_summary_reply(subscription: ChatSubscription, state: IngestionState,
+                          summary_text: str, model: str) -> str:
+    """
+    Формирует сообщение с саммари для отправки пользователю
+    
+    Args:
+        subscription: Подписка на чат
+        state: Состояние обхода окна
+        summary_text: Текст саммари
+        model: Использованная модель
+        
+    Returns:
+        str: Текст сообщения в HTML-разметке
+    """
+    model_display_name = get_model_display_name(model)
+    truncated_note = ""
+    if state.truncated:
+        truncated_note = (
+            f"<i>Обработано первые {state.count} сообщений, "
+            f"остальные попадут в следующее саммари.</i>\n"
+        )
+    return (
+        f"📝 <b>Саммари чата {subscription.chat_title}</b>\n"
+        f"<i>Модель: {model_display_name}</i>\n"
+        f"{truncated_note}\n"
+        f"{summary_text}"
+    )
\ No newline at end of file
@@ -0,0 +1,331 @@
+import asyncio
+import heapq
+import itertools
+from collections import deque
+from datetime import datetime
+from typing import Deque, Dict, List, Optional, Set, Tuple
+
+from telethon.errors import FloodWaitError, MessageNotModifiedError
+
+from src.config import DELIVERY_GLOBAL_RATE, DELIVERY_CHAT_RATE, STREAM_EDIT_INTERVAL
+from src.utils.logger import logger
+from src.utils.rate_limit import TokenBucket
+
+
+class _Delivery:
+    """Сообщение или правка сообщения в очереди доставки"""
+
+    def __init__(self, entity, text: str, parse_mode: Optional[str], not_before: float, message=None):
+        self.entity = entity
+        self.text = text
+        self.parse_mode = parse_mode
+        self.not_before = not_before
+        self.message = message  # Редактируемое сообщение (None - отправить новое)
+        self.future = asyncio.get_event_loop().create_future()
+
+
+class DeliveryQueue:
+    """
+    Очередь исходящих сообщений бота с учетом лимитов Telegram
+
+    Сообщения в один чат отправляются строго по порядку и не чаще DELIVERY_CHAT_RATE
+    в секунду, все сообщения вместе - не чаще DELIVERY_GLOBAL_RATE в секунду. Правки
+    сообщений идут через ту же очередь и расходуют те же лимиты. При FloodWait
+    сообщение возвращается в начало очереди своего чата, а отправка приостанавливается
+    на указанное Telegram время.
+    """
+
+    def __init__(self, bot, global_rate: float = DELIVERY_GLOBAL_RATE, chat_rate: float = DELIVERY_CHAT_RATE):
+        """
+        Инициализирует очередь доставки
+
+        Args:
+            bot: Telegram бот
+            global_rate: Максимум сообщений в секунду всего
+            chat_rate: Максимум сообщений в секунду в один чат
+        """
+        self.bot = bot
+        self.chat_interval = 1 / chat_rate
+        self._global = TokenBucket(global_rate)
+        self._chats: Dict[int, Deque[_Delivery]] = {}  # Очереди сообщений по чатам
+        self._ready: List[Tuple[float, int, int]] = []  # Чаты с сообщениями: (время готовности, порядок, чат)
+        self._scheduled: Set[int] = set()  # Чаты, которые стоят в _ready или отправляют сообщение сейчас
+        self._chat_next: Dict[int, float] = {}  # Время, раньше которого нельзя писать в чат
+        self._order = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._sending = set()
+
+    @property
+    def depth(self) -> int:
+        """Количество сообщений, ожидающих отправки"""
+        return sum(len(items) for items in self._chats.values())
+
+    def start(self):
+        """Запускает отправку сообщений в текущем цикле событий"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Останавливает отправку; неотправленные сообщения отменяются"""
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+        for task in list(self._sending):
+            task.cancel()
+
+        for items in self._chats.values():
+            for item in items:
+                item.future.cancel()
+        self._chats.clear()
+        self._ready.clear()
+        self._scheduled.clear()
+
+    def enqueue(self, entity, text: str, parse_mode: str = None, not_before: datetime = None) -> asyncio.Future:
+        """
+        Ставит сообщение в очередь
+
+        Args:
+            entity: Получатель
+            text: Текст сообщения
+            parse_mode: Режим разметки
+            not_before: Время (UTC), раньше которого сообщение не отправляется (опционально)
+
+        Returns:
+            asyncio.Future: Результат отправки (отправленное сообщение или ошибка)
+        """
+        now = asyncio.get_event_loop().time()
+        ready_at = now
+        if not_before:
+            ready_at += max((not_before - datetime.utcnow()).total_seconds(), 0)
+
+        return self._add(_Delivery(entity, text, parse_mode, ready_at))
+
+    async def send_message(self, entity, text: str, parse_mode: str = None, not_before: datetime = None):
+        """
+        Отправляет сообщение через очередь и дожидается отправки
+
+        Повторяет сигнатуру send_message клиента Telethon, поэтому очередь можно
+        передавать вместо бота.
+
+        Args:
+            entity: Получатель
+            text: Текст сообщения
+            parse_mode: Режим разметки
+            not_before: Время (UTC), раньше которого сообщение не отправляется (опционально)
+
+        Returns:
+            Отправленное сообщение
+        """
+        return await self.enqueue(entity, text, parse_mode, not_before)
+
+    async def edit_message(self, entity, message, text: str, parse_mode: str = None):
+        """
+        Редактирует сообщение через очередь и дожидается правки
+
+        Повторяет сигнатуру edit_message клиента Telethon, поэтому очередь можно
+        передавать вместо бота.
+
+        Args:
+            entity: Чат сообщения
+            message: Сообщение или его ID
+            text: Новый текст сообщения
+            parse_mode: Режим разметки
+
+        Returns:
+            Отредактированное сообщение
+        """
+        now = asyncio.get_event_loop().time()
+        return await self._add(_Delivery(entity, text, parse_mode, now, message))
+
+    def _add(self, item: _Delivery) -> asyncio.Future:
+        """Добавляет сообщение в конец очереди его чата"""
+        self._chats.setdefault(item.entity, deque()).append(item)
+        if item.entity not in self._scheduled:
+            self._schedule_chat(item.entity)
+        return item.future
+
+    def _schedule_chat(self, chat_id: int):
+        """Ставит чат в очередь готовности по его первому сообщению"""
+        ready_at = max(self._chats[chat_id][0].not_before, self._chat_next.get(chat_id, 0))
+        heapq.heappush(self._ready, (ready_at, next(self._order), chat_id))
+        self._scheduled.add(chat_id)
+        self._wakeup.set()
+
+    async def _run(self):
+        """Основной цикл: отправляет сообщения готовых чатов в пределах общего лимита"""
+        loop = asyncio.get_event_loop()
+        while True:
+            self._wakeup.clear()
+            now = loop.time()
+            timeout = None
+            if self._ready:
+                timeout = max(self._ready[0][0] - now, self._global.delay(now))
+            else:
+                # Очередь пуста: забываем интервалы чатов, которые уже истекли
+                self._chat_next = {chat_id: ready_at for chat_id, ready_at in self._chat_next.items()
+                                   if ready_at > now}
+
+            if timeout is None or timeout > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            _, _, chat_id = heapq.heappop(self._ready)
+            now = loop.time()
+            self._global.consume(now)
+            self._chat_next[chat_id] = now + self.chat_interval
+
+            # Следующее сообщение чата ставится в очередь только после завершения текущего
+            task = asyncio.create_task(self._send(chat_id))
+            self._sending.add(task)
+            task.add_done_callback(self._sending.discard)
+
+    async def _send(self, chat_id: int):
+        """
+        Отправляет (или редактирует) первое сообщение из очереди чата
+
+        Args:
+            chat_id: Получатель
+        """
+        items = self._chats[chat_id]
+        item = items[0]
+        try:
+            if item.message is None:
+                result = await self.bot.send_message(chat_id, item.text, parse_mode=item.parse_mode)
+            else:
+                result = await self.bot.edit_message(chat_id, item.message, item.text, parse_mode=item.parse_mode)
+            items.popleft()
+            if not item.future.done():
+                item.future.set_result(result)
+        except FloodWaitError as e:
+            # Сообщение остается первым в очереди чата, отправка приостанавливается целиком
+            logger.warning(f"FloodWait при отправке в чат {chat_id}: пауза {e.seconds} секунд, в очереди {self.depth}")
+            now = asyncio.get_event_loop().time()
+            self._chat_next[chat_id] = now + e.seconds
+            self._global.pause(now, e.seconds)
+        except Exception as e:
+            items.popleft()
+            if not item.future.done():
+                item.future.set_exception(e)
+
+        self._scheduled.discard(chat_id)
+        if items:
+            self._schedule_chat(chat_id)
+        else:
+            del self._chats[chat_id]
+
+
+# Максимальная длина промежуточного текста, который помещается в сообщение Telegram
+_MAX_PREVIEW_LENGTH = 4000
+
+
+class ProgressiveMessage:
+    """
+    Сообщение бота, которое дописывается по мере генерации текста
+
+    Правки сообщения выполняются в фоне, поэтому генерация текста их не ждет.
+    Одновременно ожидает не больше одной правки: она выполняется не раньше чем через
+    STREAM_EDIT_INTERVAL секунд после предыдущей и показывает самый свежий текст,
+    промежуточные версии пропускаются. Если вместо бота передана очередь доставки,
+    правки проходят через нее и расходуют ее лимиты наравне с отправкой.
+    """
+
+    def __init__(self, bot, chat_id: int, header: str):
+        """
+        Инициализирует сообщение
+
+        Args:
+            bot: Telegram бот или очередь доставки
+            chat_id: ID чата получателя
+            header: Заголовок, который показывается над текстом
+        """
+        self.bot = bot
+        self.chat_id = chat_id
+        self.header = header
+        self._message = None
+        self._text = ""
+        self._shown_text = None
+        self._last_edit_at = 0.0  # Время последней правки
+        self._edit_task: Optional[asyncio.Task] = None  # Ожидающая или выполняющаяся правка
+        self._editing = False  # Правка уже отправлена боту
+
+    async def start(self):
+        """Отправляет сообщение-заглушку, которое затем будет дописываться"""
+        self._message = await self.bot.send_message(self.chat_id, f"{self.header}\n\n⏳ Генерируется...")
+        self._schedule_edit()
+
+    async def update(self, text: str):
+        """
+        Обновляет текст сообщения, не дожидаясь правки
+
+        Args:
+            text: Текст, сгенерированный к этому моменту
+        """
+        self._text = text
+        self._schedule_edit()
+
+    async def finish(self, text: str, parse_mode: str = None):
+        """
+        Заменяет сообщение окончательным текстом
+
+        Правка, которая еще ждет своего интервала, отменяется, а уже отправленная
+        дожидается, чтобы промежуточный текст не заменил окончательный.
+
+        Args:
+            text: Окончательный текст сообщения
+            parse_mode: Режим разметки
+        """
+        task, self._edit_task = self._edit_task, None
+        if task is not None and not task.done():
+            if self._editing:
+                await task
+            else:
+                task.cancel()
+
+        if self._message is not None:
+            try:
+                await self.bot.edit_message(self.chat_id, self._message, text, parse_mode=parse_mode)
+                return
+            except MessageNotModifiedError:
+                return
+            except Exception as e:
+                logger.warning(f"Не удалось заменить сообщение в чате {self.chat_id}: {str(e)}")
+
+        await self.bot.send_message(self.chat_id, text, parse_mode=parse_mode)
+
+    def _schedule_edit(self):
+        """Запускает фоновую правку, если она еще не ожидает"""
+        if self._message is None or not self._text:
+            return
+        if self._edit_task is None or self._edit_task.done():
+            self._edit_task = asyncio.create_task(self._edit())
+
+    async def _edit(self):
+        """Показывает самый свежий текст, соблюдая интервал правок, пока он не покажет последний"""
+        loop = asyncio.get_event_loop()
+        while self._text != self._shown_text:
+            delay = self._last_edit_at + STREAM_EDIT_INTERVAL - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            shown_text = self._text
+            self._last_edit_at = loop.time()
+            text = shown_text
+            if len(text) > _MAX_PREVIEW_LENGTH:
+                text = text[:_MAX_PREVIEW_LENGTH] + "…"
+
+            self._editing = True
+            try:
+                await self.bot.edit_message(self.chat_id, self._message, f"{self.header}\n\n{text} ▌", parse_mode=None)
+            except MessageNotModifiedError:
+                pass
+            except Exception as e:
+                logger.warning(f"Не удалось обновить сообщение в чате {self.chat_id}: {str(e)}")
+                return
+            finally:
+                self._editing = False
+            self._shown_text = shown_text
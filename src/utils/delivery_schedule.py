@@ -0,0 +1,84 @@
+from datetime import datetime, time, timedelta
+from typing import Optional
+
+import pytz
+
+from src.config import TIMEZONE
+from src.models import UserSettings
+from src.utils.logger import logger
+
+
+def get_user_timezone(settings: UserSettings):
+    """
+    Возвращает временную зону пользователя
+
+    Args:
+        settings: Настройки пользователя
+
+    Returns:
+        Временная зона pytz (зона планировщика, если у пользователя она не задана или неизвестна)
+    """
+    try:
+        return pytz.timezone(settings.timezone) if settings.timezone else TIMEZONE
+    except pytz.UnknownTimeZoneError:
+        logger.warning(f"Неизвестная временная зона {settings.timezone} у пользователя {settings.user_id}")
+        return TIMEZONE
+
+
+def get_next_run_at(settings: UserSettings, after: datetime) -> Optional[datetime]:
+    """
+    Вычисляет ближайшее время доставки саммари пользователю
+
+    Args:
+        settings: Настройки пользователя
+        after: Момент, строго после которого нужно найти время доставки (с временной зоной)
+
+    Returns:
+        Optional[datetime]: Время доставки в UTC или None, если частота неизвестна
+    """
+    if settings.delivery_frequency == "hourly":
+        return _get_next_hourly_run_at(settings, after)
+    elif settings.delivery_frequency == "daily":
+        period_days = 1
+    elif settings.delivery_frequency == "weekly":
+        period_days = 7
+    else:
+        logger.error(f"Неизвестная частота {settings.delivery_frequency} для пользователя {settings.user_id}")
+        return None
+
+    tz = get_user_timezone(settings)
+    hour, minute = map(int, settings.delivery_time.split(":"))
+    local_date = after.astimezone(tz).date()
+
+    # Еженедельная доставка происходит по понедельникам
+    if period_days == 7:
+        local_date += timedelta(days=-local_date.weekday() % 7)
+
+    while True:
+        # Локализуем каждую дату отдельно, чтобы учитывать переходы на летнее время
+        run_at = tz.localize(datetime.combine(local_date, time(hour, minute)))
+        if run_at > after:
+            return run_at.astimezone(pytz.utc)
+        local_date += timedelta(days=period_days)
+
+
+def _get_next_hourly_run_at(settings: UserSettings, after: datetime) -> datetime:
+    """
+    Вычисляет ближайшее время ежечасной доставки: каждый час в минуту из времени доставки
+
+    Args:
+        settings: Настройки пользователя
+        after: Момент, строго после которого нужно найти время доставки (с временной зоной)
+
+    Returns:
+        datetime: Время доставки в UTC
+    """
+    minute = int(settings.delivery_time.split(":")[1])
+
+    # Минута задана по местному времени, а в некоторых зонах смещение не кратно часу
+    after = after.astimezone(pytz.utc)
+    offset = after.astimezone(get_user_timezone(settings)).utcoffset() // timedelta(minutes=1)
+    run_at = after.replace(minute=0, second=0, microsecond=0) + timedelta(minutes=(minute - offset) % 60)
+    if run_at <= after:
+        run_at += timedelta(hours=1)
+    return run_at
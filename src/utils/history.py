@@ -0,0 +1,66 @@
+from datetime import datetime, timedelta
+from typing import Optional, Tuple
+
+from src.config import SUMMARY_ARCHIVE_AFTER_DAYS, SUMMARY_RETENTION_DAYS, SUMMARY_ARCHIVE_BATCH_SIZE
+from src.database import get_session, archive_summaries, purge_summaries
+from src.utils.logger import logger
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+def encode_history_cursor(created_at: datetime, summary_id: int) -> str:
+    """
+    Кодирует ключ последнего показанного саммари для команды /history
+
+    Args:
+        created_at: Время создания саммари (UTC)
+        summary_id: ID саммари
+
+    Returns:
+        str: Курсор страницы
+    """
+    return f"{(created_at - _EPOCH) // timedelta(microseconds=1)}_{summary_id}"
+
+
+def decode_history_cursor(cursor: str) -> Optional[Tuple[datetime, int]]:
+    """
+    Разбирает курсор страницы /history
+
+    Args:
+        cursor: Курсор, полученный от encode_history_cursor
+
+    Returns:
+        Optional[Tuple[datetime, int]]: Время создания и ID саммари или None, если курсор некорректен
+    """
+    try:
+        micros, summary_id = cursor.split("_")
+        return _EPOCH + timedelta(microseconds=int(micros)), int(summary_id)
+    except ValueError:
+        return None
+
+
+async def maintain_summary_history():
+    """
+    Переносит старые саммари в сжатый архив и удаляет саммари старше срока хранения
+
+    Перенос идет пакетами по SUMMARY_ARCHIVE_BATCH_SIZE, каждый своей транзакцией,
+    поэтому запись в базу не блокируется надолго.
+    """
+    now = datetime.utcnow()
+    archived = 0
+    while True:
+        async with get_session() as db:
+            count = await archive_summaries(
+                db, now - timedelta(days=SUMMARY_ARCHIVE_AFTER_DAYS), SUMMARY_ARCHIVE_BATCH_SIZE
+            )
+        archived += count
+        if count < SUMMARY_ARCHIVE_BATCH_SIZE:
+            break
+
+    deleted = 0
+    if SUMMARY_RETENTION_DAYS:
+        async with get_session() as db:
+            deleted = await purge_summaries(db, now - timedelta(days=SUMMARY_RETENTION_DAYS))
+
+    if archived or deleted:
+        logger.info(f"История саммари: перенесено в архив {archived}, удалено {deleted}")
@@ -0,0 +1,144 @@
+from datetime import datetime
+from typing import AsyncIterable, AsyncIterator, List, Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.config import INGEST_PAGE_SIZE, INGEST_MAX_MESSAGES, INGEST_MAX_BYTES
+from src.database import get_stored_messages
+from src.utils.logger import logger
+
+
+class IngestionState:
+    """Состояние обхода окна сообщений чата"""
+
+    def __init__(self, last_id: Optional[int] = None):
+        """
+        Инициализирует состояние обхода
+
+        Args:
+            last_id: ID последнего уже обработанного сообщения (обход продолжится после него)
+        """
+        self.start_id = last_id  # Граница окна: последнее обработанное сообщение до обхода
+        self.first_id = None
+        self.last_id = last_id
+        self.count = 0
+        self.bytes = 0
+        self.truncated = False
+
+
+async def iter_message_pages(client, entity, state: IngestionState,
+                             offset_date: Optional[datetime] = None,
+                             page_size: int = INGEST_PAGE_SIZE,
+                             max_messages: int = INGEST_MAX_MESSAGES,
+                             max_bytes: int = INGEST_MAX_BYTES) -> AsyncIterator[List]:
+    """
+    Обходит все сообщения чата после state.last_id от старых к новым и отдает их страницами
+
+    Обход останавливается при достижении лимита по количеству сообщений или по объему текста.
+    В этом случае state.truncated выставляется в True, а state.last_id указывает на последнее
+    отданное сообщение, так что повторный вызов с тем же состоянием продолжит окно с места остановки.
+
+    Args:
+        client: Telegram клиент
+        entity: Сущность чата
+        state: Состояние обхода, обновляется по мере чтения
+        offset_date: Дата, начиная с которой читать сообщения, если state.last_id не задан
+        page_size: Количество сообщений в одной странице
+        max_messages: Максимальное количество сообщений за обход
+        max_bytes: Максимальный объем текста сообщений (в байтах) за обход
+
+    Yields:
+        List: Страница сообщений, упорядоченных по возрастанию ID
+    """
+    kwargs = {"reverse": True}
+    if state.last_id:
+        kwargs["min_id"] = state.last_id
+    elif offset_date:
+        kwargs["offset_date"] = offset_date
+
+    source = client.iter_messages(entity, **kwargs)
+    async for page in _paginate(source, state, page_size, max_messages, max_bytes):
+        yield page
+
+
+async def iter_stored_pages(db: AsyncSession, chat_id: int, state: IngestionState,
+                            page_size: int = INGEST_PAGE_SIZE,
+                            max_messages: int = INGEST_MAX_MESSAGES,
+                            max_bytes: int = INGEST_MAX_BYTES) -> AsyncIterator[List]:
+    """
+    Обходит сообщения чата после state.last_id из локального хранилища
+
+    Работает так же, как iter_message_pages, но читает сообщения из таблицы messages
+    диапазонными запросами по (chat_id, id) без обращения к Telegram.
+
+    Args:
+        db: Сессия базы данных
+        chat_id: ID чата в Telegram (peer id)
+        state: Состояние обхода, обновляется по мере чтения
+        page_size: Количество сообщений в одной странице
+        max_messages: Максимальное количество сообщений за обход
+        max_bytes: Максимальный объем текста сообщений (в байтах) за обход
+
+    Yields:
+        List: Страница сообщений, упорядоченных по возрастанию ID
+    """
+    async def source():
+        after_id = state.last_id or 0
+        while True:
+            rows = await get_stored_messages(db, chat_id, after_id, page_size)
+            for row in rows:
+                yield row
+            if len(rows) < page_size:
+                return
+            after_id = rows[-1].id
+
+    async for page in _paginate(source(), state, page_size, max_messages, max_bytes):
+        yield page
+
+
+async def _paginate(source: AsyncIterable, state: IngestionState, page_size: int,
+                    max_messages: int, max_bytes: int) -> AsyncIterator[List]:
+    """
+    Разбивает поток сообщений на страницы с учетом лимитов и обновляет состояние обхода
+
+    Args:
+        source: Поток сообщений по возрастанию ID
+        state: Состояние обхода
+        page_size: Количество сообщений в одной странице
+        max_messages: Максимальное количество сообщений за обход
+        max_bytes: Максимальный объем текста сообщений (в байтах) за обход
+
+    Yields:
+        List: Страница сообщений
+    """
+    page = []
+    read = 0
+    read_bytes = 0
+
+    async for msg in source:
+        size = len(msg.message.encode("utf-8")) if msg.message else 0
+
+        if read >= max_messages or (read and read_bytes + size > max_bytes):
+            state.truncated = True
+            logger.warning(
+                f"Достигнут лимит загрузки ({read} сообщений, {read_bytes} байт), "
+                f"остаток окна будет обработан после сообщения {state.last_id}"
+            )
+            break
+
+        page.append(msg)
+        read += 1
+        read_bytes += size
+
+        if state.first_id is None:
+            state.first_id = msg.id
+        state.last_id = msg.id
+        state.count += 1
+        state.bytes += size
+
+        if len(page) >= page_size:
+            yield page
+            page = []
+
+    if page:
+        yield page
@@ -0,0 +1,230 @@
+import asyncio
+from datetime import datetime, timedelta
+from typing import List
+
+from src.config import (
+    SUMMARY_WORKERS, JOB_POLL_INTERVAL, JOB_LEASE_TIMEOUT, JOB_MAX_ATTEMPTS, JOB_RETRY_DELAY,
+    JOB_BATCH_SIZE, JOB_RETENTION
+)
+from src.database import (
+    get_session, get_summary_users, lease_summary_jobs, extend_summary_job_lease, finish_summary_jobs,
+    release_summary_jobs, purge_summary_jobs
+)
+from src.models import SummaryJob
+from src.utils.history import maintain_summary_history
+from src.utils.logger import logger
+
+# Как часто удалять завершенные задачи и обслуживать историю саммари (секунды)
+_PURGE_INTERVAL = 3600
+
+
+class SummaryJobQueue:
+    """
+    Пул обработчиков постоянной очереди задач генерации саммари (таблица summary_jobs)
+
+    Команда /summary и планировщик только ставят задачи в очередь. Обработчик арендует
+    задачу на JOB_LEASE_TIMEOUT секунд и продлевает аренду, пока работает; задачу,
+    аренда которой истекла (например, после падения процесса), забирает другой обработчик.
+    Неудачные задачи, в том числе задачи с временной ошибкой модели, повторяются через
+    JOB_RETRY_DELAY секунд, не более JOB_MAX_ATTEMPTS раз. Задача доставки по расписанию
+    завершается, как только саммари поставлены в очередь доставки, а не после их отправки.
+    """
+
+    def __init__(self, telegram_client, workers: int = SUMMARY_WORKERS):
+        """
+        Инициализирует очередь
+
+        Args:
+            telegram_client: Клиент Telegram (TelegramSummaryClient)
+            workers: Количество обработчиков
+        """
+        self.telegram_client = telegram_client
+        self.workers = workers
+        self._wakeup = asyncio.Event()
+        self._tasks: List[asyncio.Task] = []
+        self._last_purge = None
+
+    def start(self):
+        """Запускает обработчиков в текущем цикле событий"""
+        if self._tasks:
+            return
+
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        logger.info(f"Очередь задач саммари запущена, обработчиков: {self.workers}")
+
+    async def stop(self):
+        """Останавливает обработчиков; прерванные задачи возвращаются в очередь"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def notify(self):
+        """Сообщает обработчикам, что в очереди появились задачи"""
+        self._wakeup.set()
+
+    async def _worker(self):
+        """Цикл обработчика: арендует задачи и выполняет их, а при пустой очереди ждет новых"""
+        while True:
+            self._wakeup.clear()
+            try:
+                async with get_session() as db:
+                    jobs = await lease_summary_jobs(db, JOB_BATCH_SIZE, JOB_LEASE_TIMEOUT)
+            except Exception as e:
+                logger.error(f"Ошибка при получении задач из очереди: {str(e)}")
+                jobs = []
+
+            if jobs:
+                await self._run_jobs(jobs)
+                continue
+
+            await self._housekeeping()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), JOB_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _run_jobs(self, jobs: List[SummaryJob]):
+        """
+        Выполняет арендованные задачи и записывает результат
+
+        Args:
+            jobs: Задачи одного вида (одна задача /summary или задачи доставки с общим временем)
+        """
+        job_ids = [job.id for job in jobs]
+        job = jobs[0]
+        kind, reply_chat_id, stream, deliver_at = job.kind, job.reply_chat_id, job.stream, job.deliver_at
+        user_ids = [job.user_id for job in jobs]
+        attempts = max(job.attempts for job in jobs)
+
+        # Аренда продлевалась столько раз подряд без завершения, что процесс, видимо, падает на этой задаче
+        if attempts > JOB_MAX_ATTEMPTS:
+            logger.error(f"Задачи {job_ids} превысили число попыток выполнения")
+            async with get_session() as db:
+                await finish_summary_jobs(db, job_ids, "Превышено число попыток", max_attempts=JOB_MAX_ATTEMPTS)
+            return
+
+        heartbeat = asyncio.create_task(self._heartbeat(job_ids))
+        try:
+            if kind == "manual":
+                await self._run_manual(user_ids[0], reply_chat_id, stream, attempts)
+            else:
+                await self._run_scheduled(user_ids, deliver_at, attempts)
+        except asyncio.CancelledError:
+            async with get_session() as db:
+                await release_summary_jobs(db, job_ids)
+            raise
+        except Exception as e:
+            logger.error(f"Ошибка при выполнении задач {job_ids}: {str(e)}")
+            async with get_session() as db:
+                await finish_summary_jobs(db, job_ids, str(e), JOB_RETRY_DELAY, JOB_MAX_ATTEMPTS)
+            if kind == "manual" and attempts >= JOB_MAX_ATTEMPTS:
+                await self._report_failure(reply_chat_id, e)
+        else:
+            async with get_session() as db:
+                await finish_summary_jobs(db, job_ids)
+        finally:
+            heartbeat.cancel()
+
+    async def _heartbeat(self, job_ids: List[int]):
+        """
+        Продлевает аренду задач, пока они выполняются
+
+        Args:
+            job_ids: ID задач
+        """
+        while True:
+            await asyncio.sleep(JOB_LEASE_TIMEOUT / 3)
+            try:
+                async with get_session() as db:
+                    await extend_summary_job_lease(db, job_ids, JOB_LEASE_TIMEOUT)
+            except Exception as e:
+                logger.error(f"Не удалось продлить аренду задач {job_ids}: {str(e)}")
+
+    async def _run_manual(self, user_id: int, reply_chat_id: int, stream: bool, attempts: int = 1):
+        """
+        Выполняет задачу команды /summary
+
+        Args:
+            user_id: ID пользователя
+            reply_chat_id: ID чата для ответа
+            stream: Показывать саммари по мере генерации
+            attempts: Номер попытки выполнения задачи
+        """
+        from src.telegram_client import generate_and_send_summaries
+
+        async with get_session() as db:
+            users = await get_summary_users(db, [user_id], active_only=False)
+        if not users:
+            logger.error(f"Пользователь с ID {user_id} не найден")
+            return
+
+        user = users[0]
+        tg = self.telegram_client
+        await generate_and_send_summaries(
+            tg.client, user, tg.delivery_queue, reply_chat_id,
+            message_sync=tg.message_sync, stream=stream,
+            retry_failures=attempts < JOB_MAX_ATTEMPTS, resumed=attempts > 1
+        )
+
+    async def _run_scheduled(self, user_ids: List[int], deliver_at: datetime, attempts: int = 1):
+        """
+        Выполняет задачи доставки по расписанию с общим временем доставки
+
+        Args:
+            user_ids: ID пользователей
+            deliver_at: Время доставки (UTC)
+            attempts: Номер попытки выполнения задач
+        """
+        from src.telegram_client import generate_and_send_chat_summaries
+
+        async with get_session() as db:
+            users = await get_summary_users(db, user_ids)
+        if not users:
+            logger.info(f"Активные пользователи с ID {user_ids} не найдены")
+            return
+
+        tg = self.telegram_client
+        await generate_and_send_chat_summaries(
+            tg.client, users, tg.delivery_queue,
+            message_sync=tg.message_sync, deliver_at=deliver_at,
+            retry_failures=attempts < JOB_MAX_ATTEMPTS
+        )
+
+    async def _report_failure(self, chat_id: int, error: Exception):
+        """
+        Сообщает пользователю, что саммари по команде /summary сгенерировать не удалось
+
+        Args:
+            chat_id: ID чата для ответа
+            error: Последняя ошибка
+        """
+        try:
+            await self.telegram_client.delivery_queue.send_message(
+                chat_id, f"❌ Произошла ошибка при генерации саммари: {str(error)}"
+            )
+        except Exception as e:
+            logger.error(f"Не удалось сообщить об ошибке в чат {chat_id}: {str(e)}")
+
+    async def _housekeeping(self):
+        """
+        Не чаще раза в час удаляет завершенные задачи старше JOB_RETENTION секунд
+        и переносит старые саммари в архив
+        """
+        now = asyncio.get_event_loop().time()
+        if self._last_purge is not None and now - self._last_purge < _PURGE_INTERVAL:
+            return
+
+        self._last_purge = now
+        try:
+            async with get_session() as db:
+                deleted = await purge_summary_jobs(db, datetime.utcnow() - timedelta(seconds=JOB_RETENTION))
+            if deleted:
+                logger.info(f"Удалено завершенных задач саммари: {deleted}")
+        except Exception as e:
+            logger.error(f"Ошибка при удалении завершенных задач: {str(e)}")
+
+        try:
+            await maintain_summary_history()
+        except Exception as e:
+            logger.error(f"Ошибка при обслуживании истории саммари: {str(e)}")
@@ -0,0 +1,273 @@
+import asyncio
+from typing import Dict, Optional, Set
+
+from telethon import events, utils
+
+from src.config import MESSAGE_SYNC_CONCURRENCY
+from src.database import (
+    get_session,
+    get_subscribed_chats,
+    get_chat_sync_state,
+    update_chat_sync_state,
+    save_messages
+)
+from src.utils.ingestion import IngestionState, iter_message_pages
+from src.utils.logger import logger
+from src.utils.senders import remember_senders
+
+
+def subscription_entity_id(chat_id) -> Optional[int]:
+    """
+    Преобразует ID чата из подписки в ID, по которому можно получить сущность
+
+    Args:
+        chat_id: ID чата из подписки (число, "user_<id>" или "name_<hash>")
+
+    Returns:
+        Optional[int]: ID для get_entity или None, если чат известен только по имени
+    """
+    chat_id = str(chat_id)
+    if chat_id.startswith('name_'):
+        return None
+    if chat_id.startswith('user_'):
+        return int(chat_id.replace('user_', ''))
+    return int(chat_id)
+
+
+def message_to_row(msg) -> Dict:
+    """
+    Преобразует сообщение Telethon в строку таблицы messages
+
+    Args:
+        msg: Сообщение Telethon
+
+    Returns:
+        Dict: Поля строки хранилища
+    """
+    reply_to = getattr(msg, 'reply_to', None)
+    return {
+        "id": msg.id,
+        "date": msg.date.replace(tzinfo=None),
+        "sender_id": msg.sender_id,
+        "text": msg.message or "",
+        "reply_to": getattr(reply_to, 'reply_to_msg_id', None),
+    }
+
+
+class MessageSync:
+    """
+    Поддерживает локальную копию сообщений чатов, на которые есть подписки
+
+    Пропуски догружаются после переподключений клиента и когда перед чтением окна
+    оказывается, что в хранилище нет последнего сообщения чата (обновления могли потеряться,
+    например при слишком длинной разнице обновлений канала).
+    """
+
+    def __init__(self, client):
+        """
+        Инициализирует синхронизацию сообщений
+
+        Args:
+            client: Telegram клиент пользователя
+        """
+        self.client = client
+        self._peers = {}  # ID чата из подписки -> peer id
+        self._entities = {}  # peer id -> сущность чата
+        self._live: Set[int] = set()  # Чаты, хранилище которых сейчас не имеет пропусков
+        self._filling: Set[int] = set()  # Чаты, пропуски которых догружаются сейчас
+        self._gap_semaphore = asyncio.Semaphore(MESSAGE_SYNC_CONCURRENCY)
+        self._track_task = None
+        self._gap_tasks: Set[asyncio.Task] = set()  # Догрузки пропусков, запущенные в фоне
+
+    async def start(self):
+        """
+        Регистрирует обработчики обновлений и запускает догрузку пропущенных сообщений
+
+        Пропуски догружаются в фоне, не более MESSAGE_SYNC_CONCURRENCY чатов одновременно,
+        поэтому запуск не ждет истории всех чатов. Пока пропуск чата не догружен,
+        саммари читают его сообщения из сети.
+        """
+        self.client.add_event_handler(self._on_message, events.NewMessage(func=self._is_tracked))
+        self.client.add_event_handler(self._on_message, events.MessageEdited(func=self._is_tracked))
+        self.client.add_reconnect_handler(self._on_reconnect)
+
+        async with get_session() as db:
+            subscribed = await get_subscribed_chats(db)
+        self._track_task = asyncio.create_task(self._track_all(subscribed))
+
+        logger.info(f"Синхронизация сообщений запущена для {len(subscribed)} чатов")
+
+    async def stop(self):
+        """Останавливает синхронизацию сообщений"""
+        for task in (self._track_task, *self._gap_tasks):
+            if task:
+                task.cancel()
+        self._track_task = None
+        self._gap_tasks.clear()
+
+        self.client.remove_event_handler(self._on_message)
+        self.client.remove_reconnect_handler(self._on_reconnect)
+        self._live.clear()
+        self._filling.clear()
+
+    async def track(self, chat_id, pending_id: Optional[int] = None):
+        """
+        Начинает синхронизацию чата и догружает его историю
+
+        Args:
+            chat_id: ID чата из подписки
+            pending_id: ID, начиная с которого сообщения еще понадобятся для саммари
+        """
+        entity_id = subscription_entity_id(chat_id)
+        if entity_id is None:
+            return
+
+        try:
+            entity = await self.client.get_entity(entity_id)
+        except Exception as e:
+            logger.warning(f"Не удалось начать синхронизацию чата {chat_id}: {str(e)}")
+            return
+
+        peer_id = utils.get_peer_id(entity)
+        self._peers[str(chat_id)] = peer_id
+        self._entities[peer_id] = entity
+        await self._fill_gap(peer_id, pending_id)
+
+    async def _track_all(self, subscribed: Dict[str, Optional[int]]):
+        """
+        Начинает синхронизацию всех чатов подписок
+
+        Args:
+            subscribed: ID, начиная с которого сообщения еще понадобятся, по ID чата из подписки
+        """
+        await asyncio.gather(*[self.track(chat_id, pending_id) for chat_id, pending_id in subscribed.items()])
+        logger.info(f"Пропущенные сообщения догружены для {len(self._live)} чатов")
+
+    async def get_live_peer(self, chat_id, after_id: Optional[int]) -> Optional[int]:
+        """
+        Проверяет, можно ли прочитать окно сообщений из локального хранилища
+
+        Хранилищу доверяется, только если в нем есть последнее сообщение чата. Иначе
+        пропуск догружается в фоне, а окно читается из сети.
+
+        Args:
+            chat_id: ID чата из подписки
+            after_id: ID последнего обработанного сообщения
+
+        Returns:
+            Optional[int]: peer id чата в хранилище или None, если окно нужно читать из сети
+        """
+        peer_id = self._peers.get(str(chat_id))
+        if peer_id is None or peer_id not in self._live or not after_id:
+            return None
+
+        async with get_session() as db:
+            state = await get_chat_sync_state(db, peer_id)
+        if not state or after_id < state.synced_from_id:
+            return None
+
+        try:
+            latest = await self.client.get_messages(self._entities[peer_id], limit=1)
+        except Exception as e:
+            logger.warning(f"Не удалось проверить последнее сообщение чата {peer_id}: {str(e)}")
+            return None
+        if latest and latest[0].id > (state.last_message_id or 0):
+            logger.info(f"В хранилище чата {peer_id} нет сообщений после {state.last_message_id}, догружаем пропуск")
+            self._schedule_fill(peer_id)
+            return None
+
+        return peer_id
+
+    def _is_tracked(self, event) -> bool:
+        """Фильтр обновлений: только чаты, для которых ведется синхронизация"""
+        return event.chat_id in self._entities
+
+    async def _on_message(self, event):
+        """Сохраняет новое или отредактированное сообщение в хранилище"""
+        msg = event.message
+        try:
+            async with get_session() as db:
+                await save_messages(db, event.chat_id, [message_to_row(msg)])
+                await remember_senders(db, [msg])
+
+                # Пока пропуск не догружен, граница непрерывности не двигается
+                if event.chat_id in self._live:
+                    await update_chat_sync_state(db, event.chat_id, msg.id)
+        except Exception as e:
+            logger.error(f"Ошибка при сохранении сообщения {msg.id} чата {event.chat_id}: {str(e)}")
+
+    async def _on_reconnect(self):
+        """После переподключения клиента догружает пропуски всех чатов"""
+        self._live.clear()
+        logger.info("Клиент переподключен, догружаем пропущенные сообщения")
+        for peer_id in self._entities:
+            self._schedule_fill(peer_id)
+
+    def _schedule_fill(self, peer_id: int):
+        """
+        Запускает догрузку пропуска чата в фоне, если она еще не идет
+
+        Args:
+            peer_id: ID чата в хранилище
+        """
+        if peer_id in self._filling:
+            return
+
+        self._live.discard(peer_id)
+        self._filling.add(peer_id)
+        task = asyncio.create_task(self._fill_gap(peer_id))
+        self._gap_tasks.add(task)
+        task.add_done_callback(self._gap_tasks.discard)
+
+    async def _fill_gap(self, peer_id: int, pending_id: Optional[int] = None):
+        """
+        Догружает сообщения, пропущенные с момента последней синхронизации
+
+        Одновременно догружаются не более MESSAGE_SYNC_CONCURRENCY чатов.
+
+        Args:
+            peer_id: ID чата в хранилище
+            pending_id: ID, начиная с которого сообщения еще понадобятся для саммари
+        """
+        self._live.discard(peer_id)
+        self._filling.add(peer_id)
+        try:
+            async with self._gap_semaphore:
+                await self._load_gap(peer_id, pending_id)
+        finally:
+            self._filling.discard(peer_id)
+
+    async def _load_gap(self, peer_id: int, pending_id: Optional[int]):
+        """Загружает пропуск чата в хранилище (см. _fill_gap)"""
+        entity = self._entities[peer_id]
+
+        try:
+            async with get_session() as db:
+                sync_state = await get_chat_sync_state(db, peer_id)
+            if sync_state:
+                start_id = sync_state.last_message_id
+                synced_from_id = None
+            elif pending_id:
+                start_id = synced_from_id = pending_id
+            else:
+                # Истории для саммари еще нет: синхронизируем с последнего сообщения
+                latest = await self.client.get_messages(entity, limit=1)
+                start_id = synced_from_id = latest[0].id if latest else 0
+
+            state = IngestionState(start_id)
+            while True:
+                async for page in iter_message_pages(self.client, entity, state):
+                    async with get_session() as db:
+                        await save_messages(db, peer_id, [message_to_row(msg) for msg in page])
+                        await remember_senders(db, page)
+                if not state.truncated:
+                    break
+                state.truncated = False
+
+            async with get_session() as db:
+                await update_chat_sync_state(db, peer_id, state.last_id or start_id, synced_from_id)
+            self._live.add(peer_id)
+            if state.count:
+                logger.info(f"Догружено {state.count} сообщений чата {peer_id}")
+        except Exception as e:
+            logger.error(f"Ошибка при догрузке сообщений чата {peer_id}: {str(e)}")
@@ -1,79 +1,693 @@
 import aiohttp
+import asyncio
 import json
-from src.config import OPENROUTER_API_KEY, DEFAULT_OPENROUTER_MODEL, AVAILABLE_MODELS
+import math
+import random
+import time
+from email.utils import parsedate_to_datetime
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterator, Optional
+
+from src.config import (
+    OPENROUTER_API_KEY,
+    OPENROUTER_API_URL,
+    DEFAULT_OPENROUTER_MODEL,
+    AVAILABLE_MODELS,
+    SUMMARY_MAX_TOKENS,
+    OPENROUTER_POOL_SIZE,
+    OPENROUTER_KEEPALIVE,
+    OPENROUTER_DNS_CACHE_TTL,
+    OPENROUTER_CONNECT_TIMEOUT,
+    OPENROUTER_READ_TIMEOUT,
+    OPENROUTER_MAX_RETRIES,
+    OPENROUTER_BACKOFF_BASE,
+    OPENROUTER_BACKOFF_MAX,
+    OPENROUTER_MAX_RETRY_AFTER,
+    OPENROUTER_BREAKER_THRESHOLD,
+    OPENROUTER_BREAKER_RESET,
+    OPENROUTER_FALLBACK_MODELS,
+    AUTO_MODEL,
+    AUTO_FAST_MODELS,
+    AUTO_QUALITY_MODELS,
+    AUTO_SMALL_WINDOW_TOKENS,
+    AUTO_STATS_ALPHA,
+    AUTO_EXPLORE_RATE,
+    AUTO_ERROR_PENALTY
+)
 from src.utils.logger import logger
+from src.utils.tokens import (
+    fits_context, get_input_budget, get_model_info, get_output_tokens, trim_to_budget
+)
+
+
+# Статусы временных ошибок, при которых запрос имеет смысл повторить
+RETRYABLE_STATUSES = {408, 429, 500, 502, 503, 504}
+
+
+class OpenRouterError(Exception):
+    """Ошибка ответа OpenRouter API"""
+
+    def __init__(self, status: Optional[int], message: str, retry_after: float = None):
+        """
+        Args:
+            status: HTTP статус ответа (None, если ответ не получен из-за сетевой ошибки)
+            message: Текст ошибки
+            retry_after: Через сколько секунд API разрешает повторить запрос (заголовок Retry-After)
+        """
+        super().__init__(f"{status}, {message}")
+        self.status = status
+        self.retry_after = retry_after
+
+    @property
+    def retryable(self) -> bool:
+        """Ошибка временная, и запрос к той же модели имеет смысл повторить"""
+        return self.status is None or self.status in RETRYABLE_STATUSES
 
-async def generate_summary(messages_text: str, model_name: str = None) -> str:
+    @property
+    def model_failure(self) -> bool:
+        """Ошибка говорит о проблеме с моделью, и стоит попробовать резервную"""
+        return self.retryable or self.status == 404
+
+
+class ModelUnavailableError(OpenRouterError):
+    """Модель отключена автоматическим выключателем после серии ошибок"""
+
+    def __init__(self, model: str):
+        super().__init__(503, f"модель {model} временно отключена после серии ошибок")
+        self.model = model
+
+
+class CircuitBreaker:
     """
-    Генерирует саммари сообщений с помощью OpenRouter API
-    
+    Автоматический выключатель модели
+
+    После OPENROUTER_BREAKER_THRESHOLD ошибок подряд запросы к модели сразу отклоняются.
+    Через OPENROUTER_BREAKER_RESET секунд пропускается один пробный запрос: при успехе
+    выключатель замыкается, при ошибке снова размыкается.
+    """
+
+    def __init__(self, model: str, threshold: int = OPENROUTER_BREAKER_THRESHOLD,
+                 reset_timeout: float = OPENROUTER_BREAKER_RESET):
+        """
+        Args:
+            model: Название модели
+            threshold: Количество ошибок подряд, после которого выключатель размыкается
+            reset_timeout: Через сколько секунд после размыкания пропустить пробный запрос
+        """
+        self.model = model
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._probe_at: Optional[float] = None  # Время начала пробного запроса
+
+    @property
+    def is_open(self) -> bool:
+        """Запросы к модели сейчас отклоняются"""
+        return self.opened_at is not None
+
+    def allow(self) -> bool:
+        """
+        Проверяет, можно ли отправить запрос к модели
+
+        Returns:
+            bool: True если запрос разрешен
+        """
+        if self.opened_at is None:
+            return True
+
+        # Пробный запрос, не завершившийся за reset_timeout (например, отмененный), не блокирует следующий
+        now = time.monotonic()
+        probe_pending = self._probe_at is not None and now - self._probe_at < self.reset_timeout
+        if not probe_pending and now - self.opened_at >= self.reset_timeout:
+            self._probe_at = now
+            return True
+        return False
+
+    def record_success(self):
+        """Учитывает успешный запрос"""
+        if self.opened_at is not None:
+            logger.info(f"Модель {self.model} снова доступна")
+        self.failures = 0
+        self.opened_at = None
+        self._probe_at = None
+
+    def record_failure(self):
+        """Учитывает ошибку модели"""
+        self.failures += 1
+        self._probe_at = None
+        if self.failures >= self.threshold:
+            if self.opened_at is None:
+                logger.warning(f"Модель {self.model} отключена после {self.failures} ошибок подряд")
+            self.opened_at = time.monotonic()
+
+
+_circuit_breakers: Dict[str, CircuitBreaker] = {}
+
+
+def get_circuit_breaker(model: str) -> CircuitBreaker:
+    """
+    Возвращает выключатель модели
+
     Args:
-        messages_text: Текст сообщений для саммаризации
-        model_name: Название модели для использования (по умолчанию берется DEFAULT_OPENROUTER_MODEL)
-        
+        model: Название модели
+
     Returns:
-        str: Сгенерированное саммари
+        CircuitBreaker: Выключатель, общий для всех запросов к модели
     """
-    if not messages_text.strip():
-        return "Нет сообщений для саммаризации."
-    
-    # Используем указанную модель или модель по умолчанию
-    model = model_name if model_name and model_name in AVAILABLE_MODELS else DEFAULT_OPENROUTER_MODEL
-    logger.info(f"Используется модель для саммаризации: {model}")
-    
-    prompt = f"""Пожалуйста, создай краткое саммари следующих сообщений из телеграм-чата. 
-Структурируй саммари по таким разделам:
+    breaker = _circuit_breakers.get(model)
+    if breaker is None:
+        breaker = _circuit_breakers[model] = CircuitBreaker(model)
+    return breaker
+
+
+class ModelStats:
+    """
+    Скользящие средние задержки и доли ошибок запросов к модели
+
+    Используются при автоматическом выборе модели. Средние экспоненциальные:
+    каждый новый запрос входит в них с весом AUTO_STATS_ALPHA.
+    """
+
+    def __init__(self, model: str, alpha: float = AUTO_STATS_ALPHA):
+        """
+        Args:
+            model: Название модели
+            alpha: Вес нового запроса в средних
+        """
+        self.model = model
+        self.alpha = alpha
+        self.latency: Optional[float] = None  # Средняя задержка успешного запроса (секунды)
+        self.error_rate = 0.0
+
+    def record_success(self, latency: float):
+        """
+        Учитывает успешный запрос
+
+        Args:
+            latency: Длительность запроса в секундах
+        """
+        self.latency = latency if self.latency is None else self.latency + self.alpha * (latency - self.latency)
+        self.error_rate -= self.alpha * self.error_rate
+
+    def record_failure(self):
+        """Учитывает ошибку модели"""
+        self.error_rate += self.alpha * (1 - self.error_rate)
+
+    def expected_latency(self) -> float:
+        """Ожидаемая задержка запроса с поправкой на долю ошибок (секунды, 0 - модель еще не наблюдалась)"""
+        if self.latency is None:
+            return 0.0
+        return self.latency * (1 + AUTO_ERROR_PENALTY * self.error_rate)
+
+
+_model_stats: Dict[str, ModelStats] = {}
+
+
+def get_model_stats(model: str) -> ModelStats:
+    """
+    Возвращает статистику запросов к модели
+
+    Args:
+        model: Название модели
+
+    Returns:
+        ModelStats: Статистика, общая для всех запросов к модели
+    """
+    stats = _model_stats.get(model)
+    if stats is None:
+        stats = _model_stats[model] = ModelStats(model)
+    return stats
+
+
+def _parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """
+    Разбирает заголовок Retry-After (число секунд или HTTP-дата)
+
+    Args:
+        value: Значение заголовка
+
+    Returns:
+        Optional[float]: Задержка в секундах или None
+    """
+    if not value:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0)
+    except (TypeError, ValueError):
+        return None
+
+
+class OpenRouterClient:
+    """Долгоживущий HTTP-клиент OpenRouter с общим пулом соединений"""
+
+    def __init__(self, api_key: str = OPENROUTER_API_KEY, base_url: str = OPENROUTER_API_URL):
+        """
+        Инициализирует клиент OpenRouter
+
+        Args:
+            api_key: API ключ OpenRouter
+            base_url: Базовый URL API
+        """
+        self.api_key = api_key
+        self.base_url = base_url.rstrip("/")
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    async def start(self):
+        """Создает сессию с пулом соединений"""
+        if self._session and not self._session.closed:
+            return
+
+        connector = aiohttp.TCPConnector(
+            limit=OPENROUTER_POOL_SIZE,
+            limit_per_host=OPENROUTER_POOL_SIZE,
+            keepalive_timeout=OPENROUTER_KEEPALIVE,
+            ttl_dns_cache=OPENROUTER_DNS_CACHE_TTL,
+        )
+        timeout = aiohttp.ClientTimeout(
+            total=None,
+            connect=OPENROUTER_CONNECT_TIMEOUT,
+            sock_read=OPENROUTER_READ_TIMEOUT,
+        )
+        self._session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=timeout,
+            headers={
+                "Authorization": f"Bearer {self.api_key}",
+                "Content-Type": "application/json",
+                "HTTP-Referer": "https://github.com",
+            },
+        )
+        logger.info("HTTP-клиент OpenRouter запущен")
+
+    async def stop(self):
+        """Закрывает сессию и все соединения пула"""
+        if self._session and not self._session.closed:
+            await self._session.close()
+            logger.info("HTTP-клиент OpenRouter остановлен")
+        self._session = None
+
+    async def chat_completion(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Выполняет запрос chat/completions
+
+        Args:
+            payload: Тело запроса
+
+        Returns:
+            Dict[str, Any]: Ответ API
+
+        Raises:
+            OpenRouterError: Если API вернул ответ с ошибкой или запрос не удался из-за сети
+        """
+        if not self._session or self._session.closed:
+            await self.start()
+
+        try:
+            async with self._session.post(f"{self.base_url}/chat/completions", json=payload) as response:
+                if response.status != 200:
+                    raise OpenRouterError(
+                        response.status,
+                        await response.text(),
+                        retry_after=_parse_retry_after(response.headers.get("Retry-After"))
+                    )
+
+                result = await response.json()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise OpenRouterError(None, f"сетевая ошибка: {e!r}")
+
+        # Ошибка провайдера модели может прийти и в ответе со статусом 200
+        if "error" in result or not result.get("choices"):
+            error = result.get("error") or {}
+            raise OpenRouterError(error.get("code") or 502, error.get("message") or "пустой ответ модели")
+
+        return result
+
+    async def stream_chat_completion(self, payload: Dict[str, Any]) -> AsyncIterator[str]:
+        """
+        Выполняет запрос chat/completions в потоковом режиме (SSE)
+
+        Args:
+            payload: Тело запроса
+
+        Returns:
+            AsyncIterator[str]: Фрагменты текста ответа по мере генерации
+
+        Raises:
+            OpenRouterError: Если API вернул ответ с ошибкой или запрос не удался из-за сети
+        """
+        if not self._session or self._session.closed:
+            await self.start()
+
+        try:
+            async with self._session.post(
+                f"{self.base_url}/chat/completions", json={**payload, "stream": True}
+            ) as response:
+                if response.status != 200:
+                    raise OpenRouterError(
+                        response.status,
+                        await response.text(),
+                        retry_after=_parse_retry_after(response.headers.get("Retry-After"))
+                    )
+
+                async for raw_line in response.content:
+                    # Строки-комментарии SSE (": OPENROUTER PROCESSING") поддерживают соединение
+                    line = raw_line.decode("utf-8").strip()
+                    if not line.startswith("data:"):
+                        continue
+
+                    data = line[len("data:"):].strip()
+                    if data == "[DONE]":
+                        return
+
+                    try:
+                        chunk = json.loads(data)
+                    except json.JSONDecodeError:
+                        raise OpenRouterError(502, f"некорректный фрагмент потока ответа: {data[:200]}")
+
+                    if "error" in chunk:
+                        error = chunk["error"] or {}
+                        raise OpenRouterError(error.get("code") or 502, error.get("message") or "ошибка в потоке ответа")
+
+                    choices = chunk.get("choices") or []
+                    delta = choices[0].get("delta", {}).get("content") if choices else None
+                    if delta:
+                        yield delta
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise OpenRouterError(None, f"сетевая ошибка: {e!r}")
+
+
+# Общий клиент, жизненным циклом которого управляет main.py
+openrouter_client = OpenRouterClient()
+
+
+SYSTEM_PROMPT = "Ты - помощник, который создает краткие и информативные саммари телеграм-чатов на русском языке."
+
+SUMMARY_STRUCTURE = """Структурируй саммари по таким разделам:
 1. Основные темы: перечисли 3-5 главных тем, которые обсуждались
 2. Ключевые обсуждения: выдели 2-3 важных обсуждения и их основные моменты
-3. Важные объявления: перечисли важные объявления или информацию, если такие были
+3. Важные объявления: перечисли важные объявления или информацию, если такие были"""
+
+SUMMARY_PROMPT = f"""Пожалуйста, создай краткое саммари следующих сообщений из телеграм-чата. 
+{SUMMARY_STRUCTURE}
 
 Сообщения для саммаризации:
-{messages_text}
+{{messages}}
 
 Составь максимально информативное саммари, выделяя самое важное. Постарайся сделать его лаконичным, но полезным.
 """
 
-    try:
-        headers = {
-            "Authorization": f"Bearer {OPENROUTER_API_KEY}",
-            "Content-Type": "application/json",
-            "HTTP-Referer": "https://github.com",
-        }
-        
-        payload = {
-            "model": model,
-            "messages": [
-                {
-                    "role": "system", 
-                    "content": "Ты - помощник, который создает краткие и информативные саммари телеграм-чатов на русском языке."
-                },
-                {
-                    "role": "user", 
-                    "content": prompt
-                }
-            ],
-            "temperature": 0.7,
-            "max_tokens": 1000
-        }
-        
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                "https://openrouter.ai/api/v1/chat/completions",
-                headers=headers,
-                json=payload
-            ) as response:
-                if response.status != 200:
-                    error_text = await response.text()
-                    logger.error(f"OpenRouter API ошибка: {response.status}, {error_text}")
-                    return f"Ошибка генерации саммари: {response.status}"
+
+def get_model_display_name(model: str) -> str:
+    """
+    Возвращает отображаемое название модели
+    
+    Args:
+        model: Название модели
+        
+    Returns:
+        str: Отображаемое название или само название модели, если она неизвестна
+    """
+    info = AVAILABLE_MODELS.get(model)
+    return info["name"] if info else model
+
+
+def resolve_model(model_name: str = None) -> str:
+    """
+    Возвращает модель для запроса: указанную, если она доступна, иначе модель по умолчанию
+    
+    Args:
+        model_name: Название модели
+        
+    Returns:
+        str: Название модели
+    """
+    return model_name if model_name and model_name in AVAILABLE_MODELS else DEFAULT_OPENROUTER_MODEL
+
+
+def resolve_request_model(model_name: str = None, tokens: int = 0) -> str:
+    """
+    Возвращает модель для саммаризации переписки заданного размера
+    
+    Для модели auto модель выбирается функцией route_model, для остальных - как в resolve_model.
+    
+    Args:
+        model_name: Название модели
+        tokens: Размер переписки в токенах
+        
+    Returns:
+        str: Название модели
+    """
+    model = resolve_model(model_name)
+    return route_model(tokens) if model == AUTO_MODEL else model
+
+
+def route_model(tokens: int) -> str:
+    """
+    Выбирает модель для переписки заданного размера
+    
+    Небольшие окна (до AUTO_SMALL_WINDOW_TOKENS) отдаются быстрым моделям из AUTO_FAST_MODELS,
+    большие - моделям из AUTO_QUALITY_MODELS. Среди них выбирается модель с наименьшей
+    ожидаемой длительностью саммаризации: скользящая средняя задержки запроса с поправкой
+    на долю ошибок, умноженная на число последовательных этапов запросов (переписка,
+    не помещающаяся в один запрос, саммаризируется по частям). Модели без наблюдений
+    выбираются в первую очередь, а доля AUTO_EXPLORE_RATE запросов уходит случайной
+    подходящей модели, чтобы статистика неиспользуемых моделей не устаревала.
+    Модели с разомкнутым выключателем пропускаются.
+    
+    Args:
+        tokens: Размер переписки в токенах
+        
+    Returns:
+        str: Название модели
+    """
+    candidates = [
+        model for model in (AUTO_FAST_MODELS if tokens <= AUTO_SMALL_WINDOW_TOKENS else AUTO_QUALITY_MODELS)
+        if not get_circuit_breaker(model).is_open
+    ]
+    if not candidates:
+        logger.warning("Все модели автовыбора недоступны, используется модель по умолчанию")
+        return DEFAULT_OPENROUTER_MODEL
+        
+    if random.random() < AUTO_EXPLORE_RATE:
+        return random.choice(candidates)
+        
+    best, best_duration = None, None
+    for model in candidates:
+        # Фрагменты саммаризируются параллельными волнами по fan_out запросов, затем объединяются
+        info = get_model_info(model)
+        chunk_budget = min(get_input_budget(model, SYSTEM_PROMPT + SUMMARY_PROMPT), info["chunk_tokens"])
+        chunks = math.ceil(tokens / chunk_budget) if chunk_budget else math.inf
+        stages = 1 if chunks <= 1 else math.ceil(chunks / info["fan_out"]) + 1
+        duration = get_model_stats(model).expected_latency() * stages
+        if best_duration is None or duration < best_duration:
+            best, best_duration = model, duration
+            
+    logger.info(f"Автовыбор модели: {best} для {tokens} токенов (ожидаемо {best_duration:.1f} с)")
+    return best
+
+
+async def complete(prompt: str, model: str, max_tokens: int = SUMMARY_MAX_TOKENS,
+                   on_text: Callable[[str], Awaitable[None]] = None) -> str:
+    """
+    Отправляет промпт модели и возвращает текст ответа
+    
+    Временные ошибки повторяются с экспоненциальной паузой. Если модель недоступна,
+    запрос отправляется резервным моделям из OPENROUTER_FALLBACK_MODELS, в контекст
+    которых он помещается.
+    
+    Args:
+        prompt: Текст запроса пользователя
+        model: Название модели
+        max_tokens: Желаемая максимальная длина ответа в токенах (ограничивается лимитом модели)
+        on_text: Если задан, ответ запрашивается потоком, и функция вызывается с уже
+            полученным текстом по мере генерации (при повторе запроса текст начинается заново)
+        
+    Returns:
+        str: Ответ модели
+        
+    Raises:
+        OpenRouterError: Если ни одна модель не ответила
+    """
+    last_error = None
+    for candidate in _iter_model_chain(prompt, model, max_tokens):
+        if last_error is not None:
+            logger.warning(f"Модель недоступна ({str(last_error)}), запрос отправлен резервной модели {candidate}")
+        try:
+            return await _complete_with_retries(prompt, candidate, max_tokens, on_text)
+        except OpenRouterError as e:
+            if not e.model_failure:
+                raise
+            last_error = e
+            
+    raise last_error
+
+
+def _iter_model_chain(prompt: str, model: str, max_tokens: int) -> Iterator[str]:
+    """
+    Перебирает модель запроса и подходящие резервные модели
+    
+    Args:
+        prompt: Текст запроса пользователя
+        model: Название модели
+        max_tokens: Желаемая длина ответа в токенах
+        
+    Returns:
+        Iterator[str]: Названия моделей в порядке приоритета
+    """
+    yield model
+    for fallback in OPENROUTER_FALLBACK_MODELS:
+        if fallback != model and fits_context(fallback, SYSTEM_PROMPT + prompt, max_tokens):
+            yield fallback
+
+
+async def _complete_with_retries(prompt: str, model: str, max_tokens: int,
+                                 on_text: Callable[[str], Awaitable[None]] = None) -> str:
+    """
+    Отправляет промпт одной модели, повторяя запрос при временных ошибках
+    
+    Args:
+        prompt: Текст запроса пользователя
+        model: Название модели
+        max_tokens: Желаемая максимальная длина ответа в токенах
+        on_text: Получатель текста ответа по мере генерации (опционально)
+        
+    Returns:
+        str: Ответ модели
+        
+    Raises:
+        ModelUnavailableError: Если модель отключена выключателем
+        OpenRouterError: Если API вернул ответ с ошибкой
+    """
+    payload = {
+        "model": model,
+        "messages": [
+            {
+                "role": "system", 
+                "content": SYSTEM_PROMPT
+            },
+            {
+                "role": "user", 
+                "content": prompt
+            }
+        ],
+        "temperature": 0.7,
+        "max_tokens": get_output_tokens(model, max_tokens)
+    }
+    
+    breaker = get_circuit_breaker(model)
+    stats = get_model_stats(model)
+    for attempt in range(OPENROUTER_MAX_RETRIES + 1):
+        if not breaker.allow():
+            raise ModelUnavailableError(model)
+            
+        started_at = time.monotonic()
+        try:
+            if on_text is None:
+                result = await openrouter_client.chat_completion(payload)
+                text = result["choices"][0]["message"]["content"]
+            else:
+                text = await _stream_text(payload, on_text)
+        except OpenRouterError as e:
+            if e.model_failure:
+                breaker.record_failure()
+                stats.record_failure()
+            else:
+                breaker.record_success()
                 
-                result = await response.json()
-                summary = result["choices"][0]["message"]["content"]
-                return summary
+            if not e.retryable or attempt == OPENROUTER_MAX_RETRIES or breaker.is_open:
+                raise
                 
-    except Exception as e:
-        logger.error(f"Ошибка при генерации саммари: {str(e)}")
-        return f"Не удалось сгенерировать саммари: {str(e)}"
+            # Экспоненциальная пауза со случайным разбросом, но не меньше Retry-After
+            delay = random.uniform(0, min(OPENROUTER_BACKOFF_MAX, OPENROUTER_BACKOFF_BASE * 2 ** attempt))
+            if e.retry_after is not None:
+                if e.retry_after > OPENROUTER_MAX_RETRY_AFTER:
+                    raise
+                delay = max(delay, e.retry_after)
+                
+            logger.warning(f"Ошибка OpenRouter ({str(e)[:200]}) для модели {model}, повтор через {delay:.1f} с")
+            await asyncio.sleep(delay)
+            continue
+            
+        breaker.record_success()
+        stats.record_success(time.monotonic() - started_at)
+        return text
+
+
+async def _stream_text(payload: Dict[str, Any], on_text: Callable[[str], Awaitable[None]]) -> str:
+    """
+    Получает ответ потоком, передавая накопленный текст получателю
+    
+    Args:
+        payload: Тело запроса
+        on_text: Получатель текста ответа по мере генерации
+        
+    Returns:
+        str: Полный текст ответа
+        
+    Raises:
+        OpenRouterError: Если API вернул ошибку или пустой ответ
+    """
+    text = ""
+    async for delta in openrouter_client.stream_chat_completion(payload):
+        text += delta
+        await on_text(text)
+        
+    if not text:
+        raise OpenRouterError(502, "пустой ответ модели")
+    return text
+
+
+async def summarize_text(messages_text: str, model: str, on_text: Callable[[str], Awaitable[None]] = None) -> str:
+    """
+    Генерирует саммари переписки одним запросом
+    
+    Переписка, не помещающаяся в контекст модели, обрезается до самых свежих сообщений.
+    
+    Args:
+        messages_text: Текст сообщений для саммаризации
+        model: Название модели
+        on_text: Получатель текста саммари по мере генерации (опционально)
+        
+    Returns:
+        str: Сгенерированное саммари
+        
+    Raises:
+        OpenRouterError: Если API вернул ответ с ошибкой
+    """
+    budget = get_input_budget(model, SYSTEM_PROMPT + SUMMARY_PROMPT)
+    messages_text, trimmed = trim_to_budget(messages_text, budget)
+    if trimmed:
+        logger.warning(f"Переписка обрезана до {budget} токенов, чтобы поместиться в контекст модели {model}")
+    
+    return await complete(SUMMARY_PROMPT.format(messages=messages_text), model, on_text=on_text)
+
+
+def format_summary_error(error: Exception) -> str:
+    """
+    Формирует текст ошибки генерации саммари для пользователя
+    
+    Args:
+        error: Исключение, возникшее при генерации
+        
+    Returns:
+        str: Текст ошибки
+    """
+    if isinstance(error, ModelUnavailableError):
+        logger.error(f"OpenRouter API ошибка: {str(error)}")
+        return "Модель временно недоступна, попробуйте позже"
+        
+    if isinstance(error, OpenRouterError):
+        logger.error(f"OpenRouter API ошибка: {str(error)}")
+        if error.status is None:
+            return "Сервис саммаризации временно недоступен"
+        return f"Ошибка генерации саммари: {error.status}"
+        
+    logger.error(f"Ошибка при генерации саммари: {str(error)}")
+    return f"Не удалось сгенерировать саммари: {str(error)}"
 
 
 async def list_available_models():
@@ -83,7 +697,7 @@ async def list_available_models():
     Returns:
         str: Форматированный список моделей
     """
-    models_list = "\n".join([f"• <code>{model_id}</code> - {description}" for model_id, description in AVAILABLE_MODELS.items()])
+    models_list = "\n".join([f"• <code>{model_id}</code> - {info['name']}" for model_id, info in AVAILABLE_MODELS.items()])
     
     return f"""📋 <b>Доступные модели для саммаризации:</b>
 
@@ -0,0 +1,242 @@
+import hashlib
+import re
+from datetime import datetime
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+from src.config import PREPROCESS_STAGES, PREPROCESS_MAX_MESSAGE_CHARS
+from src.utils.tokens import estimate_tokens
+
+
+class TranscriptMessage:
+    """Сообщение переписки, подготовленное к саммаризации"""
+
+    def __init__(self, id: int, date: datetime, sender_id: Optional[int], sender_name: str, text: str,
+                 reply_to: Optional[int] = None, is_service: bool = False, is_bot: bool = False):
+        """
+        Инициализирует сообщение
+
+        Args:
+            id: ID сообщения в чате
+            date: Время отправки (с временной зоной)
+            sender_id: ID отправителя
+            sender_name: Отображаемое имя отправителя
+            text: Текст сообщения
+            reply_to: ID сообщения, на которое это является ответом (опционально)
+            is_service: Служебное сообщение (вход в чат, закрепление и т.п.)
+            is_bot: Сообщение отправлено ботом или через инлайн-бота
+        """
+        self.id = id
+        self.date = date
+        self.sender_id = sender_id
+        self.sender_name = sender_name
+        self.text = text
+        self.reply_to = reply_to
+        self.is_service = is_service
+        self.is_bot = is_bot
+
+    @classmethod
+    def from_message(cls, msg, sender_name: str, date: datetime) -> "TranscriptMessage":
+        """
+        Создает сообщение переписки из сообщения Telethon или строки локального хранилища
+
+        Признаки бота и служебного сообщения есть только у сообщений Telethon:
+        хранилище не сохраняет служебные сообщения, а отправителя знает только по ID.
+
+        Args:
+            msg: Сообщение Telethon или StoredMessage
+            sender_name: Отображаемое имя отправителя
+            date: Время отправки (с временной зоной)
+
+        Returns:
+            TranscriptMessage: Сообщение переписки
+        """
+        reply_to = getattr(msg, 'reply_to', None)
+        if reply_to is not None and not isinstance(reply_to, int):
+            reply_to = getattr(reply_to, 'reply_to_msg_id', None)
+        sender = getattr(msg, 'sender', None)
+        return cls(
+            id=msg.id,
+            date=date,
+            sender_id=msg.sender_id,
+            sender_name=sender_name,
+            text=msg.message or "",
+            reply_to=reply_to,
+            is_service=getattr(msg, 'action', None) is not None,
+            is_bot=bool(getattr(sender, 'bot', False) or getattr(msg, 'via_bot_id', None))
+        )
+
+
+# Короткие ответы, которые не несут содержания для саммари
+_TRIVIAL_PATTERN = re.compile(
+    r"(?:\+1|\+|ok|okay|ок|окей|ага|угу|спасибо|спс|благодарю|thanks|thx|ty|лол|lol|хах|ахах\w*|"
+    r"согласен|согласна|понял|поняла|ясно|пон|норм)[\s!.,)(]*",
+    re.IGNORECASE
+)
+# Сообщение из одних эмодзи, знаков препинания и пробелов
+_SYMBOLS_ONLY_PATTERN = re.compile(r"[\W_]*")
+# Знаки препинания в конце ссылки относятся к предложению, а не к ссылке
+_URL_PATTERN = re.compile(r"(?:https?://|www\.)[^\s<>\"')\]]*[^\s<>\"')\].,;:!?]", re.IGNORECASE)
+_SPACES_PATTERN = re.compile(r"[ \t\u00a0]+")
+_LINE_BREAKS_PATTERN = re.compile(r" ?\n\s*")
+
+
+def drop_service(messages: Iterable[TranscriptMessage]) -> Iterator[TranscriptMessage]:
+    """Убирает служебные сообщения, сообщения ботов и сообщения без текста"""
+    for message in messages:
+        if not message.is_service and not message.is_bot and message.text.strip():
+            yield message
+
+
+def drop_trivial(messages: Iterable[TranscriptMessage]) -> Iterator[TranscriptMessage]:
+    """Убирает короткие ответы без содержания: "+1", "ок", "спасибо", одни эмодзи"""
+    for message in messages:
+        text = message.text.strip()
+        if _TRIVIAL_PATTERN.fullmatch(text) or _SYMBOLS_ONLY_PATTERN.fullmatch(text):
+            continue
+        yield message
+
+
+def normalize_whitespace(messages: Iterable[TranscriptMessage]) -> Iterator[TranscriptMessage]:
+    """Схлопывает повторяющиеся пробелы и пустые строки"""
+    for message in messages:
+        text = _SPACES_PATTERN.sub(" ", message.text)
+        message.text = _LINE_BREAKS_PATTERN.sub("\n", text).strip()
+        yield message
+
+
+def _url_domain(match: re.Match) -> str:
+    """Возвращает домен ссылки вместо самой ссылки"""
+    url = match.group(0)
+    if not url.lower().startswith("http"):
+        url = f"http://{url}"
+    try:
+        domain = urlsplit(url).hostname
+    except ValueError:
+        domain = None
+    if not domain:
+        return match.group(0)
+    return f"[{domain.removeprefix('www.')}]"
+
+
+def strip_urls(messages: Iterable[TranscriptMessage]) -> Iterator[TranscriptMessage]:
+    """Заменяет ссылки их доменами: для саммари важно, куда ведет ссылка, а не ее путь"""
+    for message in messages:
+        message.text = _URL_PATTERN.sub(_url_domain, message.text)
+        yield message
+
+
+def collapse_duplicates(messages: Iterable[TranscriptMessage]) -> Iterator[TranscriptMessage]:
+    """Убирает повторы уже встречавшегося в окне текста (пересылки, копипаста, спам)"""
+    seen = set()
+    for message in messages:
+        key = hashlib.blake2b(message.text.casefold().encode("utf-8"), digest_size=16).digest()
+        if key in seen:
+            continue
+        seen.add(key)
+        yield message
+
+
+def truncate_long(messages: Iterable[TranscriptMessage],
+                  max_chars: int = PREPROCESS_MAX_MESSAGE_CHARS) -> Iterator[TranscriptMessage]:
+    """Обрезает слишком длинные сообщения (логи, листинги, большие вставки)"""
+    for message in messages:
+        if len(message.text) > max_chars:
+            message.text = f"{message.text[:max_chars].rstrip()}… [обрезано]"
+        yield message
+
+
+# Этапы предобработки в порядке применения: название -> (описание, функция)
+STAGES: Dict[str, Tuple[str, Callable[[Iterable[TranscriptMessage]], Iterator[TranscriptMessage]]]] = {
+    "service": ("служебные сообщения и боты", drop_service),
+    "trivial": ("короткие ответы без содержания", drop_trivial),
+    "whitespace": ("лишние пробелы и пустые строки", normalize_whitespace),
+    "urls": ("ссылки заменяются доменами", strip_urls),
+    "duplicates": ("повторы одного и того же текста", collapse_duplicates),
+    "truncate": (f"сообщения длиннее {PREPROCESS_MAX_MESSAGE_CHARS} символов обрезаются", truncate_long),
+}
+
+DEFAULT_STAGES = [stage for stage in PREPROCESS_STAGES if stage in STAGES]
+
+
+class PreprocessingStats:
+    """Статистика предобработки окна: сколько токенов и сообщений убрал каждый этап"""
+
+    def __init__(self):
+        self.input_tokens = 0
+        self.input_messages = 0
+        self.output_tokens = 0
+        self.output_messages = 0
+        self.removed_tokens: Dict[str, int] = {}
+        self.removed_messages: Dict[str, int] = {}
+
+    def describe(self) -> str:
+        """Возвращает статистику одной строкой для журнала"""
+        stages = ", ".join(
+            f"{stage}: -{tokens} ток./-{self.removed_messages[stage]} сообщ."
+            for stage, tokens in self.removed_tokens.items()
+        )
+        return (
+            f"{self.input_tokens} -> {self.output_tokens} токенов, "
+            f"{self.input_messages} -> {self.output_messages} сообщений ({stages})"
+        )
+
+
+def _measure(messages: Iterable[TranscriptMessage], totals: List[int]) -> Iterator[TranscriptMessage]:
+    """Пропускает сообщения, подсчитывая их количество и токены в totals"""
+    for message in messages:
+        totals[0] += 1
+        totals[1] += estimate_tokens(message.text)
+        yield message
+
+
+def preprocess(messages: Iterable[TranscriptMessage], stages: List[str] = None,
+               stats: PreprocessingStats = None) -> Iterator[TranscriptMessage]:
+    """
+    Пропускает сообщения через этапы предобработки
+
+    Этапы - генераторы, соединенные в цепочку, поэтому сообщения обрабатываются по одному
+    без промежуточных списков. Статистика заполняется по мере чтения результата
+    и полна после того, как результат прочитан до конца.
+
+    Args:
+        messages: Сообщения окна в порядке отправки
+        stages: Названия включенных этапов (по умолчанию DEFAULT_STAGES)
+        stats: Статистика, которую нужно заполнить (опционально)
+
+    Yields:
+        TranscriptMessage: Сообщения, оставшиеся после предобработки
+    """
+    stats = stats if stats is not None else PreprocessingStats()
+    enabled = set(DEFAULT_STAGES if stages is None else stages)
+
+    counters = [("input", [0, 0])]
+    source = _measure(messages, counters[0][1])
+    for name, (_, stage) in STAGES.items():
+        if name in enabled:
+            counters.append((name, [0, 0]))
+            source = _measure(stage(source), counters[-1][1])
+
+    yield from source
+
+    (_, (stats.input_messages, stats.input_tokens)) = counters[0]
+    (_, (stats.output_messages, stats.output_tokens)) = counters[-1]
+    for (_, before), (name, after) in zip(counters, counters[1:]):
+        stats.removed_messages[name] = before[0] - after[0]
+        stats.removed_tokens[name] = before[1] - after[1]
+
+
+def parse_stages(value: Optional[str]) -> List[str]:
+    """
+    Разбирает список этапов подписки
+
+    Args:
+        value: Названия этапов через запятую или None, если подписка использует этапы по умолчанию
+
+    Returns:
+        List[str]: Названия включенных этапов в порядке применения
+    """
+    if value is None:
+        return list(DEFAULT_STAGES)
+    names = {name.strip() for name in value.split(",")}
+    return [stage for stage in STAGES if stage in names]
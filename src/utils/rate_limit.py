@@ -0,0 +1,255 @@
+import asyncio
+from typing import Awaitable, Callable, Dict, List
+
+from telethon import TelegramClient, utils
+from telethon.errors import FloodWaitError
+
+from src.config import (
+    MTPROTO_RATE,
+    MTPROTO_MIN_RATE,
+    MTPROTO_RATE_RECOVERY,
+    MTPROTO_FLOOD_BACKOFF,
+    MTPROTO_MAX_FLOOD_WAIT
+)
+from src.utils.logger import logger
+
+
+class TokenBucket:
+    """Ограничитель частоты по алгоритму token bucket"""
+
+    def __init__(self, rate: float, capacity: float = None):
+        """
+        Инициализирует ограничитель
+
+        Args:
+            rate: Скорость пополнения (токенов в секунду)
+            capacity: Максимальный запас токенов (по умолчанию - запас на одну секунду)
+        """
+        self.rate = rate
+        self.capacity = capacity or max(rate, 1)
+        self._tokens = self.capacity
+        self._updated_at = asyncio.get_event_loop().time()
+
+    def set_rate(self, rate: float):
+        """
+        Меняет скорость пополнения и запас ограничителя
+
+        Args:
+            rate: Новая скорость пополнения (токенов в секунду)
+        """
+        self._refill(asyncio.get_event_loop().time())
+        self.rate = rate
+        self.capacity = max(rate, 1)
+        self._tokens = min(self._tokens, self.capacity)
+
+    def _refill(self, now: float):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    def delay(self, now: float) -> float:
+        """
+        Возвращает, через сколько секунд будет доступен токен
+
+        Args:
+            now: Текущее время цикла событий
+
+        Returns:
+            float: Задержка в секундах (0, если токен доступен сейчас)
+        """
+        self._refill(now)
+        return max((1 - self._tokens) / self.rate, 0)
+
+    def consume(self, now: float):
+        """
+        Забирает токен
+
+        Args:
+            now: Текущее время цикла событий
+        """
+        self._refill(now)
+        self._tokens -= 1
+
+    def pause(self, now: float, seconds: float):
+        """
+        Опустошает ограничитель так, чтобы следующий токен появился не раньше чем через seconds секунд
+
+        Args:
+            now: Текущее время цикла событий
+            seconds: Длительность паузы
+        """
+        self._refill(now)
+        self._tokens = min(self._tokens, 1 - seconds * self.rate)
+
+
+class MTProtoRateLimiter:
+    """
+    Общий ограничитель частоты запросов к Telegram API
+
+    У каждого метода API свой token bucket. FloodWaitError приостанавливает все запросы
+    на указанное Telegram время и вдвое (MTPROTO_FLOOD_BACKOFF) снижает скорость метода,
+    вызвавшего ошибку; каждый успешный запрос понемногу возвращает скорость к MTPROTO_RATE.
+    """
+
+    def __init__(self, rate: float = MTPROTO_RATE, min_rate: float = MTPROTO_MIN_RATE,
+                 recovery: float = MTPROTO_RATE_RECOVERY, backoff: float = MTPROTO_FLOOD_BACKOFF):
+        """
+        Инициализирует ограничитель
+
+        Args:
+            rate: Максимальная скорость запросов одного метода (запросов в секунду)
+            min_rate: Минимальная скорость, до которой снижается метод после FloodWait
+            recovery: Прибавка к скорости метода после каждого успешного запроса
+            backoff: Множитель скорости метода после FloodWait
+        """
+        self.max_rate = rate
+        self.min_rate = min_rate
+        self.recovery = recovery
+        self.backoff = backoff
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._paused_until = 0.0
+        self._waiting = 0
+
+    @property
+    def depth(self) -> int:
+        """Количество запросов, ожидающих разрешения"""
+        return self._waiting
+
+    @property
+    def rates(self) -> Dict[str, float]:
+        """Текущие скорости методов (запросов в секунду)"""
+        return {method: bucket.rate for method, bucket in self._buckets.items()}
+
+    def _bucket(self, method: str) -> TokenBucket:
+        bucket = self._buckets.get(method)
+        if bucket is None:
+            bucket = self._buckets[method] = TokenBucket(self.max_rate)
+        return bucket
+
+    async def acquire(self, method: str):
+        """
+        Дожидается разрешения на запрос
+
+        Args:
+            method: Название метода API
+        """
+        loop = asyncio.get_event_loop()
+        bucket = self._bucket(method)
+        self._waiting += 1
+        try:
+            while True:
+                now = loop.time()
+                delay = max(self._paused_until - now, bucket.delay(now))
+                if delay <= 0:
+                    bucket.consume(now)
+                    return
+                await asyncio.sleep(delay)
+        finally:
+            self._waiting -= 1
+
+    def on_success(self, method: str):
+        """
+        Учитывает успешный запрос: скорость метода постепенно восстанавливается
+
+        Args:
+            method: Название метода API
+        """
+        bucket = self._bucket(method)
+        if bucket.rate < self.max_rate:
+            bucket.set_rate(min(bucket.rate + self.recovery, self.max_rate))
+
+    def on_flood_wait(self, method: str, seconds: int, pause: bool = True):
+        """
+        Учитывает FloodWait: все запросы приостанавливаются, скорость метода снижается
+
+        Args:
+            method: Название метода API
+            seconds: Время ожидания, которое потребовал Telegram
+            pause: Приостанавливать запросы (False - только снизить скорость метода)
+        """
+        bucket = self._bucket(method)
+        bucket.set_rate(max(bucket.rate * self.backoff, self.min_rate))
+        if not pause:
+            logger.warning(
+                f"FloodWait {seconds} секунд на {method}: запрос не повторяется, "
+                f"скорость метода снижена до {bucket.rate:.2f} запросов/с"
+            )
+            return
+
+        now = asyncio.get_event_loop().time()
+        self._paused_until = max(self._paused_until, now + seconds)
+
+        # Метод не получает накопленный за паузу запас и после нее идет со сниженной скоростью
+        bucket.pause(now, seconds)
+        logger.warning(
+            f"FloodWait {seconds} секунд на {method}: скорость снижена до {bucket.rate:.2f} запросов/с, "
+            f"ожидают {self.depth} запросов"
+        )
+
+
+class RateLimitedTelegramClient(TelegramClient):
+    """
+    Telegram клиент, все запросы которого проходят через общий MTProtoRateLimiter
+
+    Ограничение встроено в __call__, через который Telethon выполняет любые запросы,
+    включая постраничную загрузку в iter_messages. FloodWait не усыпляет отдельный запрос
+    внутри Telethon, а приостанавливает все запросы клиента и повторяется после паузы.
+
+    Кроме того, клиент сообщает о своих автоматических переподключениях: Telethon после них
+    не запрашивает пропущенные обновления, и подписчики догружают пропуски сами.
+    """
+
+    def __init__(self, *args, rate_limiter: MTProtoRateLimiter = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.rate_limiter = rate_limiter or MTProtoRateLimiter()
+        self._reconnect_handlers: List[Callable[[], Awaitable[None]]] = []
+        # Telethon сам не спит на FloodWait: и проверка перед отправкой, и обработка ответа
+        # сразу пробрасывают ошибку, чтобы ее учел общий ограничитель
+        self.flood_sleep_threshold = 0
+
+    async def __call__(self, request, ordered=False, flood_sleep_threshold=None):
+        first = request[0] if utils.is_list_like(request) else request
+        method = type(first).__name__
+
+        while True:
+            await self.rate_limiter.acquire(method)
+            try:
+                result = await self._call(self._sender, request, ordered=ordered)
+            except FloodWaitError as e:
+                # Слишком долгое ожидание не останавливает остальные методы: ошибка
+                # пробрасывается, а повторы того же запроса Telethon отклоняет сам до конца ожидания
+                too_long = e.seconds > MTPROTO_MAX_FLOOD_WAIT
+                self.rate_limiter.on_flood_wait(method, e.seconds, pause=not too_long)
+                if too_long:
+                    raise
+                continue
+
+            self.rate_limiter.on_success(method)
+            return result
+
+    def add_reconnect_handler(self, callback: Callable[[], Awaitable[None]]):
+        """
+        Регистрирует обработчик автоматического переподключения клиента
+
+        Args:
+            callback: Корутина, которая вызывается после каждого переподключения
+        """
+        self._reconnect_handlers.append(callback)
+
+    def remove_reconnect_handler(self, callback: Callable[[], Awaitable[None]]):
+        """
+        Удаляет обработчик переподключения
+
+        Args:
+            callback: Ранее зарегистрированный обработчик
+        """
+        if callback in self._reconnect_handlers:
+            self._reconnect_handlers.remove(callback)
+
+    async def _handle_auto_reconnect(self):
+        """Вызывается Telethon после автоматического переподключения"""
+        await super()._handle_auto_reconnect()
+        for callback in list(self._reconnect_handlers):
+            try:
+                await callback()
+            except Exception as e:
+                logger.error(f"Ошибка в обработчике переподключения: {str(e)}")
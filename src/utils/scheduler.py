@@ -1,113 +1,141 @@
-import schedule
-import time
-import threading
-import datetime
-from src.utils.logger import logger
-from sqlalchemy.orm import Session
-from src.models import UserSettings, User, ChatSubscription
 import asyncio
-from typing import Callable, Any, Dict
+import heapq
+import random
+from datetime import datetime, timedelta
+from typing import List, Tuple
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.config import SCHEDULER_POLL_INTERVAL, SCHEDULER_HORIZON, SCHEDULER_BATCH_SIZE, DELIVERY_PREPARE_JITTER
+from src.database import get_session, get_due_jobs, get_active_user_settings, claim_scheduled_job
+from src.utils.logger import logger
 
 
 class SchedulerManager:
-    def __init__(self, db: Session, telegram_client):
+    def __init__(self, telegram_client):
         """
         Инициализирует менеджер планировщика
         
         Args:
-            db: Сессия базы данных
-            telegram_client: Клиент Telegram
+            telegram_client: Клиент Telegram (TelegramSummaryClient)
         """
-        self.db = db
         self.telegram_client = telegram_client
-        self.stop_event = threading.Event()
-        self.scheduler_thread = None
+        # Задачи в пределах горизонта: (время начала генерации, время доставки, ID пользователя), время в UTC
+        self._heap: List[Tuple[datetime, datetime, int]] = []
+        self._next_poll = datetime.min
+        self._batch_full = False  # Последний опрос уперся в SCHEDULER_BATCH_SIZE
+        self._task = None
         
     def start(self):
-        """Запускает планировщик в отдельном потоке"""
-        if self.scheduler_thread is not None:
+        """Запускает планировщик в текущем цикле событий"""
+        if self._task is not None:
             logger.warning("Планировщик уже запущен")
             return
             
-        self.stop_event.clear()
-        self.scheduler_thread = threading.Thread(target=self._run_scheduler)
-        self.scheduler_thread.daemon = True
-        self.scheduler_thread.start()
+        self._task = asyncio.create_task(self._run_scheduler())
         logger.info("Планировщик запущен")
         
-    def stop(self):
+    async def stop(self):
         """Останавливает планировщик"""
-        if self.scheduler_thread is None:
+        if self._task is None:
             logger.warning("Планировщик не запущен")
             return
             
-        self.stop_event.set()
-        self.scheduler_thread.join()
-        self.scheduler_thread = None
+        self._task.cancel()
+        self._task = None
         logger.info("Планировщик остановлен")
         
-    def _run_scheduler(self):
-        """Основной цикл планировщика"""
-        self._schedule_all_users()
+    async def _run_scheduler(self):
+        """
+        Основной цикл планировщика
         
-        while not self.stop_event.is_set():
-            schedule.run_pending()
-            time.sleep(1)
+        Раз в SCHEDULER_POLL_INTERVAL секунд из таблицы scheduled_jobs выбираются задачи,
+        срабатывающие в ближайшие SCHEDULER_HORIZON секунд, а между опросами цикл спит
+        до ближайшего времени доставки. Сработавшие задачи только ставятся в очередь
+        генерации саммари (summary_jobs), саммари готовят обработчики этой очереди.
+        """
+        while True:
+            now = datetime.utcnow()
+            try:
+                async with get_session() as db:
+                    if now >= self._next_poll:
+                        await self._load_due_jobs(db, now)
+                        self._next_poll = now + timedelta(seconds=SCHEDULER_POLL_INTERVAL)
+                        
+                    if await self._claim_due(db, now) and self.telegram_client.summary_jobs:
+                        self.telegram_client.summary_jobs.notify()
+            except Exception as e:
+                logger.error(f"Ошибка в цикле планировщика: {str(e)}")
+                
+            wake_at = min(self._next_poll, self._heap[0][0]) if self._heap else self._next_poll
+            await asyncio.sleep(max((wake_at - datetime.utcnow()).total_seconds(), 0))
             
-    def _schedule_all_users(self):
-        """Планирует задачи для всех активных пользователей"""
-        schedule.clear()
-        users = self.db.query(User).join(UserSettings).filter(
-            User.is_active == True,
-            UserSettings.is_active == True
-        ).all()
+    async def _load_due_jobs(self, db: AsyncSession, now: datetime):
+        """
+        Выбирает задачи, срабатывающие в пределах горизонта планирования
         
-        for user in users:
-            self._schedule_user(user)
-            
-        logger.info(f"Запланированы задачи для {len(users)} пользователей")
+        Очередь в памяти строится заново при каждом опросе, поэтому изменения
+        настроек доставки подхватываются не позже чем через SCHEDULER_POLL_INTERVAL секунд.
         
-    def _schedule_user(self, user: User):
+        Args:
+            db: Сессия базы данных
+            now: Текущее время (UTC)
         """
-        Планирует задачи для конкретного пользователя
+        horizon = timedelta(seconds=SCHEDULER_HORIZON + DELIVERY_PREPARE_JITTER)
+        jobs = await get_due_jobs(db, now + horizon, SCHEDULER_BATCH_SIZE)
+        self._heap = [
+            (job.next_run_at - timedelta(seconds=self._prepare_offset(job.user_id)), job.next_run_at, job.user_id)
+            for job in jobs
+        ]
+        self._batch_full = len(jobs) >= SCHEDULER_BATCH_SIZE
+        heapq.heapify(self._heap)
         
-        Args:
-            user: Пользователь для которого нужно запланировать задачи
+    @staticmethod
+    def _prepare_offset(user_id: int) -> float:
         """
-        if not user.settings:
-            logger.warning(f"У пользователя {user.telegram_id} нет настроек")
-            return
-            
-        delivery_time = user.settings.delivery_time
-        frequency = user.settings.delivery_frequency
+        Возвращает, за сколько секунд до доставки начинать генерацию саммари пользователя
         
-        # Функция для выполнения
-        def job():
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            loop.run_until_complete(self._process_user_summaries(user.id))
-            loop.close()
+        Смещение случайно, но постоянно для пользователя, поэтому генерация для пользователей
+        с одинаковым временем доставки распределяется по интервалу DELIVERY_PREPARE_JITTER.
         
-        # Планирование в зависимости от частоты
-        if frequency == "daily":
-            schedule.every().day.at(delivery_time).do(job)
-        elif frequency == "weekly":
-            schedule.every().monday.at(delivery_time).do(job)
-        else:
-            logger.error(f"Неизвестная частота {frequency} для пользователя {user.telegram_id}")
+        Args:
+            user_id: ID пользователя
             
-    async def _process_user_summaries(self, user_id: int):
+        Returns:
+            float: Смещение в секундах
+        """
+        return random.Random(user_id).random() * DELIVERY_PREPARE_JITTER
+        
+    async def _claim_due(self, db: AsyncSession, now: datetime) -> int:
         """
-        Обрабатывает и отправляет саммари для пользователя
+        Забирает сработавшие задачи, ставит их в очередь генерации саммари
+        и планирует следующую доставку для каждой из них
         
         Args:
-            user_id: ID пользователя
+            db: Сессия базы данных
+            now: Текущее время (UTC)
+            
+        Returns:
+            int: Количество задач, поставленных в очередь генерации
         """
-        from src.telegram_client import generate_and_send_summaries
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            due.append(heapq.heappop(self._heap))
+            
+        if not due:
+            return 0
+            
+        settings_by_user = await get_active_user_settings(db, [user_id for _, _, user_id in due])
         
-        user = self.db.query(User).filter(User.id == user_id).first()
-        if not user:
-            logger.error(f"Пользователь с ID {user_id} не найден")
-            return
+        claimed = 0
+        for _, run_at, user_id in due:
+            settings = settings_by_user.get(user_id)
+            # Задача, перенесенная после выборки, не забирается и сработает в новое время
+            if settings and await claim_scheduled_job(db, settings, run_at):
+                claimed += 1
+                
+        # Если опрос уперся в SCHEDULER_BATCH_SIZE, остальные задачи выбираются сразу
+        if not self._heap and self._batch_full:
+            self._next_poll = now
             
-        await generate_and_send_summaries(self.telegram_client, self.db, user) 
\ No newline at end of file
+        return claimed
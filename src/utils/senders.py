@@ -0,0 +1,198 @@
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.config import SENDER_CACHE_SIZE, SENDER_CACHE_TTL
+from src.database import get_sender_names, save_sender_names
+from src.utils.logger import logger
+
+
+UNKNOWN_SENDER = "Unknown"
+
+
+class SenderCache:
+    """LRU-кэш имен отправителей с ограниченным временем жизни записей"""
+
+    def __init__(self, max_size: int = SENDER_CACHE_SIZE, ttl: int = SENDER_CACHE_TTL):
+        """
+        Инициализирует кэш
+
+        Args:
+            max_size: Максимальное количество записей
+            ttl: Время жизни записи в секундах
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self._items = OrderedDict()
+
+    def get(self, sender_id: int) -> Optional[str]:
+        """
+        Возвращает имя отправителя, если оно есть в кэше и не устарело
+
+        Args:
+            sender_id: ID отправителя
+
+        Returns:
+            Optional[str]: Имя отправителя или None
+        """
+        item = self._items.get(sender_id)
+        if item is None:
+            return None
+
+        name, expires_at = item
+        if expires_at < time.monotonic():
+            del self._items[sender_id]
+            return None
+
+        self._items.move_to_end(sender_id)
+        return name
+
+    def set(self, sender_id: int, name: str):
+        """
+        Сохраняет имя отправителя в кэше
+
+        Args:
+            sender_id: ID отправителя
+            name: Имя отправителя
+        """
+        self._items[sender_id] = (name, time.monotonic() + self.ttl)
+        self._items.move_to_end(sender_id)
+
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+
+# Общий для всего процесса кэш имен отправителей
+sender_cache = SenderCache()
+
+
+def get_display_name(entity) -> str:
+    """
+    Формирует отображаемое имя пользователя, чата или канала
+
+    Args:
+        entity: Сущность Telegram
+
+    Returns:
+        str: Отображаемое имя
+    """
+    title = getattr(entity, 'title', None)
+    if title:
+        return title
+
+    name = f"{getattr(entity, 'first_name', None) or ''} {getattr(entity, 'last_name', None) or ''}".strip()
+    return name or getattr(entity, 'username', None) or UNKNOWN_SENDER
+
+
+async def resolve_sender_names(client, db: AsyncSession, messages: List,
+                               cache: SenderCache = sender_cache) -> Dict[int, str]:
+    """
+    Определяет имена отправителей для страницы сообщений
+
+    Имена берутся по порядку из кэша в памяти, из сущностей users/chats, которые Telegram
+    уже вернул вместе с сообщениями, из таблицы senders и только в последнюю очередь
+    одним пакетным запросом get_entity для оставшихся отправителей.
+
+    Args:
+        client: Telegram клиент
+        db: Сессия базы данных
+        messages: Сообщения, для которых нужны имена отправителей
+        cache: Кэш имен в памяти
+
+    Returns:
+        Dict[int, str]: Имена отправителей по их ID
+    """
+    names = {}
+    fresh = {}
+    missing = set()
+
+    for msg in messages:
+        sender_id = msg.sender_id
+        if not sender_id or sender_id in names:
+            continue
+
+        name = cache.get(sender_id)
+        sender = getattr(msg, 'sender', None)
+        if name is None and sender is not None:
+            # Сущность отправителя пришла в том же ответе, что и сообщение
+            name = get_display_name(sender)
+            fresh[sender_id] = name
+
+        if name is None:
+            missing.add(sender_id)
+        else:
+            names[sender_id] = name
+
+    if missing:
+        stored = await get_sender_names(db, missing)
+        names.update(stored)
+        missing.difference_update(stored)
+
+    if missing:
+        fetched = await _fetch_sender_names(client, missing)
+        names.update(fetched)
+        fresh.update(fetched)
+
+    for sender_id, name in names.items():
+        cache.set(sender_id, name)
+
+    await save_sender_names(db, fresh)
+    return names
+
+
+async def remember_senders(db: AsyncSession, messages: List, cache: SenderCache = sender_cache):
+    """
+    Запоминает имена отправителей, сущности которых пришли вместе с сообщениями
+
+    В отличие от resolve_sender_names, никогда не обращается к Telegram.
+
+    Args:
+        db: Сессия базы данных
+        messages: Сообщения Telethon
+        cache: Кэш имен в памяти
+    """
+    fresh = {}
+    for msg in messages:
+        sender = getattr(msg, 'sender', None)
+        if not msg.sender_id or sender is None:
+            continue
+
+        name = get_display_name(sender)
+        if cache.get(msg.sender_id) != name:
+            fresh[msg.sender_id] = name
+        cache.set(msg.sender_id, name)
+
+    await save_sender_names(db, fresh)
+
+
+async def _fetch_sender_names(client, sender_ids: Iterable[int]) -> Dict[int, str]:
+    """
+    Загружает сущности отправителей одним запросом к Telegram
+
+    Пакетный запрос не удается целиком, если хотя бы одна сущность недоступна (например,
+    аккаунт удален). Тогда сущности запрашиваются по одной, и без имени остаются только
+    недоступные отправители.
+
+    Args:
+        client: Telegram клиент
+        sender_ids: ID отправителей
+
+    Returns:
+        Dict[int, str]: Имена найденных отправителей по их ID
+    """
+    sender_ids = list(sender_ids)
+    try:
+        entities = await client.get_entity(sender_ids)
+        return {sender_id: get_display_name(entity) for sender_id, entity in zip(sender_ids, entities)}
+    except Exception as e:
+        logger.warning(f"Не удалось получить сущности отправителей {sender_ids} одним запросом: {str(e)}")
+
+    names = {}
+    for sender_id in sender_ids:
+        try:
+            names[sender_id] = get_display_name(await client.get_entity(sender_id))
+        except Exception as e:
+            logger.warning(f"Не удалось получить сущность отправителя {sender_id}: {str(e)}")
+    return names
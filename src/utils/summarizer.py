@@ -0,0 +1,310 @@
+import asyncio
+import hashlib
+import json
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from src.config import SUMMARY_MAX_TOKENS
+from src.utils.logger import logger
+from src.utils.openrouter import (
+    SYSTEM_PROMPT,
+    SUMMARY_PROMPT,
+    SUMMARY_STRUCTURE,
+    complete,
+    summarize_text,
+    resolve_request_model
+)
+from src.utils.tokens import estimate_tokens, get_input_budget, get_model_info, split_to_budget, trim_to_budget
+from src.utils.transcript import Transcript
+
+
+# Версия промптов саммаризации. Меняется при любом изменении промптов,
+# чтобы кэш саммари не отдавал результаты, полученные со старыми промптами
+PROMPT_VERSION = 2
+
+# Максимальная длина частичного саммари фрагмента в токенах
+PARTIAL_SUMMARY_TOKENS = 600
+
+MAP_PROMPT = """Это фрагмент длинной переписки из телеграм-чата. Кратко перечисли по пунктам:
+темы, которые обсуждались, ключевые обсуждения с их основными моментами и важные объявления.
+Не добавляй вступлений, только факты из фрагмента.
+
+Фрагмент переписки:
+{messages}
+"""
+
+MERGE_PROMPT = """Ниже частичные саммари последовательных фрагментов переписки из телеграм-чата.
+Объедини их в одно краткое саммари по пунктам: темы, ключевые обсуждения, важные объявления.
+Убери повторы, сохрани все важные факты.
+
+Частичные саммари:
+{partials}
+"""
+
+REDUCE_PROMPT = f"""Ниже частичные саммари последовательных фрагментов переписки из телеграм-чата за один период.
+Составь из них единое саммари всей переписки.
+{SUMMARY_STRUCTURE}
+
+Частичные саммари:
+{{partials}}
+
+Составь максимально информативное саммари, выделяя самое важное. Постарайся сделать его лаконичным, но полезным.
+"""
+
+# Разделы состояния инкрементального саммари и их заголовки в промпте
+STATE_SECTIONS = {
+    "topics": "Актуальные темы",
+    "open_discussions": "Открытые обсуждения",
+    "announcements": "Действующие объявления",
+}
+
+# Максимум пунктов в каждом разделе состояния
+STATE_SECTION_ITEMS = 7
+
+INCREMENTAL_PROMPT = f"""Ниже сохраненное состояние телеграм-чата и новые сообщения, появившиеся после него.
+
+Состояние чата:
+{{state}}
+
+Новые сообщения:
+{{messages}}
+
+Ответь одним JSON-объектом без пояснений и без разметки вокруг него, с полями:
+"digest" - саммари новых сообщений с учетом состояния чата (строка).
+{SUMMARY_STRUCTURE}
+"topics" - актуальные темы чата,
+"open_discussions" - незавершенные обсуждения и вопросы без ответа,
+"announcements" - действующие объявления, договоренности и сроки.
+Последние три поля - списки строк, не больше {STATE_SECTION_ITEMS} пунктов в каждом, по одной короткой строке на пункт.
+Обнови их по новым сообщениям: добавь новое, убери завершенное и устаревшее, не повторяй одно и то же.
+"""
+
+# Длина ответа на инкрементальный запрос: саммари и обновленное состояние
+INCREMENTAL_MAX_TOKENS = SUMMARY_MAX_TOKENS + PARTIAL_SUMMARY_TOKENS
+
+
+def get_summary_cache_key(chat_id, from_message_id: int, to_message_id: int, model: str,
+                          variant: str = "") -> str:
+    """
+    Вычисляет ключ кэша саммари для окна сообщений
+
+    Args:
+        chat_id: ID чата из подписки
+        from_message_id: ID первого сообщения окна
+        to_message_id: ID последнего сообщения окна
+        model: Название модели
+        variant: Способ подготовки переписки (например, включенные этапы предобработки)
+
+    Returns:
+        str: Ключ кэша (SHA-256)
+    """
+    raw = f"{chat_id}:{from_message_id}:{to_message_id}:{model}:{PROMPT_VERSION}:{variant}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def get_chunk_budget(model: str, prompt: str, output_tokens: int) -> int:
+    """
+    Вычисляет размер фрагмента в токенах для запроса с заданным промптом
+
+    Фрагмент ограничен как контекстом модели, так и chunk_tokens из ее параметров,
+    чтобы отдельные запросы оставались быстрыми.
+
+    Args:
+        model: Название модели
+        prompt: Шаблон промпта запроса
+        output_tokens: Длина ответа, которую нужно зарезервировать
+
+    Returns:
+        int: Бюджет токенов на фрагмент
+    """
+    budget = get_input_budget(model, SYSTEM_PROMPT + prompt, output_tokens)
+    return min(budget, get_model_info(model)["chunk_tokens"])
+
+
+async def summarize_messages(transcript: Transcript, model_name: str = None,
+                             on_text: Callable[[str], Awaitable[None]] = None) -> str:
+    """
+    Генерирует саммари переписки любого размера
+
+    Небольшая переписка саммаризируется одним запросом. Большая разбивается на фрагменты
+    по границам сообщений, фрагменты саммаризируются параллельно (map), после чего частичные
+    саммари объединяются одним или несколькими проходами (reduce) в итоговое саммари.
+    Легенда участников повторяется в каждом фрагменте.
+
+    Args:
+        transcript: Переписка
+        model_name: Название модели
+        on_text: Получатель текста итогового саммари по мере генерации (опционально)
+
+    Returns:
+        str: Сгенерированное саммари
+
+    Raises:
+        OpenRouterError: Если API вернул ответ с ошибкой
+    """
+    model = resolve_request_model(model_name, estimate_tokens(transcript.text()))
+
+    legend, lines = transcript.legend, transcript.lines
+
+    single_budget = get_chunk_budget(model, SUMMARY_PROMPT + legend, SUMMARY_MAX_TOKENS)
+    if len(split_to_budget(lines, single_budget)) <= 1:
+        return await summarize_text(transcript.text(), model, on_text)
+
+    chunks = split_to_budget(lines, get_chunk_budget(model, MAP_PROMPT + legend, PARTIAL_SUMMARY_TOKENS))
+    logger.info(f"Иерархическая саммаризация: {len(chunks)} фрагментов, модель {model}")
+
+    semaphore = asyncio.Semaphore(get_model_info(model)["fan_out"])
+    partials = await asyncio.gather(*[
+        _summarize_chunk(legend + chunk, model, semaphore) for chunk in chunks
+    ])
+
+    # Промежуточные проходы, пока частичные саммари не поместятся в один запрос
+    reduce_budget = get_chunk_budget(model, REDUCE_PROMPT, SUMMARY_MAX_TOKENS)
+    merge_budget = get_chunk_budget(model, MERGE_PROMPT, PARTIAL_SUMMARY_TOKENS)
+    while len(split_to_budget([f"{partial}\n\n" for partial in partials], reduce_budget)) > 1:
+        groups = split_to_budget([f"{partial}\n\n" for partial in partials], merge_budget)
+        logger.info(f"Промежуточное объединение: {len(partials)} частичных саммари в {len(groups)}")
+        partials = await asyncio.gather(*[
+            _merge_partials(group, model, semaphore) for group in groups
+        ])
+
+    return await _reduce_partials("".join(f"{partial}\n\n" for partial in partials), model, on_text)
+
+
+async def _summarize_chunk(chunk: str, model: str, semaphore: asyncio.Semaphore) -> str:
+    """
+    Саммаризирует один фрагмент переписки (map)
+
+    Args:
+        chunk: Фрагмент переписки
+        model: Название модели
+        semaphore: Ограничение параллельности запросов
+
+    Returns:
+        str: Частичное саммари фрагмента
+    """
+    async with semaphore:
+        return await complete(MAP_PROMPT.format(messages=chunk), model, max_tokens=PARTIAL_SUMMARY_TOKENS)
+
+
+async def _merge_partials(partials: str, model: str, semaphore: asyncio.Semaphore) -> str:
+    """
+    Объединяет несколько частичных саммари в одно частичное (промежуточный reduce)
+
+    Args:
+        partials: Частичные саммари последовательных фрагментов
+        model: Название модели
+        semaphore: Ограничение параллельности запросов
+
+    Returns:
+        str: Объединенное частичное саммари
+    """
+    async with semaphore:
+        return await complete(MERGE_PROMPT.format(partials=partials), model, max_tokens=PARTIAL_SUMMARY_TOKENS)
+
+
+async def _reduce_partials(partials: str, model: str, on_text: Callable[[str], Awaitable[None]] = None) -> str:
+    """
+    Составляет итоговое саммари из частичных (финальный reduce)
+
+    Args:
+        partials: Частичные саммари последовательных фрагментов
+        model: Название модели
+        on_text: Получатель текста итогового саммари по мере генерации (опционально)
+
+    Returns:
+        str: Итоговое саммари
+    """
+    return await complete(REDUCE_PROMPT.format(partials=partials), model, on_text=on_text)
+
+
+def render_state(state: Optional[str]) -> str:
+    """
+    Формирует текст состояния инкрементального саммари для промпта
+
+    Args:
+        state: Состояние в JSON или None, если оно строится заново
+
+    Returns:
+        str: Разделы состояния списками
+    """
+    if state is None:
+        return "пока нет, состояние строится заново по новым сообщениям"
+
+    sections = json.loads(state)
+    return "".join(
+        f"{title}:\n" + ("".join(f"- {item}\n" for item in sections.get(name, [])) or "- нет\n")
+        for name, title in STATE_SECTIONS.items()
+    )
+
+
+def parse_incremental_response(response: str) -> Tuple[str, Optional[str]]:
+    """
+    Разбирает ответ модели на инкрементальный запрос
+
+    Args:
+        response: Ответ модели
+
+    Returns:
+        Tuple[str, Optional[str]]: Текст саммари и новое состояние в JSON
+            (None, если ответ не удалось разобрать - тогда весь ответ считается саммари)
+    """
+    try:
+        data = json.loads(response[response.index("{"):response.rindex("}") + 1])
+        digest = data["digest"]
+        if not isinstance(digest, str) or not digest.strip():
+            raise ValueError("пустое саммари")
+        sections: Dict[str, List[str]] = {}
+        for name in STATE_SECTIONS:
+            items = data.get(name) or []
+            if not isinstance(items, list):
+                items = [items]
+            sections[name] = [str(item).strip() for item in items if str(item).strip()][:STATE_SECTION_ITEMS]
+    except (ValueError, KeyError, TypeError, AttributeError) as e:
+        logger.warning(f"Не удалось разобрать ответ инкрементальной саммаризации: {str(e)}")
+        return response.strip(), None
+
+    return digest.strip(), json.dumps(sections, ensure_ascii=False)
+
+
+async def summarize_incremental(transcript: Transcript, state: Optional[str], model_name: str = None) -> str:
+    """
+    Обновляет инкрементальное саммари по новой переписке
+
+    Модели передаются только новые сообщения и компактное состояние чата, а в ответ
+    она возвращает саммари новых сообщений вместе с обновленным состоянием (JSON,
+    разбирается parse_incremental_response). Если новая переписка не помещается в один
+    запрос, вместо нее передаются частичные саммари ее фрагментов.
+
+    Args:
+        transcript: Новая переписка
+        state: Текущее состояние в JSON или None, если оно строится заново
+        model_name: Название модели
+
+    Returns:
+        str: Ответ модели
+
+    Raises:
+        OpenRouterError: Если API вернул ответ с ошибкой
+    """
+    model = resolve_request_model(model_name, estimate_tokens(transcript.text()))
+    rendered_state = render_state(state)
+
+    budget = get_chunk_budget(model, INCREMENTAL_PROMPT.format(state=rendered_state, messages=""), INCREMENTAL_MAX_TOKENS)
+    if len(split_to_budget(transcript.lines, budget - estimate_tokens(transcript.legend))) <= 1:
+        messages_text = transcript.text()
+    else:
+        chunks = split_to_budget(
+            transcript.lines, get_chunk_budget(model, MAP_PROMPT + transcript.legend, PARTIAL_SUMMARY_TOKENS)
+        )
+        logger.info(f"Инкрементальная саммаризация по частичным саммари: {len(chunks)} фрагментов, модель {model}")
+        semaphore = asyncio.Semaphore(get_model_info(model)["fan_out"])
+        partials = await asyncio.gather(*[
+            _summarize_chunk(transcript.legend + chunk, model, semaphore) for chunk in chunks
+        ])
+        messages_text, trimmed = trim_to_budget("".join(f"{partial}\n\n" for partial in partials), budget)
+        if trimmed:
+            logger.warning(f"Частичные саммари обрезаны до {budget} токенов, модель {model}")
+
+    # Обе подстановки делаются за один проход, чтобы текст состояния не мог подставить в себя переписку
+    prompt = INCREMENTAL_PROMPT.format(state=rendered_state, messages=messages_text)
+    return await complete(prompt, model, max_tokens=INCREMENTAL_MAX_TOKENS)
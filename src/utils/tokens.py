@@ -0,0 +1,224 @@
+import re
+from typing import Callable, Dict, List, Tuple
+
+from src.config import AUTO_MODEL, AVAILABLE_MODELS, DEFAULT_OPENROUTER_MODEL, SUMMARY_MAX_TOKENS, TOKEN_SAFETY_MARGIN
+
+
+# Фрагменты, на которые BPE-токенизаторы обычно режут текст: слова, числа и отдельные символы
+_PIECE_PATTERN = re.compile(r"[A-Za-z]+|[^\W\d_]+|\d{1,3}|\S")
+
+
+def approximate_bpe_tokens(text: str) -> int:
+    """
+    Быстро оценивает количество токенов в тексте без настоящего токенизатора
+
+    Оценка повторяет поведение BPE-словарей современных моделей: латинское слово
+    занимает примерно токен на 4 буквы, кириллическое - токен на 3 буквы,
+    числа режутся по 3 цифры, знаки препинания и прочие символы - по токену.
+
+    Args:
+        text: Текст
+
+    Returns:
+        int: Оценка количества токенов
+    """
+    tokens = 0
+    for piece in _PIECE_PATTERN.findall(text):
+        if piece.isascii():
+            tokens += (len(piece) + 3) // 4 if piece.isalpha() else 1
+        else:
+            tokens += (len(piece) + 2) // 3
+    return tokens
+
+
+_estimator: Callable[[str], int] = approximate_bpe_tokens
+
+
+def set_token_estimator(estimator: Callable[[str], int]):
+    """
+    Подключает другой способ подсчета токенов (например, настоящий токенизатор модели)
+
+    Args:
+        estimator: Функция, возвращающая количество токенов в тексте
+    """
+    global _estimator
+    _estimator = estimator
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Оценивает количество токенов в тексте текущим способом подсчета
+
+    Args:
+        text: Текст
+
+    Returns:
+        int: Количество токенов
+    """
+    return _estimator(text)
+
+
+def get_model_info(model: str) -> Dict:
+    """
+    Возвращает параметры модели из AVAILABLE_MODELS
+
+    Args:
+        model: Название модели
+
+    Returns:
+        Dict: Параметры модели (для неизвестной модели и auto - параметры модели по умолчанию)
+    """
+    if model == AUTO_MODEL or model not in AVAILABLE_MODELS:
+        model = DEFAULT_OPENROUTER_MODEL
+    return AVAILABLE_MODELS[model]
+
+
+def get_output_tokens(model: str, requested: int = SUMMARY_MAX_TOKENS) -> int:
+    """
+    Возвращает длину ответа, которую можно запросить у модели
+
+    Args:
+        model: Название модели
+        requested: Желаемая длина ответа в токенах
+
+    Returns:
+        int: Длина ответа, не превышающая лимит модели
+    """
+    return min(requested, get_model_info(model)["max_output_tokens"])
+
+
+def get_input_budget(model: str, prompt: str = "", output_tokens: int = SUMMARY_MAX_TOKENS) -> int:
+    """
+    Вычисляет, сколько токенов переписки можно добавить к промпту, не превысив контекст модели
+
+    Args:
+        model: Название модели
+        prompt: Неизменная часть запроса (системный промпт и инструкции)
+        output_tokens: Длина ответа, которую нужно зарезервировать
+
+    Returns:
+        int: Бюджет токенов на переписку
+    """
+    context_length = get_model_info(model)["context_length"]
+    usable = int(context_length * (1 - TOKEN_SAFETY_MARGIN))
+    return max(usable - estimate_tokens(prompt) - get_output_tokens(model, output_tokens), 0)
+
+
+def fits_context(model: str, prompt: str, output_tokens: int = SUMMARY_MAX_TOKENS) -> bool:
+    """
+    Проверяет, помещается ли запрос вместе с ответом в контекст модели
+
+    Args:
+        model: Название модели
+        prompt: Полный текст запроса
+        output_tokens: Длина ответа, которую нужно зарезервировать
+
+    Returns:
+        bool: True если запрос помещается
+    """
+    usable = int(get_model_info(model)["context_length"] * (1 - TOKEN_SAFETY_MARGIN))
+    return estimate_tokens(prompt) + get_output_tokens(model, output_tokens) <= usable
+
+
+def split_to_budget(lines: List[str], budget: int) -> List[str]:
+    """
+    Разбивает строки на фрагменты, каждый из которых укладывается в бюджет токенов
+
+    Фрагменты режутся по границам строк. Строка, которая сама не помещается в бюджет,
+    разрезается на части.
+
+    Args:
+        lines: Строки (например, сообщения переписки)
+        budget: Бюджет токенов на фрагмент
+
+    Returns:
+        List[str]: Фрагменты
+    """
+    chunks = []
+    current = []
+    current_tokens = 0
+
+    for line in lines:
+        for piece, tokens in _split_line(line, budget):
+            if current and current_tokens + tokens > budget:
+                chunks.append("".join(current))
+                current = []
+                current_tokens = 0
+            current.append(piece)
+            current_tokens += tokens
+
+    if current:
+        chunks.append("".join(current))
+
+    return chunks
+
+
+def trim_to_budget(text: str, budget: int) -> Tuple[str, bool]:
+    """
+    Обрезает текст с начала так, чтобы он уложился в бюджет токенов
+
+    Сохраняется конец текста, то есть самые свежие сообщения переписки.
+
+    Args:
+        text: Текст
+        budget: Бюджет токенов
+
+    Returns:
+        Tuple[str, bool]: Текст, укладывающийся в бюджет, и признак того, что он был обрезан
+    """
+    if estimate_tokens(text) <= budget:
+        return text, False
+
+    keep_chars = _fit_length(text, budget, from_end=True)
+    return text[len(text) - keep_chars:], True
+
+
+def _fit_length(text: str, budget: int, from_end: bool = False) -> int:
+    """
+    Находит, сколько символов с начала (или с конца) текста укладывается в бюджет токенов
+
+    Args:
+        text: Текст
+        budget: Бюджет токенов
+        from_end: Считать символы с конца текста
+
+    Returns:
+        int: Количество символов
+    """
+    def fits(length: int) -> bool:
+        piece = text[len(text) - length:] if from_end else text[:length]
+        return estimate_tokens(piece) <= budget
+
+    # Бинарный поиск по длине: оценка токенов монотонна по длине фрагмента
+    low, high = 0, len(text)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if fits(middle):
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+def _split_line(line: str, budget: int) -> List[Tuple[str, int]]:
+    """
+    Разрезает строку на части, укладывающиеся в бюджет токенов
+
+    Args:
+        line: Строка
+        budget: Бюджет токенов
+
+    Returns:
+        List[Tuple[str, int]]: Части строки и их размер в токенах
+    """
+    tokens = estimate_tokens(line)
+    if tokens <= budget:
+        return [(line, tokens)]
+
+    pieces = []
+    rest = line
+    while rest:
+        length = max(_fit_length(rest, budget), 1)
+        piece, rest = rest[:length], rest[length:]
+        pieces.append((piece, estimate_tokens(piece)))
+    return pieces
@@ -0,0 +1,141 @@
+from collections import Counter
+from string import ascii_uppercase
+from typing import Dict, Hashable, List, Sequence
+
+from src.utils.preprocessing import TranscriptMessage
+
+
+TRANSCRIPT_NOTE = (
+    "Время указано в начале строки, только когда меняется минута; дата - отдельной строкой. "
+    "[N] - номер сообщения, на которое ниже есть ответ, ↩N - ответ на сообщение N. "
+    "В саммари называй участников по именам, а не по обозначениям."
+)
+
+
+class Transcript:
+    """Переписка в компактном формате: легенда участников и строки сообщений"""
+
+    def __init__(self, legend: str, lines: List[str]):
+        """
+        Инициализирует переписку
+
+        Args:
+            legend: Легенда с обозначениями участников и пояснением формата
+            lines: Строки переписки, по одной на сообщение
+        """
+        self.legend = legend
+        self.lines = lines
+
+    def text(self) -> str:
+        """Возвращает переписку одной строкой"""
+        return "".join([self.legend, *self.lines])
+
+
+def make_alias(index: int) -> str:
+    """
+    Возвращает короткое обозначение участника по его номеру: A..Z, затем A1..Z1 и т.д.
+
+    Args:
+        index: Номер участника, начиная с 0
+
+    Returns:
+        str: Обозначение участника
+    """
+    letter = ascii_uppercase[index % len(ascii_uppercase)]
+    round_ = index // len(ascii_uppercase)
+    return f"{letter}{round_}" if round_ else letter
+
+
+def sender_key(message: TranscriptMessage) -> Hashable:
+    """
+    Возвращает ключ отправителя: его ID, а если ID нет - отображаемое имя
+
+    Args:
+        message: Сообщение переписки
+
+    Returns:
+        Hashable: Ключ отправителя
+    """
+    return message.sender_name if message.sender_id is None else message.sender_id
+
+
+def legend_labels(names: Dict[Hashable, str]) -> Dict[Hashable, str]:
+    """
+    Возвращает подписи участников для легенды
+
+    Разные участники с одинаковым именем получают номер: "Алексей (1)", "Алексей (2)".
+
+    Args:
+        names: Имена участников по ключу отправителя, в порядке обозначений
+
+    Returns:
+        Dict[Hashable, str]: Подписи участников по ключу отправителя
+    """
+    counts = Counter(names.values())
+    seen = Counter()
+    labels = {}
+    for key, name in names.items():
+        if counts[name] > 1:
+            seen[name] += 1
+            name = f"{name} ({seen[name]})"
+        labels[key] = name
+    return labels
+
+
+def build_transcript(messages: Sequence[TranscriptMessage]) -> Transcript:
+    """
+    Формирует компактную переписку для саммаризации
+
+    Имена участников заменяются однобуквенными обозначениями из легенды (самые активные
+    получают первые буквы). Обозначения выдаются по ID отправителя, поэтому тезки
+    не сливаются в одного участника. Время пишется только при смене минуты, дата - при смене дня.
+    Ответы ссылаются на короткий номер исходного сообщения, если оно есть в окне.
+
+    Args:
+        messages: Сообщения окна в порядке отправки
+
+    Returns:
+        Transcript: Переписка
+    """
+    activity = Counter(sender_key(message) for message in messages if message.text)
+    aliases = {key: make_alias(index) for index, (key, _) in enumerate(activity.most_common())}
+    if not aliases:
+        return Transcript("", [])
+
+    # Номера получают только сообщения, на которые в окне есть ответы
+    message_ids = {message.id for message in messages if message.text}
+    labels: Dict[int, int] = {}
+    for message in messages:
+        if message.text and message.reply_to in message_ids and message.reply_to not in labels:
+            labels[message.reply_to] = 0
+    for number, message_id in enumerate(sorted(labels), 1):
+        labels[message_id] = number
+
+    lines = []
+    last_day = last_minute = None
+    for message in messages:
+        if not message.text:
+            continue
+
+        parts = []
+        day = message.date.strftime("%d.%m")
+        if day != last_day:
+            parts.append(f"{day}\n")
+            last_day, last_minute = day, None
+
+        minute = message.date.strftime("%H:%M")
+        if minute != last_minute:
+            parts.append(f"{minute} ")
+            last_minute = minute
+        if message.id in labels:
+            parts.append(f"[{labels[message.id]}] ")
+        parts.append(aliases[sender_key(message)])
+        if message.reply_to in labels:
+            parts.append(f"↩{labels[message.reply_to]}")
+        parts.append(f": {message.text}\n")
+        lines.append("".join(parts))
+
+    names = {sender_key(message): message.sender_name for message in messages if message.text}
+    participants = legend_labels({key: names[key] for key in aliases})
+    legend = "Участники: " + "; ".join(f"{alias} - {participants[key]}" for key, alias in aliases.items())
+    return Transcript(f"{legend}\n{TRANSCRIPT_NOTE}\n\n", lines)
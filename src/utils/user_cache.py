@@ -0,0 +1,145 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.config import USER_CACHE_SIZE, USER_CACHE_TTL, USER_FLUSH_INTERVAL
+from src.database import get_session, get_or_create_user, save_user_profiles
+from src.models import User
+from src.utils.logger import logger
+
+
+class UserCache:
+    """
+    LRU-кэш пользователей бота вместе с настройками и подписками
+
+    Команды получают пользователя из памяти. Изменившиеся имена профиля не записываются
+    сразу, а накапливаются (последнее значение на пользователя) и записываются в базу
+    одной транзакцией раз в USER_FLUSH_INTERVAL секунд. После изменения настроек или
+    подписок запись пользователя нужно сбросить методом invalidate.
+    """
+
+    def __init__(self, max_size: int = USER_CACHE_SIZE, ttl: int = USER_CACHE_TTL,
+                 flush_interval: float = USER_FLUSH_INTERVAL):
+        """
+        Инициализирует кэш
+
+        Args:
+            max_size: Максимальное количество пользователей
+            ttl: Время жизни записи в секундах
+            flush_interval: Период записи изменившихся профилей в секундах
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self._items = OrderedDict()  # ID в Telegram -> (пользователь, время устаревания)
+        self._telegram_ids: Dict[int, int] = {}  # ID пользователя -> ID в Telegram
+        self._pending: Dict[int, Dict[str, Optional[str]]] = {}  # Незаписанные профили по ID пользователя
+        self._task = None
+
+    def start(self):
+        """Запускает периодическую запись профилей в текущем цикле событий"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Останавливает периодическую запись и записывает накопленные профили"""
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+        await self.flush()
+
+    async def get_user(self, db: AsyncSession, telegram_id: int, first_name: str,
+                       last_name: str = None, username: str = None) -> User:
+        """
+        Получает пользователя из кэша, при промахе - из базы, создавая его при необходимости
+
+        Args:
+            db: Сессия базы данных (используется только при промахе)
+            telegram_id: ID пользователя в Telegram
+            first_name: Имя пользователя
+            last_name: Фамилия пользователя (опционально)
+            username: Имя пользователя в Telegram (опционально)
+
+        Returns:
+            User: Пользователь с загруженными настройками и подписками
+        """
+        user = self._get(telegram_id)
+        if user is None:
+            user = await get_or_create_user(db, telegram_id, first_name, last_name, username)
+
+            # Объект общий для обработчиков с разными сессиями, поэтому отвязывается от сессии загрузки
+            db.expunge(user)
+            self._set(user)
+
+        profile = {"first_name": first_name, "last_name": last_name, "username": username}
+        if any(getattr(user, field) != value for field, value in profile.items()):
+            for field, value in profile.items():
+                setattr(user, field, value)
+            self._pending[user.id] = profile
+
+        return user
+
+    def invalidate(self, user_id: int):
+        """
+        Удаляет пользователя из кэша, чтобы следующая команда загрузила его из базы
+
+        Args:
+            user_id: ID пользователя
+        """
+        telegram_id = self._telegram_ids.pop(user_id, None)
+        if telegram_id is not None:
+            self._items.pop(telegram_id, None)
+
+    async def flush(self):
+        """Записывает накопленные изменения профилей одной транзакцией"""
+        if not self._pending:
+            return
+
+        pending, self._pending = self._pending, {}
+        try:
+            async with get_session() as db:
+                await save_user_profiles(db, pending)
+        except Exception as e:
+            logger.error(f"Ошибка при записи профилей пользователей: {str(e)}")
+            # Более новые изменения, накопленные во время записи, важнее
+            for user_id, profile in pending.items():
+                self._pending.setdefault(user_id, profile)
+
+    def _get(self, telegram_id: int) -> Optional[User]:
+        """Возвращает пользователя, если он есть в кэше и не устарел"""
+        item = self._items.get(telegram_id)
+        if item is None:
+            return None
+
+        user, expires_at = item
+        if expires_at < time.monotonic():
+            self.invalidate(user.id)
+            return None
+
+        self._items.move_to_end(telegram_id)
+        return user
+
+    def _set(self, user: User):
+        """Сохраняет пользователя в кэше, вытесняя самые давние записи"""
+        self._items[user.telegram_id] = (user, time.monotonic() + self.ttl)
+        self._items.move_to_end(user.telegram_id)
+        self._telegram_ids[user.id] = user.telegram_id
+
+        while len(self._items) > self.max_size:
+            _, (evicted, _) = self._items.popitem(last=False)
+            self._telegram_ids.pop(evicted.id, None)
+
+    async def _run(self):
+        """Периодически записывает накопленные профили"""
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+
+# Общий для всего процесса кэш пользователей бота
+user_cache = UserCache()
@@ -0,0 +1,21 @@
+import asyncio
+
+import pytest
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import NullPool
+
+from src import database
+
+
+@pytest.fixture
+def db_engine(tmp_path, monkeypatch):
+    """База данных во временном файле вместо рабочей, с созданными таблицами и индексами"""
+    # Без пула: каждый тест запускает свой цикл событий, а соединения aiosqlite привязаны к циклу
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'test.db'}", poolclass=NullPool)
+    monkeypatch.setattr(database, "engine", engine)
+    monkeypatch.setattr(
+        database, "SessionLocal", async_sessionmaker(engine, autoflush=False, expire_on_commit=False)
+    )
+    asyncio.run(database.create_tables())
+    yield engine
+    asyncio.run(engine.dispose())
@@ -0,0 +1,123 @@
+import asyncio
+
+from src.utils import delivery
+from src.utils.delivery import DeliveryQueue, ProgressiveMessage
+
+
+class FakeMessage:
+    def __init__(self, text: str):
+        self.text = text
+
+    async def edit(self, text, parse_mode=None):
+        raise AssertionError("правка в обход очереди доставки")
+
+
+class FakeBot:
+    """Бот, который запоминает отправки и правки вместе со временем цикла событий"""
+
+    def __init__(self):
+        self.calls = []
+
+    async def send_message(self, entity, text, parse_mode=None):
+        self.calls.append(("send", text, asyncio.get_event_loop().time()))
+        return FakeMessage(text)
+
+    async def edit_message(self, entity, message, text, parse_mode=None):
+        self.calls.append(("edit", text, asyncio.get_event_loop().time()))
+        message.text = text
+        return message
+
+
+def test_progressive_message_edits_go_through_delivery_queue(monkeypatch):
+    monkeypatch.setattr(delivery, "STREAM_EDIT_INTERVAL", 0)
+
+    async def scenario():
+        bot = FakeBot()
+        queue = DeliveryQueue(bot, global_rate=100, chat_rate=10)
+        queue.start()
+        try:
+            message = ProgressiveMessage(queue, 1, "Заголовок")
+            await message.start()
+            await message.update("Черновик")
+            await asyncio.sleep(0.2)
+            await message.finish("Итог")
+        finally:
+            await queue.stop()
+        return bot.calls
+
+    calls = asyncio.run(scenario())
+
+    assert [(kind, text) for kind, text, _ in calls] == [
+        ("send", "Заголовок\n\n⏳ Генерируется..."),
+        ("edit", "Заголовок\n\nЧерновик ▌"),
+        ("edit", "Итог"),
+    ]
+    # Правки соблюдают интервал чата так же, как отправка
+    times = [at for _, _, at in calls]
+    assert all(later - earlier >= 0.09 for earlier, later in zip(times, times[1:]))
+
+
+def test_edit_interval_is_per_message(monkeypatch):
+    monkeypatch.setattr(delivery, "STREAM_EDIT_INTERVAL", 60)
+
+    async def scenario():
+        bot = FakeBot()
+        first, second = ProgressiveMessage(bot, 1, "Первый"), ProgressiveMessage(bot, 1, "Второй")
+        for message in (first, second):
+            await message.start()
+            await message.update("Черновик")
+            await asyncio.sleep(0)
+            await message.update("Черновик подробнее")
+            await asyncio.sleep(0)
+        return [text for kind, text, _ in bot.calls if kind == "edit"]
+
+    # Интервал одного сообщения не задерживает правки другого сообщения в том же чате
+    assert asyncio.run(scenario()) == ["Первый\n\nЧерновик ▌", "Второй\n\nЧерновик ▌"]
+
+
+class SlowBot(FakeBot):
+    """Бот, правки которого ждут разрешения теста"""
+
+    def __init__(self):
+        super().__init__()
+        self.release = asyncio.Event()
+
+    async def edit_message(self, entity, message, text, parse_mode=None):
+        await self.release.wait()
+        return await super().edit_message(entity, message, text, parse_mode)
+
+
+def test_update_does_not_wait_for_edit(monkeypatch):
+    monkeypatch.setattr(delivery, "STREAM_EDIT_INTERVAL", 0)
+
+    async def scenario():
+        bot = SlowBot()
+        message = ProgressiveMessage(bot, 1, "Заголовок")
+        await message.start()
+        for text in ("Ч", "Черн", "Черновик"):
+            await asyncio.wait_for(message.update(text), 0.1)
+            await asyncio.sleep(0)
+        bot.release.set()
+        await asyncio.sleep(0.1)
+        await message.finish("Итог")
+        return [text for kind, text, _ in bot.calls if kind == "edit"]
+
+    # Правка, начатая до остальных обновлений, показывает первый текст, следующая - последний
+    assert asyncio.run(scenario()) == ["Заголовок\n\nЧ ▌", "Заголовок\n\nЧерновик ▌", "Итог"]
+
+
+def test_finish_cancels_waiting_edit(monkeypatch):
+    monkeypatch.setattr(delivery, "STREAM_EDIT_INTERVAL", 60)
+
+    async def scenario():
+        bot = FakeBot()
+        message = ProgressiveMessage(bot, 1, "Заголовок")
+        await message.start()
+        await message.update("Черновик")
+        await asyncio.sleep(0)
+        await message.update("Черновик подробнее")
+        await message.finish("Итог")
+        await asyncio.sleep(0)
+        return [text for kind, text, _ in bot.calls if kind == "edit"]
+
+    assert asyncio.run(scenario()) == ["Заголовок\n\nЧерновик ▌", "Итог"]
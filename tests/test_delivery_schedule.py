@@ -0,0 +1,56 @@
+from datetime import datetime
+
+import pytest
+import pytz
+
+from src.models import UserSettings
+from src.utils.delivery_schedule import get_next_run_at
+
+
+def _settings(frequency, delivery_time, timezone="UTC"):
+    return UserSettings(user_id=1, delivery_frequency=frequency, delivery_time=delivery_time, timezone=timezone)
+
+
+def _utc(*args):
+    return datetime(*args, tzinfo=pytz.utc)
+
+
+@pytest.mark.parametrize("timezone, delivery_time, after, expected", [
+    ("UTC", "10:30", _utc(2024, 5, 15, 10, 15), _utc(2024, 5, 15, 10, 30)),
+    # Время доставки ищется строго после заданного момента
+    ("UTC", "10:30", _utc(2024, 5, 15, 10, 30), _utc(2024, 5, 15, 11, 30)),
+    ("UTC", "00:45", _utc(2024, 5, 15, 23, 50), _utc(2024, 5, 16, 0, 45)),
+    # Смещения, не кратные часу: минута доставки задана по местному времени
+    ("Asia/Kolkata", "09:00", _utc(2024, 5, 15, 10, 15), _utc(2024, 5, 15, 10, 30)),
+    ("Asia/Kolkata", "09:00", _utc(2024, 5, 15, 10, 45), _utc(2024, 5, 15, 11, 30)),
+    ("Asia/Kathmandu", "09:15", _utc(2024, 5, 15, 10, 0), _utc(2024, 5, 15, 10, 30)),
+    ("America/St_Johns", "09:00", _utc(2024, 5, 15, 10, 0), _utc(2024, 5, 15, 10, 30)),
+])
+def test_hourly_delivery_uses_local_minute(timezone, delivery_time, after, expected):
+    assert get_next_run_at(_settings("hourly", delivery_time, timezone), after) == expected
+
+
+@pytest.mark.parametrize("timezone, after, expected", [
+    # 15 мая 2024 - среда, доставка в ближайший понедельник
+    ("Europe/Moscow", _utc(2024, 5, 15, 12, 0), _utc(2024, 5, 20, 6, 0)),
+    ("Europe/Moscow", _utc(2024, 5, 20, 5, 0), _utc(2024, 5, 20, 6, 0)),
+    ("Europe/Moscow", _utc(2024, 5, 20, 6, 0), _utc(2024, 5, 27, 6, 0)),
+    ("Asia/Kolkata", _utc(2024, 5, 15, 12, 0), _utc(2024, 5, 20, 3, 30)),
+    # В UTC еще воскресенье, а в Окленде уже понедельник после времени доставки
+    ("Pacific/Auckland", _utc(2024, 5, 19, 22, 0), _utc(2024, 5, 26, 21, 0)),
+    # Переход на летнее время между выборкой и доставкой
+    ("America/New_York", _utc(2024, 3, 6, 12, 0), _utc(2024, 3, 11, 13, 0)),
+])
+def test_weekly_delivery_on_monday(timezone, after, expected):
+    assert get_next_run_at(_settings("weekly", "09:00", timezone), after) == expected
+
+
+def test_daily_delivery_follows_daylight_saving():
+    settings = _settings("daily", "09:00", "America/New_York")
+
+    assert get_next_run_at(settings, _utc(2024, 3, 9, 15, 0)) == _utc(2024, 3, 10, 13, 0)
+    assert get_next_run_at(settings, _utc(2024, 3, 8, 13, 0)) == _utc(2024, 3, 8, 14, 0)
+
+
+def test_unknown_frequency_has_no_delivery():
+    assert get_next_run_at(_settings("monthly", "09:00"), _utc(2024, 5, 15, 12, 0)) is None
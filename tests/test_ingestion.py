@@ -0,0 +1,68 @@
+import asyncio
+
+from telethon.tl import types
+
+from src.utils.ingestion import IngestionState, iter_message_pages
+
+
+class HistoryClient:
+    """Клиент с историей чата из сообщений с ID 1..count"""
+
+    def __init__(self, texts):
+        self.messages = [types.Message(index, message=text) for index, text in enumerate(texts, start=1)]
+        self.requests = []
+
+    async def iter_messages(self, entity, reverse=False, min_id=0, offset_date=None):
+        self.requests.append(min_id)
+        for msg in self.messages:
+            if msg.id > min_id:
+                yield msg
+
+
+def collect(client, state, **limits):
+    async def run():
+        return [[msg.id for msg in page] async for page in iter_message_pages(client, None, state, **limits)]
+
+    return asyncio.run(run())
+
+
+def test_window_is_paginated_after_last_id():
+    state = IngestionState(last_id=2)
+
+    pages = collect(HistoryClient(["текст"] * 7), state, page_size=2)
+
+    assert pages == [[3, 4], [5, 6], [7]]
+    assert (state.start_id, state.first_id, state.last_id, state.count, state.truncated) == (2, 3, 7, 5, False)
+
+
+def test_message_cap_truncates_and_resumes():
+    client = HistoryClient(["текст"] * 7)
+    state = IngestionState()
+
+    assert collect(client, state, page_size=2, max_messages=3) == [[1, 2], [3]]
+    assert state.truncated and state.last_id == 3
+
+    # Повторный обход продолжает окно с места остановки
+    state = IngestionState(state.last_id)
+    assert collect(client, state, page_size=2, max_messages=3) == [[4, 5], [6]]
+    assert client.requests == [0, 3]
+
+
+def test_byte_cap_counts_utf8_bytes():
+    # Кириллическая буква занимает два байта
+    state = IngestionState()
+
+    pages = collect(HistoryClient(["абв", "где", "ёжз"]), state, max_bytes=12)
+
+    assert pages == [[1, 2]]
+    assert state.truncated and state.bytes == 12
+
+
+def test_oversized_first_message_is_still_read():
+    state = IngestionState()
+
+    pages = collect(HistoryClient(["x" * 100, "y"]), state, max_bytes=10)
+
+    # Одно слишком длинное сообщение не останавливает обход навсегда
+    assert pages == [[1]]
+    assert state.truncated and state.last_id == 1
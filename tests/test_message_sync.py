@@ -0,0 +1,130 @@
+import asyncio
+
+from telethon.tl import types
+
+from src import database
+from src.utils import message_sync
+from src.utils.message_sync import MessageSync
+
+
+class SlowHistoryClient:
+    """Клиент, история чатов которого загружается медленно"""
+
+    def __init__(self):
+        self.loading = 0
+        self.max_loading = 0
+
+    def add_event_handler(self, callback, event):
+        pass
+
+    def remove_event_handler(self, callback):
+        pass
+
+    def add_reconnect_handler(self, callback):
+        self.on_reconnect = callback
+
+    def remove_reconnect_handler(self, callback):
+        pass
+
+    def is_connected(self):
+        return True
+
+    async def get_entity(self, entity_id):
+        return types.PeerUser(entity_id)
+
+    async def get_messages(self, entity, limit=None):
+        return []
+
+    async def iter_messages(self, entity, **kwargs):
+        self.loading += 1
+        self.max_loading = max(self.max_loading, self.loading)
+        try:
+            await asyncio.sleep(0.05)
+        finally:
+            self.loading -= 1
+        return
+        yield
+
+
+def test_start_fills_gaps_in_background_with_bounded_concurrency(db_engine, monkeypatch):
+    monkeypatch.setattr(message_sync, "MESSAGE_SYNC_CONCURRENCY", 2)
+
+    async def scenario():
+        async with database.get_session() as db:
+            user = await database.get_or_create_user(db, 1, "Тест")
+            for chat_id in range(1001, 1007):
+                await database.subscribe_to_chat(db, user.id, chat_id, f"Чат {chat_id}")
+
+        client = SlowHistoryClient()
+        sync = MessageSync(client)
+        await sync.start()
+        # Запуск не ждет догрузки истории
+        live_after_start = len(sync._live)
+
+        await sync._track_task
+        live_after_fill = len(sync._live)
+        await sync.stop()
+        return live_after_start, live_after_fill, client.max_loading
+
+    assert asyncio.run(scenario()) == (0, 6, 2)
+
+
+class LatestMessageClient(SlowHistoryClient):
+    """Клиент, в чате которого последнее сообщение имеет заданный ID"""
+
+    def __init__(self, latest_id):
+        super().__init__()
+        self.latest_id = latest_id
+        self.loaded_after = []
+
+    async def get_messages(self, entity, limit=None):
+        return [types.Message(self.latest_id, message="")]
+
+    async def iter_messages(self, entity, **kwargs):
+        self.loaded_after.append(kwargs.get("min_id"))
+        return
+        yield
+
+
+async def _live_sync(client, last_message_id):
+    """Синхронизация с одним чатом, хранилище которого непрерывно до last_message_id"""
+    async with database.get_session() as db:
+        await database.update_chat_sync_state(db, 1001, last_message_id, synced_from_id=1)
+    sync = MessageSync(client)
+    await sync.start()
+    await sync.track(1001)
+    return sync
+
+
+def test_store_is_trusted_only_with_latest_message(db_engine):
+    async def scenario():
+        client = LatestMessageClient(latest_id=10)
+        sync = await _live_sync(client, 10)
+        up_to_date = await sync.get_live_peer(1001, 5)
+
+        # Обновление с сообщением 11 потерялось: окно читается из сети, а пропуск догружается
+        client.latest_id = 11
+        behind = await sync.get_live_peer(1001, 5)
+        await asyncio.gather(*sync._gap_tasks)
+        await sync.stop()
+        return up_to_date, behind, client.loaded_after
+
+    peer_id, behind, loaded_after = asyncio.run(scenario())
+    assert peer_id == 1001
+    assert behind is None
+    assert loaded_after[-1] == 10
+
+
+def test_reconnect_refills_all_chats(db_engine):
+    async def scenario():
+        client = LatestMessageClient(latest_id=10)
+        sync = await _live_sync(client, 10)
+        loads = len(client.loaded_after)
+
+        await client.on_reconnect()
+        assert not sync._live
+        await asyncio.gather(*sync._gap_tasks)
+        await sync.stop()
+        return len(client.loaded_after) - loads
+
+    assert asyncio.run(scenario()) == 1
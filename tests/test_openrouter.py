@@ -0,0 +1,106 @@
+import asyncio
+import socket
+
+import pytest
+from aiohttp import web
+
+from src.config import AUTO_MODEL, DEFAULT_OPENROUTER_MODEL
+from src.utils import openrouter
+from src.utils.openrouter import OpenRouterClient, OpenRouterError, resolve_request_model, route_model
+from src.utils.tokens import get_model_info
+
+
+async def collect_stream(lines):
+    """Запрашивает потоковый ответ у локального сервера, который отдает строки SSE"""
+    async def completions(request):
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        for line in lines:
+            await response.write(f"{line}\n\n".encode())
+        await response.write_eof()
+        return response
+
+    app = web.Application()
+    app.router.add_post("/chat/completions", completions)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    sock = socket.create_server(("127.0.0.1", 0))
+    await web.SockSite(runner, sock).start()
+
+    client = OpenRouterClient("key", f"http://127.0.0.1:{sock.getsockname()[1]}")
+    try:
+        return [delta async for delta in client.stream_chat_completion({"model": "test/model"})]
+    finally:
+        await client.stop()
+        await runner.cleanup()
+
+
+def test_stream_yields_deltas():
+    lines = [
+        ": OPENROUTER PROCESSING",
+        'data: {"choices": [{"delta": {"content": "При"}}]}',
+        'data: {"choices": [{"delta": {"content": "вет"}}]}',
+        "data: [DONE]",
+    ]
+    assert asyncio.run(collect_stream(lines)) == ["При", "вет"]
+
+
+def test_malformed_stream_chunk_raises_openrouter_error():
+    lines = ['data: {"choices": [{"delta": {"content": "При"}}]}', "data: {обрыв"]
+    with pytest.raises(OpenRouterError) as error:
+        asyncio.run(collect_stream(lines))
+    assert error.value.status == 502
+
+
+FAST_MODELS = ["meta-llama/llama-3-8b-instruct", "anthropic/claude-3-haiku-20240307"]
+
+
+@pytest.fixture
+def auto_models(monkeypatch):
+    """Автовыбор без случайных запросов и с чистой статистикой моделей"""
+    monkeypatch.setattr(openrouter, "AUTO_FAST_MODELS", FAST_MODELS)
+    monkeypatch.setattr(openrouter, "AUTO_EXPLORE_RATE", 0)
+    monkeypatch.setattr(openrouter, "_model_stats", {})
+    monkeypatch.setattr(openrouter, "_circuit_breakers", {})
+
+
+def test_route_prefers_lower_average_latency(auto_models):
+    slow, fast = FAST_MODELS
+    for latency in (1.0, 1.0, 10.0):
+        openrouter.get_model_stats(slow).record_success(latency)
+    for latency in (3.0, 3.0, 3.0):
+        openrouter.get_model_stats(fast).record_success(latency)
+
+    # Скользящая средняя медленной модели после одного долгого запроса - 2.8 с
+    assert route_model(100) == slow
+
+    openrouter.get_model_stats(slow).record_success(10.0)
+    assert route_model(100) == fast
+
+
+def test_route_prefers_models_without_stats(auto_models):
+    openrouter.get_model_stats(FAST_MODELS[0]).record_success(0.1)
+
+    assert route_model(100) == FAST_MODELS[1]
+
+
+def test_route_skips_open_circuit(auto_models):
+    openrouter.get_model_stats(FAST_MODELS[1]).record_success(5.0)
+    breaker = openrouter.get_circuit_breaker(FAST_MODELS[0])
+    for _ in range(breaker.threshold):
+        breaker.record_failure()
+
+    assert route_model(100) == FAST_MODELS[1]
+
+    breaker = openrouter.get_circuit_breaker(FAST_MODELS[1])
+    for _ in range(breaker.threshold):
+        breaker.record_failure()
+
+    assert route_model(100) == DEFAULT_OPENROUTER_MODEL
+
+
+def test_auto_is_resolved_to_a_real_model(auto_models):
+    model = resolve_request_model(AUTO_MODEL, 100)
+
+    assert model in FAST_MODELS
+    assert get_model_info(AUTO_MODEL) is get_model_info(DEFAULT_OPENROUTER_MODEL)
@@ -0,0 +1,104 @@
+from datetime import datetime, timezone
+
+from src.utils.preprocessing import (
+    DEFAULT_STAGES,
+    PreprocessingStats,
+    STAGES,
+    TranscriptMessage,
+    collapse_duplicates,
+    drop_service,
+    drop_trivial,
+    normalize_whitespace,
+    parse_stages,
+    preprocess,
+    strip_urls,
+    truncate_long,
+)
+
+DATE = datetime(2024, 5, 15, 12, 0, tzinfo=timezone.utc)
+
+
+def _messages(*texts, **flags):
+    return [TranscriptMessage(index, DATE, 1, "Анна", text, **flags) for index, text in enumerate(texts, start=1)]
+
+
+def _texts(messages):
+    return [message.text for message in messages]
+
+
+def test_drop_service_removes_service_bot_and_empty_messages():
+    messages = [
+        *_messages("вошла в чат", is_service=True),
+        *_messages("погода: +20", is_bot=True),
+        *_messages("  ", "релиз в пятницу"),
+    ]
+
+    assert _texts(drop_service(messages)) == ["релиз в пятницу"]
+
+
+def test_drop_trivial_keeps_replies_with_content():
+    messages = _messages("+1", "Ок!", "спасибо)", "👍👍", "ахахах", "ок, тогда завтра в 10", "+1 к идее с кэшем")
+
+    assert _texts(drop_trivial(messages)) == ["ок, тогда завтра в 10", "+1 к идее с кэшем"]
+
+
+def test_normalize_whitespace():
+    [message] = normalize_whitespace(_messages("  первый   абзац\t\n\n\n  второй  абзац  "))
+
+    assert message.text == "первый абзац\nвторой абзац"
+
+
+def test_strip_urls_keeps_domains():
+    [message] = strip_urls(_messages(
+        "смотри https://www.github.com/org/repo/pull/1?tab=files и www.example.org/path, а также (http://docs.python.org)"
+    ))
+
+    assert message.text == "смотри [github.com] и [example.org], а также ([docs.python.org])"
+
+
+def test_collapse_duplicates_ignores_case():
+    messages = _messages("Скидка 50%!", "обсудим релиз", "скидка 50%!", "СКИДКА 50%!")
+
+    assert _texts(collapse_duplicates(messages)) == ["Скидка 50%!", "обсудим релиз"]
+
+
+def test_truncate_long():
+    [short, long] = truncate_long(_messages("коротко", "лог " * 10), max_chars=12)
+
+    assert short.text == "коротко"
+    assert long.text == "лог лог лог… [обрезано]"
+
+
+def test_preprocess_applies_enabled_stages_and_counts_removed():
+    messages = [
+        *_messages("вошла в чат", is_service=True),
+        *_messages("+1", "завтра   созвон", "завтра созвон", "итоги: https://example.com/notes"),
+    ]
+    stats = PreprocessingStats()
+
+    result = preprocess(messages, ["service", "trivial", "whitespace", "duplicates"], stats)
+    # Этапы - генераторы: статистика заполняется, только когда результат прочитан
+    assert stats.output_messages == 0
+    texts = _texts(result)
+
+    assert texts == ["завтра созвон", "итоги: https://example.com/notes"]
+    assert (stats.input_messages, stats.output_messages) == (5, 2)
+    assert stats.removed_messages == {"service": 1, "trivial": 1, "whitespace": 0, "duplicates": 1}
+    assert stats.removed_tokens["whitespace"] == 0
+    assert stats.input_tokens - stats.output_tokens == sum(stats.removed_tokens.values())
+    assert "5 -> 2 сообщений" in stats.describe()
+
+
+def test_preprocess_without_stages_passes_messages_through():
+    messages = _messages("+1", "+1")
+
+    assert _texts(preprocess(messages, [])) == ["+1", "+1"]
+
+
+def test_parse_stages():
+    assert parse_stages(None) == DEFAULT_STAGES
+    assert parse_stages(None) is not DEFAULT_STAGES
+    assert parse_stages("") == []
+    # Порядок применения задается STAGES, неизвестные названия пропускаются
+    assert parse_stages(" urls, service ,unknown") == ["service", "urls"]
+    assert parse_stages(",".join(reversed(STAGES))) == list(STAGES)
@@ -0,0 +1,91 @@
+import asyncio
+from datetime import datetime
+
+from sqlalchemy import event
+
+from src import database
+
+
+def query_plans(engine, scenario) -> dict:
+    """
+    Выполняет сценарий и возвращает планы всех SELECT, которые он отправил в базу
+
+    Returns:
+        dict: Текст запроса -> строки EXPLAIN QUERY PLAN
+    """
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("SELECT"):
+            statements.append((statement, parameters))
+
+    async def run():
+        event.listen(engine.sync_engine, "before_cursor_execute", record)
+        try:
+            async with database.get_session() as db:
+                await scenario(db)
+        finally:
+            event.remove(engine.sync_engine, "before_cursor_execute", record)
+
+        plans = {}
+        async with engine.connect() as conn:
+            for statement, parameters in statements:
+                rows = await conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters)
+                plans[statement] = [row[3] for row in rows]
+        return plans
+
+    return asyncio.run(run())
+
+
+def assert_searches(plans: dict, table: str, index: str):
+    """Проверяет, что запросы к таблице ищут по индексу и не сортируют результат отдельно"""
+    table_plans = [plan for statement, plan in plans.items() if f"FROM {table} " in f"{statement} "]
+    assert table_plans, f"нет запросов к {table}"
+    for plan in table_plans:
+        assert any(step.startswith(f"SEARCH {table} USING") and index in step for step in plan), plan
+        assert not any("TEMP B-TREE" in step for step in plan), plan
+
+
+def test_subscription_lookup_uses_index(db_engine):
+    async def scenario(db):
+        user = await database.get_or_create_user(db, 1, "Тест")
+        await database.subscribe_to_chat(db, user.id, -100, "Чат")
+
+    plans = query_plans(db_engine, scenario)
+    assert_searches(plans, "chat_subscriptions", "ix_chat_subscriptions_user_id_chat_id")
+
+
+def test_history_page_uses_index(db_engine):
+    async def scenario(db):
+        await database.get_summary_history(db, 1, (datetime.utcnow(), 10), 5)
+
+    plans = query_plans(db_engine, scenario)
+    assert_searches(plans, "summaries", "ix_summaries_subscription_id_created_at")
+    assert_searches(plans, "summaries_archive", "ix_summaries_archive_subscription_id_created_at_summary_id")
+
+
+def test_due_scheduled_jobs_use_index(db_engine):
+    async def scenario(db):
+        await database.get_due_jobs(db, datetime.utcnow(), 10)
+
+    plans = query_plans(db_engine, scenario)
+    assert_searches(plans, "scheduled_jobs", "ix_scheduled_jobs_next_run_at")
+
+
+def test_summary_job_queries_use_indexes(db_engine):
+    async def scenario(db):
+        user = await database.get_or_create_user(db, 1, "Тест")
+        await database.enqueue_summary_job(db, user.id, 1)
+
+    plans = query_plans(db_engine, scenario)
+    assert_searches(plans, "summary_jobs", "ix_summary_jobs_user_id_kind_status")
+
+
+def test_job_claim_uses_indexes(db_engine):
+    async def scenario(db):
+        await database.lease_summary_jobs(db, 10, 60)
+
+    plans = query_plans(db_engine, scenario)
+    assert_searches(plans, "summary_jobs", "ix_summary_jobs_status_")
+    indexes = {step.split("INDEX ")[1].split()[0] for plan in plans.values() for step in plan}
+    assert indexes == {"ix_summary_jobs_status_available_at", "ix_summary_jobs_status_lease_until"}
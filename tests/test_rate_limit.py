@@ -0,0 +1,103 @@
+import asyncio
+
+import pytest
+
+from telethon.errors import FloodWaitError
+from telethon.sessions import MemorySession
+from telethon.tl.functions.help import GetConfigRequest, GetNearestDcRequest
+
+from src.utils import rate_limit
+from src.utils.rate_limit import MTProtoRateLimiter, RateLimitedTelegramClient
+
+
+class FloodingSender:
+    """Отправитель, который отвечает FloodWait на первые запросы"""
+
+    def __init__(self, floods: int, seconds: int):
+        self.floods = floods
+        self.seconds = seconds
+        self.sent = 0
+
+    def send(self, request, ordered=False):
+        self.sent += 1
+        future = asyncio.get_event_loop().create_future()
+        if self.sent <= self.floods:
+            future.set_exception(FloodWaitError(request=request, capture=self.seconds))
+        else:
+            future.set_result(request)
+        return future
+
+
+class RecordingRateLimiter(MTProtoRateLimiter):
+    def __init__(self):
+        super().__init__()
+        self.flood_waits = []
+
+    def on_flood_wait(self, method: str, seconds: int, pause: bool = True):
+        self.flood_waits.append((method, seconds))
+        super().on_flood_wait(method, seconds, pause)
+
+
+def test_flood_wait_goes_through_rate_limiter():
+    async def scenario():
+        limiter = RecordingRateLimiter()
+        client = RateLimitedTelegramClient(MemorySession(), 1, "hash", rate_limiter=limiter)
+        sender = FloodingSender(floods=1, seconds=1)
+        client._sender = sender
+
+        request = GetConfigRequest()
+        assert await client(request) is request
+        return limiter, sender
+
+    limiter, sender = asyncio.run(scenario())
+
+    # Короткий FloodWait не проглатывается Telethon, а приостанавливает весь ограничитель
+    assert limiter.flood_waits == [("GetConfigRequest", 1)]
+    assert sender.sent == 2
+
+
+def test_long_flood_wait_only_slows_down_its_method(monkeypatch):
+    monkeypatch.setattr(rate_limit, "MTPROTO_MAX_FLOOD_WAIT", 60)
+
+    async def scenario():
+        limiter = RecordingRateLimiter()
+        client = RateLimitedTelegramClient(MemorySession(), 1, "hash", rate_limiter=limiter)
+        client._sender = FloodingSender(floods=1, seconds=3600)
+
+        with pytest.raises(FloodWaitError):
+            await client(GetConfigRequest())
+
+        # Другие методы не ждут чужой FloodWait
+        loop = asyncio.get_event_loop()
+        started = loop.time()
+        request = GetNearestDcRequest()
+        assert await client(request) is request
+        return limiter, loop.time() - started
+
+    limiter, elapsed = asyncio.run(scenario())
+
+    assert limiter.flood_waits == [("GetConfigRequest", 3600)]
+    assert limiter.rates["GetConfigRequest"] < limiter.max_rate
+    assert elapsed < 1
+
+
+def test_reconnect_handlers_run_after_auto_reconnect():
+    async def scenario():
+        client = RateLimitedTelegramClient(MemorySession(), 1, "hash")
+        calls = []
+
+        async def failing():
+            raise RuntimeError("сбой обработчика")
+
+        async def handler():
+            calls.append("переподключен")
+
+        client.add_reconnect_handler(failing)
+        client.add_reconnect_handler(handler)
+        await asyncio.wait_for(client._handle_auto_reconnect(), 1)
+        client.remove_reconnect_handler(handler)
+        await asyncio.wait_for(client._handle_auto_reconnect(), 1)
+        return calls
+
+    # Ошибка одного обработчика не мешает остальным
+    assert asyncio.run(scenario()) == ["переподключен"]
@@ -0,0 +1,143 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from sqlalchemy import select
+
+from src import database
+from src.models import ScheduledJob, SummaryJob
+from src.utils import scheduler
+from src.utils.scheduler import SchedulerManager
+
+
+class FakeSummaryJobs:
+    def __init__(self):
+        self.notified = 0
+
+    def notify(self):
+        self.notified += 1
+
+
+class FakeTelegramClient:
+    def __init__(self):
+        self.summary_jobs = FakeSummaryJobs()
+
+
+async def _users_with_jobs(run_times):
+    """Создает пользователей с ежедневной доставкой и задает время их следующей доставки"""
+    user_ids = []
+    async with database.get_session() as db:
+        for telegram_id, run_at in enumerate(run_times, start=1):
+            user = await database.get_or_create_user(db, telegram_id, "Тест")
+            await database.update_user_settings(db, user.id, delivery_time="09:00", delivery_frequency="daily")
+            job = await db.get(ScheduledJob, user.id)
+            job.next_run_at = run_at
+            user_ids.append(user.id)
+        await db.commit()
+    return user_ids
+
+
+async def _summary_jobs():
+    async with database.get_session() as db:
+        return [(job.user_id, job.kind, job.deliver_at) for job in await db.scalars(select(SummaryJob))]
+
+
+def test_due_jobs_are_claimed_and_rescheduled(db_engine, monkeypatch):
+    monkeypatch.setattr(scheduler, "SCHEDULER_HORIZON", 60)
+
+    async def scenario():
+        now = datetime.utcnow().replace(microsecond=0)
+        due, soon, later = await _users_with_jobs(
+            [now - timedelta(seconds=1), now + timedelta(seconds=30), now + timedelta(hours=1)]
+        )
+        manager = SchedulerManager(FakeTelegramClient())
+
+        async with database.get_session() as db:
+            await manager._load_due_jobs(db, now)
+            # В очередь в памяти попадают только задачи в пределах горизонта
+            assert [user_id for _, _, user_id in manager._heap] == [due, soon]
+
+            assert await manager._claim_due(db, now) == 1
+            assert await _summary_jobs() == [(due, "scheduled", now - timedelta(seconds=1))]
+            assert [user_id for _, _, user_id in manager._heap] == [soon]
+
+            job = await db.get(ScheduledJob, due)
+            await db.refresh(job)
+            assert job.next_run_at > now
+
+            assert await manager._claim_due(db, now + timedelta(seconds=30)) == 1
+            assert len(await _summary_jobs()) == 2
+
+    asyncio.run(scenario())
+
+
+def test_rescheduled_job_is_not_claimed_at_old_time(db_engine):
+    async def scenario():
+        now = datetime.utcnow().replace(microsecond=0)
+        [user_id] = await _users_with_jobs([now])
+        manager = SchedulerManager(FakeTelegramClient())
+
+        async with database.get_session() as db:
+            await manager._load_due_jobs(db, now)
+
+            # Пользователь перенес доставку после выборки
+            job = await db.get(ScheduledJob, user_id)
+            job.next_run_at = now + timedelta(hours=3)
+            await db.commit()
+
+            assert await manager._claim_due(db, now) == 0
+            assert await _summary_jobs() == []
+
+    asyncio.run(scenario())
+
+
+def test_full_batch_is_polled_again_immediately(db_engine, monkeypatch):
+    monkeypatch.setattr(scheduler, "SCHEDULER_BATCH_SIZE", 2)
+
+    async def scenario():
+        now = datetime.utcnow().replace(microsecond=0)
+        await _users_with_jobs([now - timedelta(seconds=3), now - timedelta(seconds=2), now - timedelta(seconds=1)])
+        manager = SchedulerManager(FakeTelegramClient())
+        manager._next_poll = now + timedelta(seconds=5)
+
+        async with database.get_session() as db:
+            await manager._load_due_jobs(db, now)
+            assert len(manager._heap) == 2
+
+            assert await manager._claim_due(db, now) == 2
+            assert manager._next_poll == now
+
+            await manager._load_due_jobs(db, now)
+            assert await manager._claim_due(db, now) == 1
+
+        assert len(await _summary_jobs()) == 3
+
+    asyncio.run(scenario())
+
+
+def test_prepare_offset_is_stable_and_within_jitter(monkeypatch):
+    monkeypatch.setattr(scheduler, "DELIVERY_PREPARE_JITTER", 600)
+
+    offsets = [SchedulerManager._prepare_offset(user_id) for user_id in range(1, 50)]
+
+    assert offsets == [SchedulerManager._prepare_offset(user_id) for user_id in range(1, 50)]
+    assert all(0 <= offset < 600 for offset in offsets)
+    assert len(set(offsets)) > 1
+
+
+def test_running_scheduler_queues_due_summary(db_engine):
+    async def scenario():
+        [user_id] = await _users_with_jobs([datetime.utcnow() - timedelta(seconds=1)])
+        client = FakeTelegramClient()
+        manager = SchedulerManager(client)
+
+        manager.start()
+        for _ in range(50):
+            await asyncio.sleep(0.02)
+            if client.summary_jobs.notified:
+                break
+        await manager.stop()
+
+        assert client.summary_jobs.notified == 1
+        assert [job[0] for job in await _summary_jobs()] == [user_id]
+
+    asyncio.run(scenario())
@@ -0,0 +1,34 @@
+import asyncio
+from types import SimpleNamespace
+
+from src.utils.senders import _fetch_sender_names
+
+
+class PartlyDeletedClient:
+    """Клиент, у которого одна из сущностей недоступна"""
+
+    def __init__(self, names, deleted):
+        self.names = names
+        self.deleted = deleted
+
+    async def get_entity(self, entity):
+        if isinstance(entity, list):
+            return [await self.get_entity(entity_id) for entity_id in entity]
+        if entity in self.deleted:
+            raise ValueError(f"Could not find the input entity for {entity}")
+        return SimpleNamespace(first_name=self.names[entity], last_name=None)
+
+
+def test_batch_failure_falls_back_to_single_lookups():
+    client = PartlyDeletedClient({1: "Анна", 3: "Борис"}, deleted={2})
+
+    names = asyncio.run(_fetch_sender_names(client, [1, 2, 3]))
+
+    # Без имени остается только недоступный отправитель
+    assert names == {1: "Анна", 3: "Борис"}
+
+
+def test_batch_lookup_returns_all_names():
+    client = PartlyDeletedClient({1: "Анна", 2: "Вера"}, deleted=set())
+
+    assert asyncio.run(_fetch_sender_names(client, [1, 2])) == {1: "Анна", 2: "Вера"}
@@ -0,0 +1,100 @@
+import asyncio
+import json
+
+from src.utils import summarizer
+from src.utils.summarizer import STATE_SECTION_ITEMS, parse_incremental_response, summarize_incremental
+from src.utils.transcript import Transcript
+
+
+def test_parses_response_wrapped_in_markup():
+    response = '```json\n{"digest": " Итоги ", "topics": ["релиз", " "], "announcements": "созвон в 12"}\n```'
+
+    digest, state = parse_incremental_response(response)
+
+    assert digest == "Итоги"
+    assert json.loads(state) == {"topics": ["релиз"], "open_discussions": [], "announcements": ["созвон в 12"]}
+
+
+def test_state_sections_are_capped():
+    response = json.dumps({"digest": "Итоги", "topics": [f"тема {i}" for i in range(STATE_SECTION_ITEMS + 3)]})
+
+    _, state = parse_incremental_response(response)
+
+    assert len(json.loads(state)["topics"]) == STATE_SECTION_ITEMS
+
+
+def test_malformed_response_is_kept_as_digest():
+    for response in ("Просто текст саммари", '{"digest": "Итоги", "topics": [', '{"topics": ["релиз"]}',
+                     '{"digest": ""}', '{"digest": ["Итоги"]}', '["digest"]'):
+        assert parse_incremental_response(f" {response} ") == (response, None)
+
+
+def test_state_cannot_inject_messages(monkeypatch):
+    prompts = []
+
+    async def complete(prompt, model, max_tokens=None):
+        prompts.append(prompt)
+        return "{}"
+
+    monkeypatch.setattr(summarizer, "complete", complete)
+    state = json.dumps({"topics": ["обсуждали шаблон {messages} и {state}"]})
+
+    asyncio.run(summarize_incremental(Transcript("Участники: A - Анна\n", ["A: новое\n"]), state, None))
+
+    assert "обсуждали шаблон {messages} и {state}" in prompts[0]
+    assert prompts[0].count("A: новое") == 1
+
+
+def _fake_model(monkeypatch, chunk_budget, partials_budget=None):
+    """Подменяет запросы к модели: ответ - тип запроса и номер вызова"""
+    calls = []
+    kinds = {summarizer.MAP_PROMPT: "map", summarizer.MERGE_PROMPT: "merge", summarizer.REDUCE_PROMPT: "reduce"}
+
+    async def complete(prompt, model, max_tokens=None, on_text=None):
+        calls.append(next(kind for template, kind in kinds.items() if prompt.startswith(template.split("\n")[0])))
+        return f"{calls[-1]} {len(calls)}"
+
+    async def summarize_text(text, model, on_text=None):
+        calls.append("single")
+        return "single"
+
+    def get_chunk_budget(model, prompt, output_tokens):
+        if prompt.startswith((summarizer.MERGE_PROMPT, summarizer.REDUCE_PROMPT)):
+            return partials_budget or chunk_budget
+        return chunk_budget
+
+    monkeypatch.setattr(summarizer, "complete", complete)
+    monkeypatch.setattr(summarizer, "summarize_text", summarize_text)
+    monkeypatch.setattr(summarizer, "get_chunk_budget", get_chunk_budget)
+    return calls
+
+
+def test_small_transcript_is_summarized_in_one_request(monkeypatch):
+    calls = _fake_model(monkeypatch, chunk_budget=1000)
+
+    result = asyncio.run(summarizer.summarize_messages(Transcript("", ["A: привет\n"] * 5)))
+
+    assert (result, calls) == ("single", ["single"])
+
+
+def test_large_transcript_is_mapped_and_reduced(monkeypatch):
+    calls = _fake_model(monkeypatch, chunk_budget=30, partials_budget=1000)
+    lines = [f"A: сообщение номер {index}\n" for index in range(40)]
+
+    result = asyncio.run(summarizer.summarize_messages(Transcript("", lines)))
+
+    maps = calls.count("map")
+    assert maps > 1
+    assert calls == ["map"] * maps + ["reduce"] and result == f"reduce {maps + 1}"
+
+
+def test_partials_over_budget_are_merged_before_reduce(monkeypatch):
+    calls = _fake_model(monkeypatch, chunk_budget=30, partials_budget=8)
+    lines = [f"A: сообщение номер {index}\n" for index in range(40)]
+
+    asyncio.run(summarizer.summarize_messages(Transcript("", lines)))
+
+    maps = calls.count("map")
+    assert calls[:maps] == ["map"] * maps
+    assert calls[maps] == "merge" and set(calls[maps:-1]) == {"merge"}
+    assert calls[-1] == "reduce"
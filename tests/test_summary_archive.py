@@ -0,0 +1,74 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, select
+
+from src import database
+from src.models import ArchivedSummary, Summary
+
+
+async def _add_summaries(subscription_id: int, texts, created_at: datetime):
+    async with database.get_session() as db:
+        for text in texts:
+            db.add(Summary(subscription_id=subscription_id, content=text, created_at=created_at, model_used="m"))
+        await db.commit()
+
+
+def test_archive_after_summary_ids_are_reused(db_engine):
+    """Саммари с ID, повторно выданными после опустошения таблицы, не теряются при переносе в архив"""
+    async def scenario():
+        async with database.get_session() as db:
+            user = await database.get_or_create_user(db, 1, "Тест")
+            subscription = await database.subscribe_to_chat(db, user.id, 100, "Чат")
+
+        now = datetime.utcnow()
+        await _add_summaries(subscription.id, ["старое 1", "старое 2", "старое 3"], now - timedelta(days=60))
+        async with database.get_session() as db:
+            assert await database.archive_summaries(db, now - timedelta(days=30), 100) == 3
+            assert await db.scalar(select(func.count(Summary.id))) == 0
+
+        # Таблица пуста, поэтому SQLite снова выдает ID начиная с 1
+        await _add_summaries(subscription.id, ["новое 1", "новое 2"], now - timedelta(days=40))
+        async with database.get_session() as db:
+            assert set(await db.scalars(select(Summary.id))) == {1, 2}
+            assert await database.archive_summaries(db, now - timedelta(days=30), 100) == 2
+
+        async with database.get_session() as db:
+            archived = (await db.scalars(select(ArchivedSummary).order_by(ArchivedSummary.id))).all()
+            history = await database.get_summary_history(db, subscription.id, None, 10)
+
+        assert [summary.text for summary in archived] == ["старое 1", "старое 2", "старое 3", "новое 1", "новое 2"]
+        assert [summary.summary_id for summary in archived] == [1, 2, 3, 1, 2]
+        assert sorted(summary.text for summary in history) == sorted(summary.text for summary in archived)
+
+    asyncio.run(scenario())
+
+
+def test_history_pages_across_archive_with_equal_timestamps(db_engine):
+    """Страницы истории не пропускают и не повторяют саммари с одинаковым временем в обеих таблицах"""
+    async def scenario():
+        async with database.get_session() as db:
+            user = await database.get_or_create_user(db, 1, "Тест")
+            subscription = await database.subscribe_to_chat(db, user.id, 100, "Чат")
+
+        created_at = datetime.utcnow() - timedelta(days=60)
+        await _add_summaries(subscription.id, [f"саммари {i}" for i in range(1, 6)], created_at)
+        async with database.get_session() as db:
+            # В архив уходят саммари 1-3, их ID в архиве не совпадают с ID в summaries
+            db.add(ArchivedSummary(summary_id=100, subscription_id=subscription.id + 1, content=b"", created_at=created_at))
+            await db.commit()
+            assert await database.archive_summaries(db, datetime.utcnow(), 3) == 3
+
+        pages = []
+        before = None
+        async with database.get_session() as db:
+            while True:
+                page = await database.get_summary_history(db, subscription.id, before, 2)
+                if not page:
+                    break
+                pages.append([summary.text for summary in page])
+                before = database.summary_history_key(page[-1])
+
+        assert pages == [["саммари 5", "саммари 4"], ["саммари 3", "саммари 2"], ["саммари 1"]]
+
+    asyncio.run(scenario())
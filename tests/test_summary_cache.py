@@ -0,0 +1,73 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from sqlalchemy import select
+
+from src import database
+from src.models import SummaryCacheEntry
+from src.utils import summarizer
+from src.utils.summarizer import get_summary_cache_key
+
+
+def test_cache_key_depends_on_window_model_variant_and_prompt(monkeypatch):
+    key = get_summary_cache_key(100, 1, 50, "m")
+
+    assert key == get_summary_cache_key(100, 1, 50, "m", "")
+    assert len({
+        key,
+        get_summary_cache_key("@chat", 1, 50, "m"),
+        get_summary_cache_key(100, 2, 50, "m"),
+        get_summary_cache_key(100, 1, 51, "m"),
+        get_summary_cache_key(100, 1, 50, "other"),
+        get_summary_cache_key(100, 1, 50, "m", "dedupe"),
+        get_summary_cache_key(100, 1, 50, "m", "incremental"),
+    }) == 7
+
+    # Новая версия промпта не должна отдавать саммари, сгенерированные по старому
+    monkeypatch.setattr(summarizer, "PROMPT_VERSION", summarizer.PROMPT_VERSION + 1)
+    assert get_summary_cache_key(100, 1, 50, "m") != key
+
+
+def test_cache_returns_saved_summary_until_it_expires(db_engine, monkeypatch):
+    monkeypatch.setattr(database, "SUMMARY_CACHE_TTL", 3600)
+
+    async def scenario():
+        async with database.get_session() as db:
+            await database.save_cached_summary(db, "fresh", "свежее", "m")
+            await database.save_cached_summary(db, "old", "старое", "m")
+            entry = await db.get(SummaryCacheEntry, "old")
+            entry.created_at = datetime.utcnow() - timedelta(hours=2)
+            await db.commit()
+
+        async with database.get_session() as db:
+            assert await database.get_cached_summary(db, "fresh") == "свежее"
+            assert await database.get_cached_summary(db, "old") is None
+            assert await database.get_cached_summary(db, "missing") is None
+
+            # Устаревшие записи удаляются при следующем сохранении
+            await database.save_cached_summary(db, "next", "следующее", "m")
+            assert set(await db.scalars(select(SummaryCacheEntry.key))) == {"fresh", "next"}
+
+    asyncio.run(scenario())
+
+
+def test_cache_evicts_least_recently_used_entries(db_engine, monkeypatch):
+    monkeypatch.setattr(database, "SUMMARY_CACHE_MAX_ENTRIES", 2)
+
+    async def scenario():
+        start = datetime.utcnow() - timedelta(minutes=10)
+        async with database.get_session() as db:
+            await database.save_cached_summary(db, "a", "A", "m")
+            await database.save_cached_summary(db, "b", "B", "m")
+            for minutes, key in enumerate(("a", "b")):
+                entry = await db.get(SummaryCacheEntry, key)
+                entry.last_used_at = start + timedelta(minutes=minutes)
+            await db.commit()
+
+            # Чтение обновляет время использования, поэтому вытесняется "b", а не "a"
+            assert await database.get_cached_summary(db, "a") == "A"
+            await database.save_cached_summary(db, "c", "C", "m")
+
+            assert set(await db.scalars(select(SummaryCacheEntry.key))) == {"a", "c"}
+
+    asyncio.run(scenario())
@@ -0,0 +1,30 @@
+import asyncio
+import gc
+
+from src import database, telegram_client
+
+
+def test_user_semaphore_is_dropped_after_summaries(db_engine, monkeypatch):
+    held = []
+
+    async def summarize(client, subscription, *args):
+        held.extend(telegram_client._user_semaphores)
+        return telegram_client._Replies([(f"Саммари {subscription.chat_title}", None)])
+
+    monkeypatch.setattr(telegram_client, "_summarize_subscription", summarize)
+
+    async def scenario():
+        async with database.get_session() as db:
+            user = await database.get_or_create_user(db, 1, "Тест")
+            await database.subscribe_to_chat(db, user.id, -1, "Чат")
+        async with database.get_session() as db:
+            [user] = await database.get_summary_users(db, [user.id])
+
+        await telegram_client.generate_and_send_summaries(None, user)
+        gc.collect()
+        return user.id
+
+    user_id = asyncio.run(scenario())
+    # Семафор пользователя есть, пока обрабатываются его чаты, и удаляется после
+    assert held == [user_id]
+    assert user_id not in telegram_client._user_semaphores
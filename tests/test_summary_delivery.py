@@ -0,0 +1,232 @@
+import asyncio
+
+import pytest
+
+from src import database, telegram_client
+from src.models import ChatSubscription
+from src.utils.ingestion import IngestionState
+from src.utils.openrouter import OpenRouterError
+from src.utils.transcript import Transcript
+
+
+class ManualDeliveryQueue:
+    """Очередь доставки, сообщения которой доставляет сам тест"""
+
+    def __init__(self):
+        self.futures = []
+
+    def enqueue(self, entity, text, parse_mode=None, not_before=None):
+        future = asyncio.get_event_loop().create_future()
+        self.futures.append((text, future))
+        return future
+
+
+async def _subscribed_user():
+    async with database.get_session() as db:
+        user = await database.get_or_create_user(db, 1, "Тест")
+        await database.subscribe_to_chat(db, user.id, -100, "Чат")
+    async with database.get_session() as db:
+        [user] = await database.get_summary_users(db, [user.id])
+    return user
+
+
+def _window(monkeypatch, summarize):
+    """Подменяет загрузку окна из трех сообщений и генерацию его саммари"""
+    async def fetch_window(client, db, subscription, message_sync=None, stages=None):
+        state = IngestionState(subscription.last_processed_message_id)
+        state.first_id, state.last_id, state.count = 1, 3, 3
+        return state, Transcript("Участники: A - Анна\n", ["A: привет\n"])
+
+    monkeypatch.setattr(telegram_client, "_fetch_window", fetch_window)
+    monkeypatch.setattr(telegram_client, "_summarize_window", summarize)
+
+
+async def _last_processed(subscription_id):
+    async with database.get_session() as db:
+        return (await db.get(ChatSubscription, subscription_id)).last_processed_message_id
+
+
+def test_window_advances_only_after_delivery(db_engine, monkeypatch):
+    async def summarize(subscription, state, transcript, model, *args, **kwargs):
+        return "Итоги", model
+
+    _window(monkeypatch, summarize)
+
+    async def scenario():
+        user = await _subscribed_user()
+        queue = ManualDeliveryQueue()
+
+        # Задача завершается, как только саммари поставлено в очередь доставки
+        await asyncio.wait_for(telegram_client.generate_and_send_chat_summaries(None, [user], queue), 1)
+        [(text, future)] = queue.futures
+        assert "Итоги" in text
+        await asyncio.sleep(0.05)
+        assert await _last_processed(user.chats[0].id) is None
+
+        future.set_result(None)
+        await asyncio.gather(*telegram_client._delivery_tasks)
+        assert await _last_processed(user.chats[0].id) == 3
+
+    asyncio.run(scenario())
+
+
+def test_undelivered_summary_keeps_window(db_engine, monkeypatch):
+    async def summarize(subscription, state, transcript, model, *args, **kwargs):
+        return "Итоги", model
+
+    _window(monkeypatch, summarize)
+
+    async def scenario():
+        user = await _subscribed_user()
+        queue = ManualDeliveryQueue()
+        await telegram_client.generate_and_send_chat_summaries(None, [user], queue)
+
+        [(_, future)] = queue.futures
+        future.set_exception(RuntimeError("бот заблокирован"))
+        await asyncio.gather(*telegram_client._delivery_tasks)
+        assert await _last_processed(user.chats[0].id) is None
+
+    asyncio.run(scenario())
+
+
+def test_retryable_model_error_reaches_job_queue(db_engine, monkeypatch):
+    async def summarize(subscription, state, transcript, model, *args, **kwargs):
+        raise OpenRouterError(503, "перегружено")
+
+    _window(monkeypatch, summarize)
+
+    async def scenario(retry_failures):
+        user = await _subscribed_user()
+        queue = ManualDeliveryQueue()
+        await telegram_client.generate_and_send_chat_summaries(None, [user], queue, retry_failures=retry_failures)
+        return [text for text, _ in queue.futures]
+
+    with pytest.raises(OpenRouterError):
+        asyncio.run(scenario(retry_failures=True))
+
+    # На последней попытке ошибка становится ответом пользователю
+    [text] = asyncio.run(scenario(retry_failures=False))
+    assert text.startswith("❌ Саммари чата Чат не готово")
+
+
+class RecordingBot:
+    def __init__(self):
+        self.texts = []
+
+    async def send_message(self, entity, text, parse_mode=None):
+        self.texts.append(text)
+
+
+def test_manual_summary_is_retried_for_failed_chat_only(db_engine, monkeypatch):
+    failing_chats = {"Сбойный"}
+
+    async def summarize(subscription, state, transcript, model, *args, **kwargs):
+        if subscription.chat_title in failing_chats:
+            raise OpenRouterError(None, "обрыв соединения")
+        return f"Итоги {subscription.chat_title}", model
+
+    _window(monkeypatch, summarize)
+
+    async def fetch_window(client, db, subscription, message_sync=None, stages=None):
+        state = IngestionState(subscription.last_processed_message_id)
+        if subscription.last_processed_message_id is None:
+            state.first_id, state.last_id, state.count = 1, 3, 3
+        return state, Transcript("Участники: A - Анна\n", ["A: привет\n"])
+
+    monkeypatch.setattr(telegram_client, "_fetch_window", fetch_window)
+
+    async def run(bot, **kwargs):
+        async with database.get_session() as db:
+            [user] = await database.get_summary_users(db, [1])
+        await telegram_client.generate_and_send_summaries(None, user, bot, 1, **kwargs)
+
+    async def scenario():
+        async with database.get_session() as db:
+            user = await database.get_or_create_user(db, 1, "Тест")
+            await database.subscribe_to_chat(db, user.id, -100, "Рабочий")
+            failing = await database.subscribe_to_chat(db, user.id, -200, "Сбойный")
+
+        bot = RecordingBot()
+        with pytest.raises(OpenRouterError):
+            await run(bot, retry_failures=True)
+        assert sorted(text[:24] for text in bot.texts) == ["⏳ Саммари чата Сбойный п", "📝 <b>Саммари чата Рабочи"]
+        assert await _last_processed(failing.id) is None
+
+        # При повторе чат, который уже получил саммари, не отвечает "нет новых сообщений"
+        failing_chats.clear()
+        bot.texts.clear()
+        await run(bot, resumed=True)
+        assert len(bot.texts) == 1 and "Итоги Сбойный" in bot.texts[0]
+        assert await _last_processed(failing.id) == 3
+
+    asyncio.run(scenario())
+
+
+def test_subscribers_of_one_window_share_fetch_and_generation(db_engine, monkeypatch):
+    fetched, generated = [], []
+
+    async def summarize(subscription, state, transcript, model, stages, *args, **kwargs):
+        generated.append((model, tuple(stages)))
+        return f"Итоги {model}", model
+
+    _window(monkeypatch, summarize)
+    fetch_window = telegram_client._fetch_window
+
+    async def counting_fetch_window(client, db, subscription, message_sync=None, stages=None):
+        fetched.append(tuple(stages))
+        return await fetch_window(client, db, subscription, message_sync, stages)
+
+    monkeypatch.setattr(telegram_client, "_fetch_window", counting_fetch_window)
+
+    async def scenario():
+        async with database.get_session() as db:
+            for telegram_id, model in ((1, "m1"), (2, "m1"), (3, "m2"), (4, "m1")):
+                user = await database.get_or_create_user(db, telegram_id, "Тест")
+                await database.update_user_settings(db, user.id, openrouter_model=model)
+                subscription = await database.subscribe_to_chat(db, user.id, -100, "Чат")
+                if telegram_id == 4:
+                    await database.set_preprocessing_stages(db, subscription.id, ["service"])
+            await db.commit()
+        async with database.get_session() as db:
+            users = await database.get_summary_users(db, [1, 2, 3, 4])
+
+        queue = ManualDeliveryQueue()
+        await telegram_client.generate_and_send_chat_summaries(None, users, queue)
+        return [text for text, _ in queue.futures]
+
+    texts = asyncio.run(scenario())
+
+    # Окно с одинаковыми этапами загружается один раз и саммаризируется один раз на модель;
+    # подписка с другими этапами предобработки обрабатывается отдельно
+    default_stages = tuple(telegram_client.parse_stages(None))
+    assert sorted(fetched) == sorted([default_stages, ("service",)])
+    assert sorted(generated) == sorted([("m1", default_stages), ("m2", default_stages), ("m1", ("service",))])
+    assert len(texts) == 4
+    assert sum("Итоги m1" in text for text in texts) == 3
+
+
+def test_subscribers_at_different_positions_do_not_share_window(db_engine, monkeypatch):
+    windows = []
+
+    async def summarize(subscription, state, transcript, model, *args, **kwargs):
+        windows.append(subscription.last_processed_message_id)
+        return "Итоги", model
+
+    _window(monkeypatch, summarize)
+
+    async def scenario():
+        async with database.get_session() as db:
+            for telegram_id in (1, 2):
+                user = await database.get_or_create_user(db, telegram_id, "Тест")
+                subscription = await database.subscribe_to_chat(db, user.id, -100, "Чат")
+            subscription.last_processed_message_id = 10
+            await db.merge(subscription)
+            await db.commit()
+        async with database.get_session() as db:
+            users = await database.get_summary_users(db, [1, 2])
+
+        await telegram_client.generate_and_send_chat_summaries(None, users, ManualDeliveryQueue())
+
+    asyncio.run(scenario())
+
+    assert sorted(windows, key=str) == sorted([None, 10], key=str)
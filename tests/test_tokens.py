@@ -0,0 +1,85 @@
+from src.config import AUTO_MODEL, DEFAULT_OPENROUTER_MODEL
+from src.utils.tokens import (
+    approximate_bpe_tokens,
+    estimate_tokens,
+    fits_context,
+    get_input_budget,
+    get_model_info,
+    split_to_budget,
+    trim_to_budget,
+)
+
+
+def test_estimator_counts_words_numbers_and_symbols():
+    # Латиница - токен на 4 буквы, кириллица - на 3, числа - по 3 цифры, символы - по токену
+    assert approximate_bpe_tokens("hello") == 2
+    assert approximate_bpe_tokens("привет") == 2
+    assert approximate_bpe_tokens("1234567") == 3
+    assert approximate_bpe_tokens("a, b!") == 4
+    assert approximate_bpe_tokens("") == 0
+
+
+def test_estimator_grows_with_text():
+    text = "Созвон перенесли на 15:30, ссылка в закрепе"
+
+    assert estimate_tokens(text * 2) == 2 * estimate_tokens(text)
+
+
+def test_input_budget_reserves_prompt_output_and_margin():
+    empty = get_input_budget(DEFAULT_OPENROUTER_MODEL, "", 1000)
+
+    # 90% контекста 8192 токенов за вычетом ответа
+    assert empty == int(8192 * 0.9) - 1000
+    assert get_input_budget(DEFAULT_OPENROUTER_MODEL, "привет " * 10, 1000) == empty - 20
+    assert get_input_budget(DEFAULT_OPENROUTER_MODEL, "", 10 ** 6) == int(8192 * 0.9) - 4096
+    assert get_input_budget(DEFAULT_OPENROUTER_MODEL, "слово " * 10000, 1000) == 0
+
+
+def test_auto_and_unknown_models_use_default_limits():
+    assert get_model_info(AUTO_MODEL) == get_model_info(DEFAULT_OPENROUTER_MODEL)
+    assert get_model_info("vendor/unknown") == get_model_info(DEFAULT_OPENROUTER_MODEL)
+
+
+def test_fits_context_matches_budget():
+    budget = get_input_budget(DEFAULT_OPENROUTER_MODEL, "", 1000)
+
+    assert fits_context(DEFAULT_OPENROUTER_MODEL, "1 " * budget, 1000)
+    assert not fits_context(DEFAULT_OPENROUTER_MODEL, "1 " * (budget + 1), 1000)
+
+
+def test_split_keeps_line_boundaries():
+    lines = [f"A: сообщение {index}\n" for index in range(10)]
+
+    chunks = split_to_budget(lines, 15)
+
+    assert len(chunks) > 1
+    assert "".join(chunks) == "".join(lines)
+    assert all(chunk.endswith("\n") for chunk in chunks)
+    assert all(estimate_tokens(chunk) <= 15 for chunk in chunks)
+
+
+def test_split_cuts_oversized_line():
+    line = "слово " * 100
+
+    chunks = split_to_budget(["A: коротко\n", line], 20)
+
+    assert len(chunks) > 2 and chunks[0].startswith("A: коротко\n")
+    assert "".join(chunks) == "A: коротко\n" + line
+    assert all(estimate_tokens(chunk) <= 20 for chunk in chunks)
+
+
+def test_split_of_nothing_is_empty():
+    assert split_to_budget([], 10) == []
+
+
+def test_trim_keeps_the_end():
+    text = "".join(f"сообщение {index}\n" for index in range(50))
+
+    assert trim_to_budget(text, 10 ** 6) == (text, False)
+
+    trimmed, was_trimmed = trim_to_budget(text, 20)
+    assert was_trimmed
+    assert text.endswith(trimmed)
+    assert estimate_tokens(trimmed) <= 20
+    # Следующий символ уже не поместился бы в бюджет
+    assert estimate_tokens(text[len(text) - len(trimmed) - 1:]) > 20
@@ -0,0 +1,46 @@
+from datetime import datetime
+
+from src.utils.preprocessing import TranscriptMessage
+from src.utils.transcript import build_transcript, make_alias
+
+
+def message(message_id, sender_id, name, text, minute=0, reply_to=None):
+    return TranscriptMessage(message_id, datetime(2026, 10, 1, 9, minute), sender_id, name, text, reply_to)
+
+
+def test_aliases_follow_activity():
+    transcript = build_transcript([
+        message(1, 10, "Анна", "привет"),
+        message(2, 20, "Борис", "привет"),
+        message(3, 20, "Борис", "как дела"),
+    ])
+
+    assert transcript.legend.startswith("Участники: A - Борис; B - Анна\n")
+    assert transcript.lines == ["01.10\n09:00 B: привет\n", "A: привет\n", "A: как дела\n"]
+
+
+def test_namesakes_get_separate_aliases():
+    transcript = build_transcript([
+        message(1, 10, "Алексей", "я за"),
+        message(2, 20, "Алексей", "я против"),
+        message(3, 20, "Алексей", "и еще раз против"),
+    ])
+
+    assert transcript.legend.startswith("Участники: A - Алексей (1); B - Алексей (2)\n")
+    assert [line.split(":")[-2][-1] for line in transcript.lines] == ["B", "A", "A"]
+
+
+def test_replies_are_labelled():
+    transcript = build_transcript([
+        message(5, 10, "Анна", "вопрос"),
+        message(6, 20, "Борис", "ответ", minute=1, reply_to=5),
+        message(7, 20, "Борис", "ответ на сообщение вне окна", minute=1, reply_to=1),
+    ])
+
+    assert transcript.lines[0].endswith("[1] B: вопрос\n")
+    assert transcript.lines[1] == "09:01 A↩1: ответ\n"
+    assert transcript.lines[2] == "A: ответ на сообщение вне окна\n"
+
+
+def test_make_alias_wraps_after_alphabet():
+    assert [make_alias(index) for index in (0, 25, 26, 27)] == ["A", "Z", "A1", "B1"]
@@ -0,0 +1,123 @@
+import asyncio
+
+from sqlalchemy import select
+
+from src import database
+from src.models import User
+from src.utils import user_cache as user_cache_module
+from src.utils.user_cache import UserCache
+
+
+async def _stored_names():
+    async with database.get_session() as db:
+        return {user.telegram_id: user.first_name for user in await db.scalars(select(User))}
+
+
+async def _get(cache, telegram_id, first_name):
+    async with database.get_session() as db:
+        return await cache.get_user(db, telegram_id, first_name)
+
+
+def test_cached_user_is_served_without_database(db_engine):
+    async def scenario():
+        cache = UserCache()
+        user = await _get(cache, 1, "Анна")
+
+        # При попадании в кэш сессия не используется
+        assert await cache.get_user(None, 1, "Анна") is user
+        assert user.settings is not None and user.chats == []
+
+    asyncio.run(scenario())
+
+
+def test_profile_changes_are_written_behind(db_engine):
+    async def scenario():
+        cache = UserCache()
+        await _get(cache, 1, "Анна")
+        await _get(cache, 2, "Борис")
+
+        user = await cache.get_user(None, 1, "Аня")
+        await cache.get_user(None, 1, "Анюта")
+        await cache.get_user(None, 2, "Боря")
+        assert user.first_name == "Анюта"
+        assert await _stored_names() == {1: "Анна", 2: "Борис"}
+
+        # Записывается только последнее значение каждого профиля
+        await cache.flush()
+        assert await _stored_names() == {1: "Анюта", 2: "Боря"}
+        assert cache._pending == {}
+
+    asyncio.run(scenario())
+
+
+def test_failed_flush_keeps_newer_changes(db_engine, monkeypatch):
+    async def scenario():
+        cache = UserCache()
+        user = await _get(cache, 1, "Анна")
+        await cache.get_user(None, 1, "Аня")
+
+        failures = [RuntimeError("база недоступна")]
+        save_user_profiles = user_cache_module.save_user_profiles
+
+        async def failing_save_user_profiles(db, profiles):
+            if failures:
+                # Пока идет запись, профиль успевает измениться еще раз
+                await cache.get_user(None, 1, "Анюта")
+                raise failures.pop()
+            await save_user_profiles(db, profiles)
+
+        monkeypatch.setattr(user_cache_module, "save_user_profiles", failing_save_user_profiles)
+        await cache.flush()
+        assert cache._pending[user.id]["first_name"] == "Анюта"
+
+        await cache.flush()
+        assert await _stored_names() == {1: "Анюта"}
+
+    asyncio.run(scenario())
+
+
+def test_least_recently_used_user_is_evicted(db_engine):
+    async def scenario():
+        cache = UserCache(max_size=2)
+        first = await _get(cache, 1, "Анна")
+        await _get(cache, 2, "Борис")
+        await cache.get_user(None, 1, "Анна")
+        await _get(cache, 3, "Вера")
+
+        assert cache._get(2) is None
+        assert cache._get(1) is first
+        assert set(cache._telegram_ids.values()) == {1, 3}
+
+    asyncio.run(scenario())
+
+
+def test_expired_and_invalidated_users_are_reloaded(db_engine):
+    async def scenario():
+        cache = UserCache(ttl=-1)
+        user = await _get(cache, 1, "Анна")
+        assert await _get(cache, 1, "Анна") is not user
+
+        cache = UserCache()
+        user = await _get(cache, 1, "Анна")
+        cache.invalidate(user.id)
+        assert cache._get(1) is None
+        assert (await _get(cache, 1, "Анна")).id == user.id
+
+    asyncio.run(scenario())
+
+
+def test_periodic_flush_and_stop(db_engine):
+    async def scenario():
+        cache = UserCache(flush_interval=0.01)
+        cache.start()
+        await _get(cache, 1, "Анна")
+        await cache.get_user(None, 1, "Аня")
+        await asyncio.sleep(0.1)
+        assert await _stored_names() == {1: "Аня"}
+
+        # Остановка записывает то, что накопилось после последней записи
+        await cache.get_user(None, 1, "Анюта")
+        await cache.stop()
+        assert await _stored_names() == {1: "Анюта"}
+
+    asyncio.run(scenario())
@@ -0,0 +1,64 @@
+import asyncio
+from contextlib import contextmanager
+
+import pytest
+from sqlalchemy import event
+
+from src import database
+
+
+@contextmanager
+def count_statements(engine):
+    """Считает запросы, отправленные в базу внутри блока"""
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine.sync_engine, "before_cursor_execute", record)
+    try:
+        yield statements
+    finally:
+        event.remove(engine.sync_engine, "before_cursor_execute", record)
+
+
+async def create_users(count: int) -> list:
+    """Создает пользователей с двумя активными и одной отключенной подпиской"""
+    user_ids = []
+    async with database.get_session() as db:
+        for telegram_id in range(1, count + 1):
+            user = await database.get_or_create_user(db, telegram_id, f"Пользователь {telegram_id}")
+            for chat_id in range(3):
+                await database.subscribe_to_chat(db, user.id, -chat_id - 1, f"Чат {chat_id}")
+            await database.unsubscribe_from_chat(db, user.id, -3)
+            user_ids.append(user.id)
+    return user_ids
+
+
+@pytest.mark.parametrize("count", [1, 10])
+def test_summary_users_take_two_statements(db_engine, count):
+    async def scenario():
+        user_ids = await create_users(count)
+        async with database.get_session() as db:
+            with count_statements(db_engine) as statements:
+                users = await database.get_summary_users(db, user_ids)
+                for user in users:
+                    assert user.settings is not None
+                    assert sorted(chat.chat_id for chat in user.chats) == [-2, -1]
+            return len(users), len(statements)
+
+    # Пользователи с настройками и подписки всех пользователей, независимо от их количества
+    assert asyncio.run(scenario()) == (count, 2)
+
+
+def test_active_user_settings_take_one_statement(db_engine):
+    async def scenario():
+        user_ids = await create_users(10)
+        async with database.get_session() as db:
+            with count_statements(db_engine) as statements:
+                settings = await database.get_active_user_settings(db, user_ids)
+                for user_id in user_ids:
+                    assert settings[user_id].user_id == user_id
+            return len(settings), len(statements)
+
+    assert asyncio.run(scenario()) == (10, 1)